@@ -1,35 +1,182 @@
 # Standard Library
+import asyncio
+import contextlib
+import os
 from logging import getLogger
-from logging.config import dictConfig
-from pathlib import Path
+from typing import AsyncIterator
 from typing import List
+from typing import Optional
 
 # Third Party Library
-import yaml
+import anyio
 from fastapi import Depends
 from fastapi import FastAPI
 from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
 from fastapi.security.http import HTTPAuthorizationCredentials
 from fastapi.security.http import HTTPBearer
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import generate_latest
 from pydantic import BaseModel
-
-# if __name__ == "__main__":
-if True:
-    filepath = Path(__file__).parents[1] / "conf" / "logging.yml"
-    with open(file=str(filepath), mode="rt") as f:
-        config_dict = yaml.safe_load(f)
-    dictConfig(config=config_dict)
-    del filepath, config_dict
-
+from pydantic import Field
 
 # Local Library
+from . import db
+from . import leaderboard
+from . import maintenance
+from . import metrics
 from . import model
+from . import presence
+from . import query_stats
 from . import room_model
+from .config import settings
+from .log import setup_logging
+from .log import stop_logging
 from .model import SafeUser
+from .result_writer import ResultWriter
+from .room_state import RoomStateEngine
 
+setup_logging(settings)
 logger = getLogger(__name__)
 
+if settings.db_backend == "sqlite":
+    db.create_tables()
+
 app = FastAPI()
+room_sweeper_task: Optional[asyncio.Task] = None
+presence_monitor_task: Optional[asyncio.Task] = None
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware, routes=app.routes)
+    REGISTRY.register(metrics.RoomCollector(room_model.count_rooms_by_status))
+    REGISTRY.register(metrics.CacheCollector({"user": model.get_user_cache_stats}))
+if settings.query_stats:
+    app.add_middleware(query_stats.QueryStatsMiddleware, budget=settings.query_budget)
+
+
+@app.on_event("startup")
+async def check_pool_size():
+    db.check_pool_size(
+        settings,
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        threads=anyio.to_thread.current_default_thread_limiter().total_tokens,
+    )
+
+
+@app.on_event("startup")
+async def start_room_state_engine():
+    if settings.room_engine != "memory":
+        return
+    if int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+        raise RuntimeError("room_engine=memory keeps the rooms in process and requires a single worker")
+    room_state_engine = RoomStateEngine()
+    await room_state_engine.start()
+    room_model.room_state_engine = room_state_engine
+
+
+@app.on_event("shutdown")
+async def stop_room_state_engine():
+    if room_model.room_state_engine is not None:
+        await room_model.room_state_engine.stop()
+        room_model.room_state_engine = None
+
+
+@app.on_event("startup")
+async def start_result_writer():
+    if not settings.room_end_batching:
+        return
+    if settings.room_engine != "database":
+        raise RuntimeError("room_end_batching requires room_engine=database (room_engine=memory already writes behind)")
+    room_result_writer = ResultWriter(
+        batch_size=settings.room_end_batch_size,
+        delay=settings.room_end_batch_delay,
+        buffer_size=settings.room_end_buffer_size,
+    )
+    room_result_writer.start()
+    room_model.room_result_writer = room_result_writer
+
+
+@app.on_event("shutdown")
+async def stop_result_writer():
+    if room_model.room_result_writer is not None:
+        await room_model.room_result_writer.stop()
+        room_model.room_result_writer = None
+
+
+@app.on_event("startup")
+async def start_room_sweeper():
+    if not settings.room_sweeper:
+        return
+    if settings.room_engine != "database":
+        raise RuntimeError("room_sweeper deletes room rows and requires room_engine=database")
+    global room_sweeper_task
+    room_sweeper_task = asyncio.create_task(
+        maintenance.run_room_sweeper(
+            period=settings.room_sweep_period,
+            batch_size=settings.room_sweep_batch_size,
+            interval=settings.room_sweep_batch_interval,
+        )
+    )
+
+
+@app.on_event("shutdown")
+async def stop_room_sweeper():
+    global room_sweeper_task
+    if room_sweeper_task is not None:
+        room_sweeper_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await room_sweeper_task
+        room_sweeper_task = None
+
+
+@app.on_event("startup")
+async def start_presence_monitor():
+    if not settings.presence_enabled:
+        return
+    if int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+        raise RuntimeError("presence_enabled keeps the heartbeats in process and requires a single worker")
+    global presence_monitor_task
+    presence.tracker = presence.PresenceTracker()
+    presence_monitor_task = asyncio.create_task(
+        presence.run_presence_monitor(
+            presence.tracker,
+            timeout=settings.presence_timeout,
+            period=settings.presence_check_period,
+            host_handover=settings.presence_host_handover,
+        )
+    )
+
+
+@app.on_event("shutdown")
+async def stop_presence_monitor():
+    global presence_monitor_task
+    if presence_monitor_task is not None:
+        presence_monitor_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await presence_monitor_task
+        presence_monitor_task = None
+        presence.tracker = None
+
+
+@app.on_event("shutdown")
+async def dispose_engine():
+    await db.async_engine.dispose()
+
+
+@app.on_event("shutdown")
+async def flush_logs():
+    stop_logging()
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus text exposition (a sync endpoint: the room gauges are read from the database in the threadpool)"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404)
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
 
 # Sample APIs
 
@@ -52,16 +199,16 @@ class UserCreateResponse(BaseModel):
 
 
 @app.post("/user/create", response_model=UserCreateResponse)
-def user_create(req: UserCreateRequest):
+async def user_create(req: UserCreateRequest):
     """新規ユーザー作成"""
-    token = model.create_user(req.user_name, req.leader_card_id)
+    token = await model.create_user_async(req.user_name, req.leader_card_id)
     return UserCreateResponse(user_token=token)
 
 
 bearer = HTTPBearer()
 
 
-def get_auth_token(cred: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
+async def get_auth_token(cred: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
     assert cred is not None
     if not cred.credentials:
         raise HTTPException(status_code=401, detail="invalid credential")
@@ -69,13 +216,13 @@ def get_auth_token(cred: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
 
 
 @app.get("/user/me", response_model=SafeUser)
-def user_me(token: str = Depends(get_auth_token)):
+async def user_me(token: str = Depends(get_auth_token)):
     try:
-        user: SafeUser = model.get_user_by_token(token)
+        user: SafeUser = await model.get_user_by_token_async(token)
     except HTTPException as e:
-        logger.warning(f"{e=}", exc_info=True)
+        logger.warning("e=%r", e, exc_info=True)
         raise HTTPException(status_code=404)
-    logger.info(f"user_me ({token=}, {user=})")
+    logger.info("user_me (token=%r, user=%r)", token, user)
     return user
 
 
@@ -84,13 +231,20 @@ class EmptyResponse(BaseModel):
 
 
 @app.post("/user/update", response_model=EmptyResponse)
-def user_update(req: UserCreateRequest, token: str = Depends(get_auth_token)):
+async def user_update(req: UserCreateRequest, token: str = Depends(get_auth_token)):
     """Update user attributes"""
-    logger.warning(f"/usr/update : {req=}")
-    model.update_user(token, req.user_name, req.leader_card_id)
+    logger.info("/usr/update : req=%r", req)
+    await model.update_user_async(token, req.user_name, req.leader_card_id)
     return EmptyResponse()
 
 
+@app.get("/user/stats", response_model=room_model.UserPlayStats)
+async def user_stats(token: str = Depends(get_auth_token)):
+    """Play statistics of the user, one row read"""
+    user: SafeUser = await model.get_user_by_token_async(token)
+    return await room_model.get_user_play_stats_async(user.id)
+
+
 class RoomCreateRequest(BaseModel):
     live_id: int
     select_difficulty: room_model.LiveDifficulty
@@ -101,10 +255,10 @@ class RoomCreateResponse(BaseModel):
 
 
 @app.post("/room/create", response_model=RoomCreateResponse)
-def room_create(req: RoomCreateRequest, token: str = Depends(get_auth_token)):
-    room_id: int = room_model.create_room(req.live_id)
-    user: SafeUser = model.get_user_by_token(token)
-    room_model.join_room(
+async def room_create(req: RoomCreateRequest, token: str = Depends(get_auth_token)):
+    room_id: int = await room_model.create_room_async(req.live_id)
+    user: SafeUser = await model.get_user_by_token_async(token)
+    await room_model.join_room_async(
         room_id=room_id,
         user_id=user.id,
         user_name=user.name,
@@ -112,24 +266,52 @@ def room_create(req: RoomCreateRequest, token: str = Depends(get_auth_token)):
         live_difficulty=req.select_difficulty,
         is_host=True,
     )
-    logger.info(f"create room: {room_id=}")
+    presence.touch(room_id, user.id)
+    logger.info("create room: room_id=%r", room_id)
     return RoomCreateResponse(room_id=room_id)
 
 
 class RoomListRequest(BaseModel):
     live_id: int
+    # page size, capped by settings.room_list_max_limit
+    limit: Optional[int] = Field(None, ge=1)
+    order: room_model.RoomListOrder = room_model.RoomListOrder.oldest
+    # `next_cursor` of the previous page
+    cursor: Optional[str] = None
 
 
 class RoomListResponse(BaseModel):
     room_info_list: List[room_model.RoomInfo]
+    # None on the last page
+    next_cursor: Optional[str] = None
 
 
 @app.post("/room/list", response_model=RoomListResponse)
-def room_list(req: RoomListRequest):
-    rooms: List[room_model.RoomInfo] = room_model.get_rooms_by_live_id(req.live_id)
-    logger.info(f"{rooms=}")
-    logger.info(f"{type(rooms)=}")
-    return RoomListResponse(room_info_list=rooms)
+async def room_list(req: RoomListRequest):
+    limit: int = min(req.limit or settings.room_list_default_limit, settings.room_list_max_limit)
+    if settings.fast_response:
+        return await _room_list_fast(req, limit)
+    try:
+        page: room_model.RoomListPage = await room_model.get_room_list_page_async(
+            req.live_id, limit=limit, order=req.order, cursor=req.cursor
+        )
+    except room_model.InvalidCursor as e:
+        logger.warning("e=%r", e)
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    logger.debug("page=%r", page)
+    return RoomListResponse(room_info_list=page.room_info_list, next_cursor=page.next_cursor)
+
+
+async def _room_list_fast(req: RoomListRequest, limit: int) -> ORJSONResponse:
+    # returning a Response skips the response_model validation, the records already have its shape
+    try:
+        page: room_model.RoomListPageRecord = await room_model.get_room_list_page_record_async(
+            req.live_id, limit=limit, order=req.order, cursor=req.cursor
+        )
+    except room_model.InvalidCursor as e:
+        logger.warning("e=%r", e)
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return ORJSONResponse(page)
 
 
 class RoomWaitRequest(BaseModel):
@@ -150,13 +332,14 @@ class RoomWaitResponse(BaseModel):
     room_user_list: List[WaitResponseRoomUser]
 
 
-@app.post("/room/wait", response_model=RoomWaitResponse)
-def room_wait(req: RoomWaitRequest, token: str = Depends(get_auth_token)):
-    room_status: room_model.RoomStatus = room_model.get_room_status(room_id=req.room_id)
-    logger.info(f"{room_status=}")
-    user: SafeUser = model.get_user_by_token(token)
-    room_user_list: List[room_model.RoomUser] = room_model.get_room_users(room_id=req.room_id, user_id_req=user.id)
-    logger.info(f"{room_user_list=}")
+async def _get_room_wait_response(room_id: int, user: SafeUser) -> RoomWaitResponse:
+    snapshot: Optional[room_model.RoomSnapshot] = await room_model.get_room_snapshot_async(
+        room_id=room_id, user_id_req=user.id
+    )
+    logger.debug("snapshot=%r", snapshot)
+    if snapshot is None:
+        # the room has been dropped
+        return RoomWaitResponse(status=room_model.WaitRoomStatus.Dissolution, room_user_list=[])
     wait_response_room_user_list: List[WaitResponseRoomUser] = [
         WaitResponseRoomUser(
             user_id=room_user.user_id,
@@ -166,10 +349,71 @@ def room_wait(req: RoomWaitRequest, token: str = Depends(get_auth_token)):
             is_me=room_user.is_me,
             is_host=room_user.is_host,
         )
-        for room_user in room_user_list
+        for room_user in snapshot.room_user_list
     ]
-    logger.info(f"{wait_response_room_user_list=}")
-    return RoomWaitResponse(status=room_status.status, room_user_list=wait_response_room_user_list)
+    logger.debug("wait_response_room_user_list=%r", wait_response_room_user_list)
+    return RoomWaitResponse(status=snapshot.status, room_user_list=wait_response_room_user_list)
+
+
+@app.post("/room/wait", response_model=RoomWaitResponse)
+async def room_wait(req: RoomWaitRequest, token: str = Depends(get_auth_token)):
+    user: SafeUser = await model.get_user_by_token_async(token)
+    if settings.fast_response:
+        record: Optional[room_model.WaitRoomRecord] = await room_model.get_wait_room_record_async(
+            room_id=req.room_id, user_id_req=user.id
+        )
+        if record is None:
+            # the room has been dropped
+            record = room_model.WaitRoomRecord(status=room_model.WaitRoomStatus.Dissolution, room_user_list=[])
+        if record.status == room_model.WaitRoomStatus.Waiting:
+            presence.touch(req.room_id, user.id)
+        return ORJSONResponse(record)
+    response: RoomWaitResponse = await _get_room_wait_response(req.room_id, user)
+    if response.status == room_model.WaitRoomStatus.Waiting:
+        presence.touch(req.room_id, user.id)
+    return response
+
+
+async def _room_wait_events(room_id: int, user: SafeUser) -> AsyncIterator[str]:
+    last_data: Optional[str] = None
+    while True:
+        # subscribe before reading so that a change between the read and the wait is not lost
+        event = room_model.room_wait_notifier.subscribe(room_id)
+        response: RoomWaitResponse = await _get_room_wait_response(room_id, user)
+        if response.status == room_model.WaitRoomStatus.Waiting:
+            # an open stream counts as a heartbeat, refreshed at least every room_wait_stream_keepalive seconds
+            presence.touch(room_id, user.id)
+        data: str = response.json()
+        if data != last_data:
+            yield f"data: {data}\n\n"
+            last_data = data
+        if response.status != room_model.WaitRoomStatus.Waiting:
+            return
+        if not await room_model.room_wait_notifier.wait(event, timeout=settings.room_wait_stream_keepalive):
+            yield ": keep-alive\n\n"
+
+
+@app.post("/room/wait/stream", response_class=StreamingResponse)
+async def room_wait_stream(req: RoomWaitRequest, token: str = Depends(get_auth_token)):
+    """Server-Sent Events version of /room/wait
+
+    Sends the RoomWaitResponse of the room on connect and then whenever it changes (join, leave, start).
+    The stream ends once the status is no longer Waiting.
+    """
+    user: SafeUser = await model.get_user_by_token_async(token)
+    return StreamingResponse(_room_wait_events(req.room_id, user), media_type="text/event-stream")
+
+
+class RoomHeartbeatRequest(BaseModel):
+    room_id: int
+
+
+@app.post("/room/heartbeat", response_model=EmptyResponse)
+async def room_heartbeat(req: RoomHeartbeatRequest, token: str = Depends(get_auth_token)):
+    """keep the seat in a waiting room without polling /room/wait (settings.presence_enabled). No database write."""
+    user: SafeUser = await model.get_user_by_token_async(token)
+    presence.touch(req.room_id, user.id)
+    return EmptyResponse()
 
 
 class RoomJoinRequest(BaseModel):
@@ -182,25 +426,54 @@ class RoomJoinResponse(BaseModel):
 
 
 @app.post("/room/join", response_model=RoomJoinResponse)
-def room_join(req: RoomJoinRequest, token: str = Depends(get_auth_token)):
-    user: SafeUser = model.get_user_by_token(token)
-    join_room_result: room_model.JoinRoomResult = room_model.join_room(
+async def room_join(req: RoomJoinRequest, token: str = Depends(get_auth_token)):
+    user: SafeUser = await model.get_user_by_token_async(token)
+    join_room_result: room_model.JoinRoomResult = await room_model.join_room_async(
         room_id=req.room_id,
         user_id=user.id,
         user_name=user.name,
         leader_card_id=user.leader_card_id,
         live_difficulty=req.select_difficulty,
     )
+    if join_room_result == room_model.JoinRoomResult.Ok:
+        presence.touch(req.room_id, user.id)
     return RoomJoinResponse(join_room_result=join_room_result)
 
 
+class RoomQuickJoinRequest(BaseModel):
+    live_id: int
+    select_difficulty: room_model.LiveDifficulty
+
+
+class RoomQuickJoinResponse(BaseModel):
+    room_id: int
+    is_host: bool  # True if no room was available and a new one has been created
+
+
+@app.post("/room/quick_join", response_model=RoomQuickJoinResponse)
+async def room_quick_join(req: RoomQuickJoinRequest, token: str = Depends(get_auth_token)):
+    """join a free room of the live in one request, creating a room if there is none"""
+    user: SafeUser = await model.get_user_by_token_async(token)
+    room_id, is_host = await room_model.quick_join_room_async(
+        live_id=req.live_id,
+        user_id=user.id,
+        user_name=user.name,
+        leader_card_id=user.leader_card_id,
+        live_difficulty=req.select_difficulty,
+    )
+    presence.touch(room_id, user.id)
+    logger.info("quick join: room_id=%r, is_host=%r", room_id, is_host)
+    return RoomQuickJoinResponse(room_id=room_id, is_host=is_host)
+
+
 class RoomStartRequest(BaseModel):
     room_id: int
 
 
 @app.post("/room/start", response_model=EmptyResponse)
-def room_start(req: RoomStartRequest, token: str = Depends(get_auth_token)):
-    room_model.start_room(req.room_id)
+async def room_start(req: RoomStartRequest, token: str = Depends(get_auth_token)):
+    await room_model.start_room_async(req.room_id)
+    presence.forget_room(req.room_id)
     return EmptyResponse()
 
 
@@ -211,10 +484,10 @@ class RoomEndRequest(BaseModel):
 
 
 @app.post("/room/end", response_model=EmptyResponse)
-def room_end(req: RoomEndRequest, token: str = Depends(get_auth_token)):
+async def room_end(req: RoomEndRequest, token: str = Depends(get_auth_token)):
     if len(req.judge_count_list) != 5:
         raise HTTPException(status_code=400, detail="judge_count_list must be 5")
-    user: SafeUser = model.get_user_by_token(token)
+    user: SafeUser = await model.get_user_by_token_async(token)
     room_user_result: room_model.RoomUserResult = room_model.RoomUserResult(
         room_id=req.room_id,
         user_id=user.id,
@@ -222,12 +495,14 @@ def room_end(req: RoomEndRequest, token: str = Depends(get_auth_token)):
         score=req.score,
         end_playing=True,
     )
-    room_model.finish_playing(room_user_result=room_user_result)
+    await room_model.finish_playing_async(room_user_result=room_user_result)
     return EmptyResponse()
 
 
 class RoomResultRequest(BaseModel):
     room_id: int
+    # long-poll: wait up to this many seconds for all players to finish. None returns immediately.
+    wait_timeout: Optional[float] = Field(None, ge=0)
 
 
 class RoomResultResponse(BaseModel):
@@ -235,8 +510,11 @@ class RoomResultResponse(BaseModel):
 
 
 @app.post("/room/result", response_model=RoomResultResponse)
-def room_result(req: RoomResultRequest):
-    return RoomResultResponse(result_user_list=room_model.get_result_user_list(req.room_id))
+async def room_result(req: RoomResultRequest):
+    if req.wait_timeout is None:
+        return RoomResultResponse(result_user_list=await room_model.get_result_user_list_async(req.room_id))
+    timeout: float = min(req.wait_timeout, settings.room_result_max_wait)
+    return RoomResultResponse(result_user_list=await room_model.wait_result_user_list_async(req.room_id, timeout))
 
 
 class RoomLeaveRequest(BaseModel):
@@ -244,7 +522,60 @@ class RoomLeaveRequest(BaseModel):
 
 
 @app.post("/room/leave", response_model=EmptyResponse)
-def room_leave(req: RoomLeaveRequest, token: str = Depends(get_auth_token)):
-    user: SafeUser = model.get_user_by_token(token)
-    room_model.leave_room(room_id=req.room_id, user_id=user.id)
+async def room_leave(req: RoomLeaveRequest, token: str = Depends(get_auth_token)):
+    user: SafeUser = await model.get_user_by_token_async(token)
+    await room_model.leave_room_async(room_id=req.room_id, user_id=user.id)
+    presence.forget(req.room_id, user.id)
     return EmptyResponse()
+
+
+# Leaderboard APIs
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    user_name: str
+    leader_card_id: int
+    score: int
+
+    class Config:
+        orm_mode = True
+
+
+class LeaderboardTopRequest(BaseModel):
+    live_id: int
+    difficulty: room_model.LiveDifficulty
+    # capped by settings.leaderboard_top_k
+    limit: int = Field(10, ge=1)
+
+
+class LeaderboardTopResponse(BaseModel):
+    entries: List[LeaderboardEntry]
+
+
+@app.post("/leaderboard/top", response_model=LeaderboardTopResponse)
+async def leaderboard_top(req: LeaderboardTopRequest):
+    ranked_scores: List[leaderboard.RankedScore] = await leaderboard.leaderboards.top(
+        req.live_id, int(req.difficulty), req.limit
+    )
+    return LeaderboardTopResponse(entries=[LeaderboardEntry.from_orm(ranked_score) for ranked_score in ranked_scores])
+
+
+class LeaderboardRankRequest(BaseModel):
+    live_id: int
+    difficulty: room_model.LiveDifficulty
+
+
+class LeaderboardRankResponse(BaseModel):
+    # None until the user has finished the live on this difficulty
+    entry: Optional[LeaderboardEntry] = None
+
+
+@app.post("/leaderboard/rank", response_model=LeaderboardRankResponse)
+async def leaderboard_rank(req: LeaderboardRankRequest, token: str = Depends(get_auth_token)):
+    user: SafeUser = await model.get_user_by_token_async(token)
+    ranked_score: Optional[leaderboard.RankedScore] = await leaderboard.leaderboards.rank(
+        req.live_id, int(req.difficulty), user.id
+    )
+    return LeaderboardRankResponse(entry=None if ranked_score is None else LeaderboardEntry.from_orm(ranked_score))
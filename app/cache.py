@@ -0,0 +1,101 @@
+# Standard Library
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+from typing import Generic
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+from typing import Union
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class _Missing:
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    ``ttl=None`` means entries never expire and are only evicted by LRU.
+    The cache is guarded by a lock because the sync model functions may be called from worker threads.
+
+    ``generation`` changes on every invalidation. A reader that takes it before reading the source and passes it to
+    ``set`` does not store a value that an invalidation made during the read has outdated.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float], clock: Callable[[], float] = time.monotonic) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"maxsize must be positive: {maxsize=}")
+        self.maxsize: int = maxsize
+        self.ttl: Optional[float] = ttl
+        self._clock: Callable[[], float] = clock
+        self._data: "OrderedDict[K, Tuple[Optional[float], V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.generation: int = 0
+
+    def get(self, key: K, default=MISSING):
+        """Return the cached value or ``default`` (``MISSING``) when absent or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or self._clock() < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(
+        self, key: K, value: V, ttl: Union[float, None, _Missing] = MISSING, generation: Optional[int] = None
+    ) -> None:
+        """Store ``value``. ``ttl`` overrides the cache-wide TTL for this entry.
+
+        With ``generation``, nothing is stored if the cache has been invalidated since that generation.
+        """
+        if isinstance(ttl, _Missing):
+            ttl = self.ttl
+        expires_at: Optional[float] = None if ttl is None else self._clock() + ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize)
+
+    def __len__(self) -> int:
+        return len(self._data)
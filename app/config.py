@@ -1,7 +1,174 @@
-DATABASE_URI = "mysql://{mysql_user}:{mysql_passwd}@{host}/{mysql_schema}".format(
-    mysql_user="webapp",
-    mysql_passwd="webapp_no_password",
-    # host="172.18.0.2",
-    host="127.0.0.1",
-    mysql_schema="webapp",
-)
+"""Application settings.
+
+Values are resolved in this order (first wins):
+
+1. environment variables prefixed with ``APP_`` (e.g. ``APP_DB_POOL_SIZE=20``)
+2. the profile selected by ``APP_PROFILE`` in ``conf/settings.yml`` (or ``APP_CONFIG_FILE``)
+3. the defaults below
+"""
+
+# Standard Library
+import os
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Literal
+from typing import Optional
+
+# Third Party Library
+import yaml
+from pydantic import BaseSettings
+
+default_config_path: Path = Path(__file__).parents[1] / "conf" / "settings.yml"
+
+
+class Settings(BaseSettings):
+    profile: str = "dev"
+
+    # "mysql": the MySQL server below (schema.sql)
+    # "sqlite": an embedded database created from the table metadata, see app/db.py
+    db_backend: Literal["mysql", "sqlite"] = "mysql"
+    # database file of the sqlite backend. ":memory:" is an ephemeral database removed at exit.
+    sqlite_path: str = ":memory:"
+    # seconds a sqlite transaction waits for the write lock held by another one
+    sqlite_busy_timeout: float = 30.0
+
+    mysql_user: str = "webapp"
+    mysql_password: str = "webapp_no_password"
+    # mysql_host: str = "172.18.0.2"
+    mysql_host: str = "127.0.0.1"
+    mysql_schema: str = "webapp"
+
+    # SQLAlchemy engine / connection pool
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0  # seconds to wait for a connection checkout
+    db_pool_recycle: int = -1  # seconds, -1 disables recycling
+    db_pool_pre_ping: bool = False
+    db_echo: bool = False
+    db_isolation_level: Optional[str] = None  # e.g. "READ COMMITTED", None keeps the server default
+    db_max_connections: int = 151  # MySQL `max_connections`, used by the startup pool check
+
+    # token -> user cache (see model.get_user_by_token)
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 60.0
+    user_cache_negative_ttl: float = 5.0
+
+    # "database": every room operation is a database transaction
+    # "memory": rooms are served by room_state.RoomStateEngine and written behind (single worker only)
+    room_engine: Literal["database", "memory"] = "database"
+
+    # page size of /room/list
+    room_list_default_limit: int = 50
+    room_list_max_limit: int = 100
+
+    # number of finished rooms whose result is kept in memory (see room_model.get_result_user_list)
+    result_cache_size: int = 10000
+
+    # /room/list and /room/wait map rows to plain records encoded by orjson instead of validated pydantic models.
+    # The JSON and the OpenAPI schema are the same.
+    fast_response: bool = False
+
+    # interval of keep-alive comments on /room/wait/stream
+    room_wait_stream_keepalive: float = 15.0
+    # upper bound of RoomResultRequest.wait_timeout
+    room_result_max_wait: float = 30.0
+    # a long-polling /room/result reads again at least this often: the /room/end calls served by other workers
+    # do not wake it up
+    room_result_poll_interval: float = 1.0
+
+    # Abandoned rooms, whose row has not changed for the timeout, are swept by app/maintenance.py:
+    # Waiting -> Dissolution, deleted room_dissolution_grace seconds later. LiveStart -> deleted.
+    # room_sweeper runs the sweep in the API process every room_sweep_period seconds
+    # (database room_engine only, `python -m app.maintenance sweep_rooms --period 30` is the standalone worker).
+    room_sweeper: bool = False
+    room_sweep_period: float = 30.0
+    # rooms per transaction and the pause between two batches, so that the sweep never holds locks for long
+    room_sweep_batch_size: int = 100
+    room_sweep_batch_interval: float = 0.05
+    room_waiting_timeout: float = 600.0
+    # /room/wait refreshes updated_at of a Waiting room at most this often, so that a polled room is not swept
+    # (below room_waiting_timeout)
+    room_wait_touch_interval: float = 60.0
+    room_live_timeout: float = 1800.0
+    room_dissolution_grace: float = 60.0
+
+    # Members of a Waiting room not seen by /room/wait or /room/heartbeat for presence_timeout seconds are removed
+    # through the /room/leave path (see app/presence.py). In-process state: single worker only.
+    presence_enabled: bool = False
+    presence_timeout: float = 30.0
+    presence_check_period: float = 5.0
+    # when the host is evicted, True hands the host role over to another member, False dissolves the room
+    presence_host_handover: bool = True
+
+    # /room/end write coalescing (see app/result_writer.py), room_engine=database only: up to room_end_batch_size
+    # results per transaction, written room_end_batch_delay seconds after the first one at the latest.
+    # Beyond room_end_buffer_size pending results, /room/end waits.
+    room_end_batching: bool = False
+    room_end_batch_size: int = 100
+    room_end_batch_delay: float = 0.005
+    room_end_buffer_size: int = 1000
+
+    # leaderboards (see app/leaderboard.py): best scores kept in memory per board, and boards kept in memory
+    leaderboard_top_k: int = 1000
+    leaderboard_cache_size: int = 1000
+    # seconds a board is served from memory before it is read again: the scores committed by the other workers
+    # show up after at most this long
+    leaderboard_ttl: float = 5.0
+
+    # logging (see app/log.py)
+    log_config_path: Path = Path(__file__).parents[1] / "conf" / "logging.yml"
+    # level of the `app` logger, None keeps the level of log_config_path
+    log_level: Optional[str] = None
+    # hand records to a background thread through an in-memory queue instead of writing them in the caller
+    log_queue: bool = False
+
+    # Prometheus metrics on GET /metrics (see app/metrics.py)
+    metrics_enabled: bool = True
+    # count the statements, transactions and database time of each request and send them back as X-Query-*
+    # response headers (see app/query_stats.py). For development and the tests.
+    query_stats: bool = False
+    # with query_stats, log a warning for the requests running more statements than this
+    query_budget: Optional[int] = None
+
+    class Config:
+        env_prefix = "APP_"
+        # APP_PROFILE selects the profile in load_settings, it must not override the name of the loaded one
+        fields = {"profile": {"env": []}}
+
+        @classmethod
+        def customise_sources(cls, init_settings, env_settings, file_secret_settings):
+            # environment variables override the values of the profile passed as init kwargs
+            return env_settings, init_settings, file_secret_settings
+
+    @property
+    def database_uri(self) -> str:
+        if self.db_backend == "sqlite":
+            return f"sqlite:///{self.sqlite_path}"
+        return f"mysql://{self.mysql_user}:{self.mysql_password}@{self.mysql_host}/{self.mysql_schema}"
+
+    @property
+    def async_database_uri(self) -> str:
+        if self.db_backend == "sqlite":
+            return f"sqlite+aiosqlite:///{self.sqlite_path}"
+        return f"mysql+aiomysql://{self.mysql_user}:{self.mysql_password}@{self.mysql_host}/{self.mysql_schema}"
+
+
+def load_settings(profile: Optional[str] = None, config_path: Optional[Path] = None) -> Settings:
+    """load settings of the given profile
+
+    Args:
+        profile (Optional[str]): profile name in the config file. Defaults to $APP_PROFILE or "dev".
+        config_path (Optional[Path]): yaml file with a top level `profiles` mapping.
+            Defaults to $APP_CONFIG_FILE or conf/settings.yml.
+    """
+    profile = profile or os.environ.get("APP_PROFILE", "dev")
+    config_path = config_path or Path(os.environ.get("APP_CONFIG_FILE", default_config_path))
+    with open(file=str(config_path), mode="rt") as f:
+        profiles: Dict[str, Dict[str, Any]] = (yaml.safe_load(f) or {}).get("profiles", {})
+    if profile not in profiles:
+        raise ValueError(f"unknown settings profile: {profile=}, available: {list(profiles)}")
+    return Settings(**{**(profiles[profile] or {}), "profile": profile})
+
+
+settings: Settings = load_settings()
@@ -1,7 +1,164 @@
+# Standard Library
+import atexit
+import shutil
+import tempfile
+from logging import getLogger
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+
 # Third Party Library
+from sqlalchemy import BigInteger
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import FunctionElement
 
 # Local Library
-from . import config
+from . import metrics
+from . import query_stats
+from .config import Settings
+from .config import settings
+
+logger = getLogger(__name__)
+
+# table definitions of model.py and room_model.py (mirrors schema.sql)
+metadata = MetaData()
+# type of the AUTO_INCREMENT primary keys. SQLite only auto-increments an INTEGER PRIMARY KEY.
+BigIntegerPrimaryKey = BigInteger().with_variant(Integer, "sqlite")
+
+
+class unix_timestamp(FunctionElement):
+    """current time of the database server in epoch seconds (UTC), e.g. `.values(updated_at=unix_timestamp())`"""
+
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(unix_timestamp)
+def _compile_unix_timestamp(element, compiler, **kw) -> str:
+    return "UNIX_TIMESTAMP()"
+
+
+@compiles(unix_timestamp, "sqlite")
+def _compile_unix_timestamp_sqlite(element, compiler, **kw) -> str:
+    return "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def _engine_kwargs(settings: Settings) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = dict(
+        future=True,
+        echo=settings.db_echo,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+    if settings.db_backend == "sqlite":
+        # pooled connections are handed from thread to thread
+        kwargs["connect_args"] = dict(timeout=settings.sqlite_busy_timeout, check_same_thread=False)
+    elif settings.db_isolation_level is not None:
+        kwargs["isolation_level"] = settings.db_isolation_level
+    return kwargs
+
+
+def _ephemeral_sqlite_path() -> str:
+    """database file standing in for sqlite_path=":memory:"
+
+    A real in-memory database is private to one connection, but the sync and async engines and their pools need
+    to share it, and the shared-cache mode fails with "database table is locked" instead of waiting for the lock.
+    The database is therefore a temporary file, on tmpfs (/dev/shm) when available, removed at exit.
+    """
+    shm: Path = Path("/dev/shm")
+    directory: str = tempfile.mkdtemp(prefix="gameserver-", dir=str(shm) if shm.is_dir() else None)
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return str(Path(directory) / "gameserver.db")
+
+
+def _on_sqlite_connect(dbapi_connection, connection_record) -> None:
+    # leave BEGIN to the "begin" event below. The driver would otherwise defer it and break SAVEPOINT.
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    # readers do not wait for the writer
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def _on_sqlite_begin(conn) -> None:
+    # Every transaction takes the write lock up front and waits up to sqlite_busy_timeout for it.
+    # It stands in for the row locks of MySQL (FOR UPDATE, conditional UPDATEs), which SQLite does not have.
+    # A DBAPI cursor keeps it out of the statement events (metrics, query_stats), like the implicit BEGIN of MySQL.
+    cursor = conn.connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.close()
+
+
+def _configure_sqlite(sync_engine: Engine) -> None:
+    event.listen(sync_engine, "connect", _on_sqlite_connect)
+    event.listen(sync_engine, "begin", _on_sqlite_begin)
+
+
+if settings.db_backend == "sqlite" and settings.sqlite_path == ":memory:":
+    settings.sqlite_path = _ephemeral_sqlite_path()
+
+# the sqlite dialects would open a new connection to a file for every checkout (NullPool), hence the explicit class
+if settings.metrics_enabled:
+    pool_class, async_pool_class = metrics.InstrumentedQueuePool, metrics.InstrumentedAsyncAdaptedQueuePool
+else:
+    pool_class, async_pool_class = QueuePool, AsyncAdaptedQueuePool
+
+engine = create_engine(settings.database_uri, **_engine_kwargs(settings), poolclass=pool_class)
+# used by the API server so that requests do not occupy threadpool workers
+async_engine = create_async_engine(settings.async_database_uri, **_engine_kwargs(settings), poolclass=async_pool_class)
+if settings.db_backend == "sqlite":
+    _configure_sqlite(engine)
+    _configure_sqlite(async_engine.sync_engine)
+if settings.metrics_enabled:
+    metrics.instrument_engine(engine, "sync")
+    metrics.instrument_engine(async_engine.sync_engine, "async")
+if settings.query_stats:
+    query_stats.instrument_engine(engine)
+    query_stats.instrument_engine(async_engine.sync_engine)
+
+
+def create_tables() -> None:
+    """create the tables of `metadata` that do not exist yet (the sqlite backend has no schema.sql)"""
+    metadata.create_all(engine)
+
+
+def check_pool_size(settings: Settings, workers: int, threads: int) -> List[str]:
+    """warn when the pool size does not match the server concurrency
+
+    Args:
+        settings (Settings):
+        workers (int): number of server processes (uvicorn `--workers` / $WEB_CONCURRENCY)
+        threads (int): threadpool size of each process, which bounds the concurrent users of the sync engine
 
-engine = create_engine(config.DATABASE_URI, future=True, echo=True)
+    Returns:
+        List[str]: warning messages (also logged)
+    """
+    warnings: List[str] = []
+    connections_per_engine: int = settings.db_pool_size + settings.db_max_overflow
+    if threads > connections_per_engine:
+        warnings.append(
+            f"threadpool size ({threads}) exceeds db_pool_size + db_max_overflow ({connections_per_engine}):"
+            f" sync callers may wait up to db_pool_timeout ({settings.db_pool_timeout}s) for a connection"
+        )
+    # each worker owns a sync and an async engine
+    max_connections: int = workers * 2 * connections_per_engine
+    if settings.db_backend == "mysql" and max_connections > settings.db_max_connections:
+        warnings.append(
+            f"{workers} worker(s) may open up to {max_connections} connections"
+            f" but the database accepts db_max_connections={settings.db_max_connections}"
+        )
+    for warning in warnings:
+        logger.warning(warning)
+    return warnings
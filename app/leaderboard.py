@@ -0,0 +1,335 @@
+"""Leaderboards per (live_id, difficulty).
+
+The best score of every player is persisted in `live_best_score` by room_model._finish_playing, in the transaction
+of /room/end. ``Leaderboards`` keeps the top ``settings.leaderboard_top_k`` entries of the recently used boards in
+memory, loaded from that table and then fed incrementally by room_model.finish_playing_async:
+
+- the top N and the rank of a player in the top K are answered from memory (binary search)
+- the rank of any other player is read from the table: one primary key lookup and one index range count on
+  (live_id, difficulty, score)
+- a board is read again ``settings.leaderboard_ttl`` seconds after it was loaded, so that the scores committed by
+  the other workers, which never reach this process, show up in the top N
+
+Ranks are competition ranks: players with the same score share a rank, the next rank skips accordingly.
+"""
+
+# Standard Library
+import bisect
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Third Party Library
+from sqlalchemy import BigInteger
+from sqlalchemy import Column
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import bindparam
+from sqlalchemy import case
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Local Library
+from .cache import MISSING
+from .cache import TTLCache
+from .config import settings
+from .db import async_engine
+from .db import engine
+from .db import metadata
+from .db import unix_timestamp
+from .notifier import SingleFlight
+
+logger = getLogger(__name__)
+
+
+class LiveBestScoreDBTableName:
+    """table column names"""
+
+    table_name: str = "live_best_score"
+
+    live_id: str = "live_id"  # primary key
+    difficulty: str = "difficulty"  # primary key, LiveDifficulty
+    user_id: str = "user_id"  # primary key
+    user_name: str = "user_name"  # as of the best score
+    leader_card_id: str = "leader_card_id"  # as of the best score
+    score: str = "score"
+    updated_at: str = "updated_at"  # epoch seconds of the best score
+
+
+live_best_score_table = Table(
+    LiveBestScoreDBTableName.table_name,
+    metadata,
+    Column(LiveBestScoreDBTableName.live_id, BigInteger, primary_key=True, autoincrement=False),
+    Column(LiveBestScoreDBTableName.difficulty, Integer, primary_key=True, autoincrement=False),
+    Column(LiveBestScoreDBTableName.user_id, BigInteger, primary_key=True, autoincrement=False),
+    Column(LiveBestScoreDBTableName.user_name, String(255), nullable=False),
+    Column(LiveBestScoreDBTableName.leader_card_id, Integer),
+    Column(LiveBestScoreDBTableName.score, Integer, nullable=False),
+    Column(LiveBestScoreDBTableName.updated_at, BigInteger, nullable=False),
+    Index(
+        "live_difficulty_score",
+        LiveBestScoreDBTableName.live_id,
+        LiveBestScoreDBTableName.difficulty,
+        LiveBestScoreDBTableName.score,
+    ),
+)
+
+_best = live_best_score_table.c
+
+
+@dataclass(frozen=True, slots=True)
+class BestScore:
+    live_id: int
+    difficulty: int
+    user_id: int
+    user_name: str
+    leader_card_id: int
+    score: int
+
+
+@dataclass(frozen=True, slots=True)
+class RankedScore:
+    rank: int
+    user_id: int
+    user_name: str
+    leader_card_id: int
+    score: int
+
+
+def _best_score_params(best_score: BestScore) -> Dict[str, Any]:
+    return dict(
+        live_id=best_score.live_id,
+        difficulty=best_score.difficulty,
+        user_id=best_score.user_id,
+        user_name=best_score.user_name,
+        leader_card_id=best_score.leader_card_id,
+        score=best_score.score,
+    )
+
+
+def _build_upsert_best_score_stmt(bound_updated_at: bool = False):
+    """INSERT of a new best score, which only overwrites a lower one
+
+    Args:
+        bound_updated_at (bool): take updated_at from a bind parameter instead of unix_timestamp(). The MySQL drivers
+            send an executemany of an INSERT as one multi-row INSERT only if its VALUES are all bind parameters.
+    """
+    values: Dict[str, Any] = dict(
+        live_id=bindparam(LiveBestScoreDBTableName.live_id),
+        difficulty=bindparam(LiveBestScoreDBTableName.difficulty),
+        user_id=bindparam(LiveBestScoreDBTableName.user_id),
+        user_name=bindparam(LiveBestScoreDBTableName.user_name),
+        leader_card_id=bindparam(LiveBestScoreDBTableName.leader_card_id),
+        score=bindparam(LiveBestScoreDBTableName.score),
+        updated_at=bindparam(LiveBestScoreDBTableName.updated_at) if bound_updated_at else unix_timestamp(),
+    )
+    if settings.db_backend == "sqlite":
+        sqlite_stmt = sqlite_insert(live_best_score_table).values(values)
+        return sqlite_stmt.on_conflict_do_update(
+            index_elements=[_best.live_id, _best.difficulty, _best.user_id],
+            set_={
+                name: sqlite_stmt.excluded[name]
+                for name in (
+                    LiveBestScoreDBTableName.user_name,
+                    LiveBestScoreDBTableName.leader_card_id,
+                    LiveBestScoreDBTableName.score,
+                    LiveBestScoreDBTableName.updated_at,
+                )
+            },
+            where=_best.score < sqlite_stmt.excluded.score,
+        )
+    mysql_stmt = mysql_insert(live_best_score_table).values(values)
+    improved = mysql_stmt.inserted.score > _best.score
+    # MySQL assigns from left to right: `score` goes last so that the conditions see the previous best
+    return mysql_stmt.on_duplicate_key_update(
+        [
+            (name, case((improved, mysql_stmt.inserted[name]), else_=_best[name]))
+            for name in (
+                LiveBestScoreDBTableName.user_name,
+                LiveBestScoreDBTableName.leader_card_id,
+                LiveBestScoreDBTableName.updated_at,
+                LiveBestScoreDBTableName.score,
+            )
+        ]
+    )
+
+
+_upsert_best_score_stmt = _build_upsert_best_score_stmt()
+_upsert_best_score_batch_stmt = _build_upsert_best_score_stmt(bound_updated_at=True)
+_board_where = (
+    _best.live_id == bindparam(LiveBestScoreDBTableName.live_id),
+    _best.difficulty == bindparam(LiveBestScoreDBTableName.difficulty),
+)
+_select_top_best_scores_stmt = (
+    select(_best.user_id, _best.user_name, _best.leader_card_id, _best.score)
+    .where(*_board_where)
+    .order_by(_best.score.desc(), _best.user_id.asc())
+    .limit(bindparam("limit"))
+)
+_select_best_score_stmt = select(_best.user_id, _best.user_name, _best.leader_card_id, _best.score).where(
+    *_board_where, _best.user_id == bindparam(LiveBestScoreDBTableName.user_id)
+)
+_count_better_scores_stmt = select(func.count()).where(
+    *_board_where, _best.score > bindparam(LiveBestScoreDBTableName.score)
+)
+
+
+def _update_best_score(conn, best_score: BestScore) -> None:
+    conn.execute(_upsert_best_score_stmt, _best_score_params(best_score))
+
+
+def _update_best_scores(conn, best_scores: List[BestScore], updated_at: int) -> None:
+    """_update_best_score of several scores, sent as one multi-row INSERT by the MySQL drivers (executemany)
+
+    Args:
+        updated_at (int): unix_timestamp() read by the transaction
+    """
+    conn.execute(
+        _upsert_best_score_batch_stmt,
+        [dict(_best_score_params(best_score), updated_at=updated_at) for best_score in best_scores],
+    )
+
+
+def _get_top_best_scores(conn, live_id: int, difficulty: int, limit: int) -> List[BestScore]:
+    return [
+        BestScore(live_id, difficulty, row.user_id, row.user_name, row.leader_card_id, row.score)
+        for row in conn.execute(
+            _select_top_best_scores_stmt, dict(live_id=live_id, difficulty=difficulty, limit=limit)
+        ).all()
+    ]
+
+
+def _get_rank_from_database(conn, live_id: int, difficulty: int, user_id: int) -> Optional[RankedScore]:
+    row = conn.execute(
+        _select_best_score_stmt, dict(live_id=live_id, difficulty=difficulty, user_id=user_id)
+    ).one_or_none()
+    if row is None:
+        return None
+    better: int = conn.execute(
+        _count_better_scores_stmt, dict(live_id=live_id, difficulty=difficulty, score=row.score)
+    ).scalar_one()
+    return RankedScore(better + 1, row.user_id, row.user_name, row.leader_card_id, row.score)
+
+
+class TopK:
+    """the best score of the `k` best players of a board, ordered by score (desc) then user_id"""
+
+    def __init__(self, k: int) -> None:
+        self.k: int = k
+        self._keys: List[Tuple[int, int]] = []  # (-score, user_id), sorted
+        self._entries: Dict[int, BestScore] = {}  # user_id -> best score
+        # False until the board has been read from live_best_score
+        self.loaded: bool = False
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def offer(self, best_score: BestScore) -> None:
+        """keep the score if it is the best of the player and within the top k"""
+        key: Tuple[int, int] = (-best_score.score, best_score.user_id)
+        current: Optional[BestScore] = self._entries.get(best_score.user_id)
+        if current is not None:
+            if best_score.score <= current.score:
+                return
+            del self._keys[bisect.bisect_left(self._keys, (-current.score, current.user_id))]
+        elif len(self._keys) >= self.k and key >= self._keys[-1]:
+            return
+        bisect.insort(self._keys, key)
+        self._entries[best_score.user_id] = best_score
+        if len(self._keys) > self.k:
+            _, evicted_user_id = self._keys.pop()
+            del self._entries[evicted_user_id]
+
+    def _rank_of(self, score: int) -> int:
+        # (-score,) sorts before every key of the score: the number of strictly better scores
+        return bisect.bisect_left(self._keys, (-score,)) + 1
+
+    def top(self, n: int) -> List[RankedScore]:
+        return [
+            RankedScore(self._rank_of(entry.score), entry.user_id, entry.user_name, entry.leader_card_id, entry.score)
+            for entry in (self._entries[user_id] for _, user_id in self._keys[:n])
+        ]
+
+    def rank(self, user_id: int) -> Optional[RankedScore]:
+        """None if the player is not in the top k"""
+        entry: Optional[BestScore] = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return RankedScore(
+            self._rank_of(entry.score), entry.user_id, entry.user_name, entry.leader_card_id, entry.score
+        )
+
+
+BoardKey = Tuple[int, int]  # (live_id, difficulty)
+
+
+class Leaderboards:
+    """TopK of the recently used boards, loaded on first use"""
+
+    def __init__(self, k: int, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.k: int = k
+        self._boards: TTLCache[BoardKey, TopK] = TTLCache(maxsize=maxsize, ttl=ttl, clock=clock)
+        self._loading: SingleFlight[BoardKey, None] = SingleFlight()
+
+    def offer(self, best_score: BestScore) -> None:
+        """feed a committed score to its board, if held in memory. The table is updated either way."""
+        board = self._boards.get((best_score.live_id, best_score.difficulty))
+        if board is not MISSING:
+            board.offer(best_score)
+
+    async def _load(self, key: BoardKey, board: TopK) -> None:
+        async with async_engine.begin() as conn:
+            best_scores: List[BestScore] = await conn.run_sync(_get_top_best_scores, *key, limit=self.k)
+        # merged with the scores offered during the read, the board keeps the best of each player
+        for best_score in best_scores:
+            board.offer(best_score)
+        board.loaded = True
+
+    async def _get_board(self, live_id: int, difficulty: int) -> TopK:
+        key: BoardKey = (live_id, difficulty)
+        board = self._boards.get(key)
+        if board is MISSING:
+            board = TopK(self.k)
+            # cached before the read so that it receives the scores committed in the meantime
+            self._boards.set(key, board)
+        if not board.loaded:
+            try:
+                await self._loading.do(key, lambda: self._load(key, board))
+            except Exception:
+                self._boards.invalidate(key)
+                raise
+        return board
+
+    async def top(self, live_id: int, difficulty: int, n: int) -> List[RankedScore]:
+        return (await self._get_board(live_id, difficulty)).top(min(n, self.k))
+
+    async def rank(self, live_id: int, difficulty: int, user_id: int) -> Optional[RankedScore]:
+        """None if the player has no score on the board"""
+        board: TopK = await self._get_board(live_id, difficulty)
+        ranked_score: Optional[RankedScore] = board.rank(user_id)
+        if ranked_score is not None:
+            return ranked_score
+        # below the top k, or committed by another worker since the board was loaded
+        async with async_engine.begin() as conn:
+            return await conn.run_sync(_get_rank_from_database, live_id, difficulty, user_id)
+
+
+leaderboards = Leaderboards(
+    k=settings.leaderboard_top_k, maxsize=settings.leaderboard_cache_size, ttl=settings.leaderboard_ttl
+)
+
+
+def get_rank(live_id: int, difficulty: int, user_id: int) -> Optional[RankedScore]:
+    """rank from the table only (scripts and tests)"""
+    with engine.begin() as conn:
+        return _get_rank_from_database(conn, live_id, difficulty, user_id)
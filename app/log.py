@@ -0,0 +1,84 @@
+"""Logging setup.
+
+``setup_logging`` applies ``conf/logging.yml``. With ``settings.log_queue`` the handlers configured there are
+moved behind a ``QueueListener`` per logger: the loggers only put records on an in-memory queue and background
+threads format and write them, so a slow console or log file never blocks a request.
+"""
+
+# Standard Library
+import atexit
+import logging
+import queue
+from logging.config import dictConfig
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from typing import Any
+from typing import Dict
+from typing import List
+
+# Third Party Library
+import yaml
+
+# Local Library
+from .config import Settings
+
+_listeners: List[QueueListener] = []
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """QueueHandler that leaves the formatting to the listener thread
+
+    The default `prepare` formats the message in the caller so that the record can be pickled.
+    The queue never leaves the process here, so the record is enqueued as is.
+    Arguments of a record must therefore not be mutated after the logging call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _load_config(settings: Settings) -> Dict[str, Any]:
+    with open(file=str(settings.log_config_path), mode="rt") as f:
+        config: Dict[str, Any] = yaml.safe_load(f)
+    if settings.log_level is not None:
+        config.setdefault("loggers", {}).setdefault("app", {})["level"] = settings.log_level
+    return config
+
+
+def _move_handlers_to_listeners() -> List[QueueListener]:
+    """replace the handlers of each configured logger by a queue handler of its own
+
+    Every logger gets its own queue and listener, so that a record still reaches the handlers of its logger and of
+    the loggers it propagates to, and no others: e.g. uvicorn.access records keep their AccessFormatter to
+    themselves.
+    """
+    listeners: List[QueueListener] = []
+    loggers: List[logging.Logger] = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values() if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        if len(logger.handlers) == 0:
+            continue
+        queue_handler = _InProcessQueueHandler(queue.SimpleQueue())
+        # each handler still filters by its own level, as it did when attached to the logger
+        listeners.append(QueueListener(queue_handler.queue, *logger.handlers, respect_handler_level=True))
+        logger.handlers = [queue_handler]
+    return listeners
+
+
+def setup_logging(settings: Settings) -> None:
+    stop_logging()
+    dictConfig(config=_load_config(settings))
+    if settings.log_queue:
+        _listeners.extend(_move_handlers_to_listeners())
+        for listener in _listeners:
+            listener.start()
+
+
+def stop_logging() -> None:
+    """flush the queued records and stop the listener threads"""
+    while len(_listeners) > 0:
+        _listeners.pop().stop()
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,290 @@
+"""Maintenance jobs.
+
+usage:
+    python -m app.maintenance cleanup_orphan_room_users [--batch-size 500] [--interval 0.1]
+    python -m app.maintenance sweep_rooms [--batch-size 100] [--interval 0.05] [--period 30]
+    python -m app.maintenance rebuild_user_play_stats [--batch-size 1000] [--interval 0.1]
+"""
+
+# Standard Library
+import argparse
+import asyncio
+import time
+from logging import getLogger
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+# Third Party Library
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import update
+
+# Local Library
+from .config import Settings
+from .config import settings
+from .db import async_engine
+from .db import engine
+from .db import unix_timestamp
+from .room_model import RoomDBTableName
+from .room_model import RoomUserDBTableName
+from .room_model import WaitRoomStatus
+from .room_model import _replace_user_play_stats_stmt
+from .room_model import _user_play_stats_params
+from .room_model import const_judge_count_order
+from .room_model import room_result_notifier
+from .room_model import room_table
+from .room_model import room_user_table
+from .room_model import room_wait_notifier
+
+logger = getLogger(__name__)
+
+
+_select_orphan_room_ids_stmt = (
+    select(room_user_table.c[RoomUserDBTableName.room_id])
+    .distinct()
+    .join_from(
+        room_user_table,
+        room_table,
+        room_table.c[RoomDBTableName.room_id] == room_user_table.c[RoomUserDBTableName.room_id],
+        isouter=True,
+    )
+    .where(room_table.c[RoomDBTableName.room_id].is_(None))
+    .limit(bindparam("batch_size"))
+)
+_delete_room_users_of_stmt = delete(room_user_table).where(
+    room_user_table.c[RoomUserDBTableName.room_id].in_(bindparam("room_ids", expanding=True))
+)
+
+_room = room_table.c
+# oldest first on the (status, updated_at) index. Rows locked by a request are skipped and picked up by a later sweep.
+_select_stale_room_ids_for_update_stmt = (
+    select(_room.room_id)
+    .where(
+        _room.status == bindparam("room_status"),
+        _room.updated_at < unix_timestamp() - bindparam("timeout"),
+    )
+    .order_by(_room.updated_at)
+    .limit(bindparam("batch_size"))
+    .with_for_update(skip_locked=True)
+)
+_dissolve_rooms_stmt = (
+    update(room_table)
+    .where(_room.room_id.in_(bindparam("room_ids", expanding=True)))
+    .values({_room.status: int(WaitRoomStatus.Dissolution), _room.updated_at: unix_timestamp()})
+)
+_delete_rooms_stmt = delete(room_table).where(_room.room_id.in_(bindparam("room_ids", expanding=True)))
+
+_room_user = room_user_table.c
+# the finished plays summed up per user, `batch_size` users at a time: keyset pagination on the user_id index, so
+# that every batch reads the rows of its users only
+_select_user_play_totals_stmt = (
+    select(
+        _room_user.user_id,
+        func.count().label("play_count"),
+        func.coalesce(func.sum(_room_user.score), 0).label("total_score"),
+        func.coalesce(func.max(_room_user.score), 0).label("best_score"),
+        *(func.coalesce(func.sum(_room_user[name]), 0).label(name) for name in const_judge_count_order),
+    )
+    .where(_room_user.user_id > bindparam("after_user_id"), _room_user.end_playing.is_(True))
+    .group_by(_room_user.user_id)
+    .order_by(_room_user.user_id)
+    .limit(bindparam("batch_size"))
+)
+
+
+def _find_orphan_room_ids(conn, batch_size: int) -> List[int]:
+    return [row.room_id for row in conn.execute(_select_orphan_room_ids_stmt, dict(batch_size=batch_size)).all()]
+
+
+def _drop_room_users_of(conn, room_ids: List[int]) -> int:
+    result = conn.execute(_delete_room_users_of_stmt, dict(room_ids=room_ids))
+    return result.rowcount
+
+
+def cleanup_orphan_room_users(batch_size: int = 500, interval: float = 0.1) -> int:
+    """delete room_user rows whose room has already been dropped
+
+    Each batch of rooms is deleted in its own short transaction and the job sleeps `interval` seconds between
+    batches, so that it does not hold locks needed by live traffic.
+
+    Returns:
+        int: number of deleted room_user rows
+    """
+    deleted: int = 0
+    while True:
+        with engine.begin() as conn:
+            room_ids: List[int] = _find_orphan_room_ids(conn, batch_size=batch_size)
+            if len(room_ids) == 0:
+                break
+            deleted += _drop_room_users_of(conn, room_ids)
+        logger.info("cleanup_orphan_room_users: deleted=%d", deleted)
+        time.sleep(interval)
+    return deleted
+
+
+def rebuild_user_play_stats(batch_size: int = 1000, interval: float = 0.1) -> int:
+    """rebuild user_play_stats from the finished plays kept in room_user
+
+    The plays are summed up by the database per user, in user_id order, and each batch of `batch_size` users is
+    written in the short transaction that read it: nothing is held in memory across batches. The users without a
+    finished play in room_user keep their row.
+
+    room_user only keeps the plays of the rooms that have not been deleted yet: run it when user_play_stats is
+    created (migrations/004_user_play_stats.sql) or lost, not over statistics counted by the servers since.
+
+    Returns:
+        int: number of users written
+    """
+    written: int = 0
+    after_user_id: int = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                _select_user_play_totals_stmt, dict(after_user_id=after_user_id, batch_size=batch_size)
+            ).all()
+            if len(rows) > 0:
+                conn.execute(
+                    _replace_user_play_stats_stmt,
+                    [
+                        _user_play_stats_params(
+                            user_id=row.user_id,
+                            play_count=int(row.play_count),
+                            total_score=int(row.total_score),
+                            best_score=int(row.best_score),
+                            judge_counts=[int(getattr(row, judge_name)) for judge_name in const_judge_count_order],
+                        )
+                        for row in rows
+                    ],
+                )
+        written += len(rows)
+        logger.info("rebuild_user_play_stats: %d users", written)
+        if len(rows) < batch_size:
+            break
+        after_user_id = rows[-1].user_id
+        time.sleep(interval)
+    return written
+
+
+def _sweep_stages(settings: Settings) -> List[Tuple[WaitRoomStatus, float]]:
+    """(status, seconds without a change of the room row) of the rooms to sweep
+
+    Waiting rooms are dissolved first, so that the members still polling /room/wait see Dissolution,
+    and deleted room_dissolution_grace seconds later. Rooms stuck in LiveStart are deleted right away.
+    """
+    return [
+        (WaitRoomStatus.Waiting, settings.room_waiting_timeout),
+        (WaitRoomStatus.Dissolution, settings.room_dissolution_grace),
+        (WaitRoomStatus.LiveStart, settings.room_live_timeout),
+    ]
+
+
+def _sweep_room_batch(conn, status: WaitRoomStatus, timeout: float, batch_size: int) -> List[int]:
+    """dissolve (Waiting) or delete (the others) up to batch_size rooms of the status unchanged for timeout seconds
+
+    Returns:
+        List[int]: the swept room ids
+    """
+    room_ids: List[int] = [
+        row.room_id
+        for row in conn.execute(
+            _select_stale_room_ids_for_update_stmt,
+            dict(room_status=int(status), timeout=int(timeout), batch_size=batch_size),
+        ).all()
+    ]
+    if len(room_ids) == 0:
+        return room_ids
+    if status == WaitRoomStatus.Waiting:
+        conn.execute(_dissolve_rooms_stmt, dict(room_ids=room_ids))
+    else:
+        _drop_room_users_of(conn, room_ids)
+        conn.execute(_delete_rooms_stmt, dict(room_ids=room_ids))
+    return room_ids
+
+
+def sweep_rooms(batch_size: int = 100, interval: float = 0.05) -> Dict[str, int]:
+    """dissolve and delete abandoned rooms (see _sweep_stages)
+
+    Like cleanup_orphan_room_users, every batch is a short transaction followed by `interval` seconds of sleep.
+
+    Returns:
+        Dict[str, int]: status name -> number of swept rooms
+    """
+    swept: Dict[str, int] = {}
+    for status, timeout in _sweep_stages(settings):
+        swept[status.name] = 0
+        while True:
+            with engine.begin() as conn:
+                room_ids: List[int] = _sweep_room_batch(conn, status, timeout=timeout, batch_size=batch_size)
+            swept[status.name] += len(room_ids)
+            if len(room_ids) < batch_size:
+                break
+            time.sleep(interval)
+    if sum(swept.values()) > 0:
+        logger.info("sweep_rooms: swept=%r", swept)
+    return swept
+
+
+async def sweep_rooms_async(batch_size: int = 100, interval: float = 0.05) -> Dict[str, int]:
+    """sweep_rooms on the async engine, waking up the waiters of the swept rooms in this process"""
+    swept: Dict[str, int] = {}
+    for status, timeout in _sweep_stages(settings):
+        swept[status.name] = 0
+        while True:
+            async with async_engine.begin() as conn:
+                room_ids: List[int] = await conn.run_sync(
+                    _sweep_room_batch, status, timeout=timeout, batch_size=batch_size
+                )
+            for room_id in room_ids:
+                room_wait_notifier.notify(room_id)
+                room_result_notifier.notify(room_id)
+            swept[status.name] += len(room_ids)
+            if len(room_ids) < batch_size:
+                break
+            await asyncio.sleep(interval)
+    if sum(swept.values()) > 0:
+        logger.info("sweep_rooms: swept=%r", swept)
+    return swept
+
+
+async def run_room_sweeper(period: float, batch_size: int, interval: float) -> None:
+    """sweep the rooms every `period` seconds until cancelled (started by the API server with settings.room_sweeper)"""
+    while True:
+        try:
+            await sweep_rooms_async(batch_size=batch_size, interval=interval)
+        except Exception as e:
+            # e.g. a lost connection. The next sweep retries.
+            logger.error("sweep_rooms failed: e=%r", e, exc_info=True)
+        await asyncio.sleep(period)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("job", choices=["cleanup_orphan_room_users", "sweep_rooms", "rebuild_user_play_stats"])
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=None)
+    parser.add_argument("--period", type=float, default=None, help="sweep_rooms: repeat every PERIOD seconds")
+    args = parser.parse_args()
+    if args.job == "cleanup_orphan_room_users":
+        deleted: int = cleanup_orphan_room_users(
+            batch_size=args.batch_size or 500, interval=args.interval if args.interval is not None else 0.1
+        )
+        print(f"deleted {deleted} rows")
+    elif args.job == "rebuild_user_play_stats":
+        written: int = rebuild_user_play_stats(
+            batch_size=args.batch_size or 1000, interval=args.interval if args.interval is not None else 0.1
+        )
+        print(f"rebuilt the statistics of {written} users")
+    else:
+        while True:
+            print(
+                sweep_rooms(
+                    batch_size=args.batch_size or settings.room_sweep_batch_size,
+                    interval=args.interval if args.interval is not None else settings.room_sweep_batch_interval,
+                )
+            )
+            if args.period is None:
+                break
+            time.sleep(args.period)
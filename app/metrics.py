@@ -0,0 +1,266 @@
+"""Prometheus metrics served by GET /metrics.
+
+- request latency and in-flight requests per route (``MetricsMiddleware``)
+- connection pool checkout wait (``InstrumentedQueuePool``) and utilisation, read from the pools at scrape time
+- duration of every SQL statement, labelled by the model function that executed it (``instrument_engine``)
+- rooms and joined players per WaitRoomStatus, counted at scrape time (``RoomCollector``)
+- hits, misses and size of the in-process caches (``CacheCollector``)
+
+The request and statement paths only take timestamps, observe histograms and move gauges. Everything else is
+computed when /metrics is scraped. Each server process exposes its own values.
+"""
+
+# Standard Library
+import sys
+import time
+from types import CodeType
+from types import FrameType
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Third Party Library
+from prometheus_client import REGISTRY
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
+from starlette.routing import BaseRoute
+from starlette.routing import Match
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+# Local Library
+from .cache import CacheStats
+
+# buckets of the database side, which is mostly well below the 5ms lower bound of the default buckets
+_db_buckets: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Time until the response has been sent", ["method", "route", "status"]
+)
+http_requests_in_progress = Gauge("http_requests_in_progress", "Requests being served", ["method", "route"])
+db_pool_checkout_wait_seconds = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to check a connection out of the pool", ["engine"], buckets=_db_buckets
+)
+db_statement_duration_seconds = Histogram(
+    "db_statement_duration_seconds", "Time of a SQL statement round trip", ["function"], buckets=_db_buckets
+)
+
+# modules whose functions label db_statement_duration_seconds
+_statement_modules: Dict[str, str] = {
+    "app.model": "model",
+    "app.room_model": "room_model",
+    "app.room_state": "room_state",
+    "app.maintenance": "maintenance",
+    "app.leaderboard": "leaderboard",
+}
+# frames between the cursor event and the function executing the statement are SQLAlchemy (and greenlet) frames
+_max_caller_depth: int = 32
+
+
+class _CheckoutTimingMixin:
+    engine_label: str
+
+    def connect(self):
+        start: float = time.perf_counter()
+        try:
+            return super().connect()  # type: ignore
+        finally:
+            db_pool_checkout_wait_seconds.labels(self.engine_label).observe(time.perf_counter() - start)
+
+
+class InstrumentedQueuePool(_CheckoutTimingMixin, QueuePool):
+    """QueuePool observing the checkout wait of the sync engine"""
+
+    engine_label = "sync"
+
+
+class InstrumentedAsyncAdaptedQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool observing the checkout wait of the async engine"""
+
+    engine_label = "async"
+
+
+# code object -> its child of db_statement_duration_seconds, or None for the frames of other modules
+_statement_histograms: Dict[CodeType, Any] = {}
+
+
+def _statement_histogram() -> Any:
+    """db_statement_duration_seconds of the innermost app frame, i.e. of the function that executed the statement"""
+    frame: Optional[FrameType] = sys._getframe(2)
+    for _ in range(_max_caller_depth):
+        if frame is None:
+            break
+        code: CodeType = frame.f_code
+        try:
+            histogram = _statement_histograms[code]
+        except KeyError:
+            module: Optional[str] = _statement_modules.get(frame.f_globals.get("__name__", ""))
+            histogram = None if module is None else db_statement_duration_seconds.labels(f"{module}.{code.co_name}")
+            _statement_histograms[code] = histogram
+        if histogram is not None:
+            return histogram
+        frame = frame.f_back
+    return _other_statement_histogram
+
+
+_other_statement_histogram = db_statement_duration_seconds.labels("other")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._statement_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    _statement_histogram().observe(time.perf_counter() - context._statement_start)
+
+
+class PoolCollector(Collector):
+    """size and checked out connections of the pools, read at scrape time"""
+
+    def __init__(self) -> None:
+        self.engines: Dict[str, Engine] = {}
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        size = GaugeMetricFamily("db_pool_size", "Connections kept by the pool (pool_size)", labels=["engine"])
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections in use", labels=["engine"])
+        overflow = GaugeMetricFamily(
+            "db_pool_overflow", "Connections opened beyond pool_size (negative: not opened yet)", labels=["engine"]
+        )
+        utilisation = GaugeMetricFamily(
+            "db_pool_utilisation", "Connections in use / (pool_size + max_overflow)", labels=["engine"]
+        )
+        for label, engine in self.engines.items():
+            # dispose() replaces the pool, so it is looked up on every scrape
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            size.add_metric([label], pool.size())
+            checked_out.add_metric([label], pool.checkedout())
+            overflow.add_metric([label], pool.overflow())
+            if pool._max_overflow >= 0:  # -1: no upper bound
+                utilisation.add_metric([label], pool.checkedout() / (pool.size() + pool._max_overflow))
+        yield from (size, checked_out, overflow, utilisation)
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+def instrument_engine(sync_engine: Engine, label: str) -> None:
+    """time the statements of the engine and expose its pool
+
+    Args:
+        sync_engine (Engine): the engine, or the `sync_engine` of an AsyncEngine
+        label (str): `engine` label of the pool metrics
+    """
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    pool_collector.engines[label] = sync_engine
+
+
+class RoomCollector(Collector):
+    """rooms and joined players per WaitRoomStatus
+
+    Args:
+        count_rooms (Callable[[], Dict[str, Tuple[int, int]]]): status name -> (rooms, joined players).
+            Called on every scrape, from the threadpool serving /metrics.
+    """
+
+    def __init__(self, count_rooms: Callable[[], Dict[str, Tuple[int, int]]]) -> None:
+        self.count_rooms = count_rooms
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        rooms = GaugeMetricFamily("rooms", "Rooms per status", labels=["status"])
+        players = GaugeMetricFamily("room_joined_players", "Joined players per room status", labels=["status"])
+        for status, (room_count, player_count) in self.count_rooms().items():
+            rooms.add_metric([status], room_count)
+            players.add_metric([status], player_count)
+        yield from (rooms, players)
+
+
+class CacheCollector(Collector):
+    """hits, misses and entries of in-process caches
+
+    Args:
+        caches (Dict[str, Callable[[], CacheStats]]): `cache` label -> stats of the cache (TTLCache.stats)
+    """
+
+    def __init__(self, caches: Dict[str, Callable[[], CacheStats]]) -> None:
+        self.caches = caches
+
+    def collect(self) -> Iterator[Any]:
+        hits = CounterMetricFamily("cache_hits", "Lookups answered by the cache", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Lookups not answered by the cache", labels=["cache"])
+        size = GaugeMetricFamily("cache_size", "Entries held by the cache", labels=["cache"])
+        maxsize = GaugeMetricFamily("cache_maxsize", "Entries the cache holds at most", labels=["cache"])
+        for label, get_stats in self.caches.items():
+            stats: CacheStats = get_stats()
+            hits.add_metric([label], stats.hits)
+            misses.add_metric([label], stats.misses)
+            size.add_metric([label], stats.size)
+            maxsize.add_metric([label], stats.maxsize)
+        yield from (hits, misses, size, maxsize)
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing http_request_duration_seconds and http_requests_in_progress
+
+    The route label is the path template of the matched route, or "unmatched", so that it stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp, routes: List[BaseRoute]) -> None:
+        self.app = app
+        self.routes = routes
+        # path -> route label of the routes without path parameters
+        self._route_labels: Dict[str, str] = {}
+
+    def _route_label(self, scope: Scope) -> str:
+        route_label = self._route_labels.get(scope["path"])
+        if route_label is not None:
+            return route_label
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                route_label = getattr(route, "path", "unmatched")
+                if "{" not in route_label:
+                    self._route_labels[scope["path"]] = route_label
+                return route_label
+        return "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method: str = scope["method"]
+        route_label: str = self._route_label(scope)
+        status: List[int] = [500]
+
+        async def send_with_status(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        in_progress = http_requests_in_progress.labels(method, route_label)
+        in_progress.inc()
+        start: float = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration_seconds.labels(method, route_label, str(status[0])).observe(
+                time.perf_counter() - start
+            )
+            in_progress.dec()
@@ -6,12 +6,26 @@ from typing import Optional
 # Third Party Library
 from fastapi import HTTPException
 from pydantic import BaseModel
-from sqlalchemy import text
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import bindparam
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import update
 from sqlalchemy.engine import CursorResult  # type: ignore
 from sqlalchemy.exc import NoResultFound  # type: ignore
 
 # Local Library
+from .cache import MISSING
+from .cache import CacheStats
+from .cache import TTLCache
+from .config import settings
+from .db import BigIntegerPrimaryKey
+from .db import async_engine
 from .db import engine
+from .db import metadata
 
 logger = getLogger(__name__)
 
@@ -27,6 +41,37 @@ class UserDBTableName:
     leader_card_id: str = "leader_card_id"  # int DEFAULT NULL,
 
 
+user_table = Table(
+    UserDBTableName.table_name,
+    metadata,
+    Column(UserDBTableName.id, BigIntegerPrimaryKey, primary_key=True, autoincrement=True),
+    Column(UserDBTableName.name, String(255)),
+    Column(UserDBTableName.token, String(255), unique=True),
+    Column(UserDBTableName.leader_card_id, Integer),
+    # never reuse the id of a deleted row, like AUTO_INCREMENT
+    sqlite_autoincrement=True,
+)
+
+# statements are built once at import time so that every call hits the compiled statement cache of SQLAlchemy.
+# Bound parameters in the WHERE clause of an UPDATE are prefixed with `b_`: column names are reserved for its SET clause.
+_insert_user_stmt = insert(user_table)
+_select_user_by_token_stmt = select(
+    user_table.c[UserDBTableName.id],
+    user_table.c[UserDBTableName.name],
+    user_table.c[UserDBTableName.leader_card_id],
+).where(user_table.c[UserDBTableName.token] == bindparam(UserDBTableName.token))
+_update_user_by_token_stmt = (
+    update(user_table)
+    .where(user_table.c[UserDBTableName.token] == bindparam("b_token"))
+    .values(
+        {
+            UserDBTableName.name: bindparam(UserDBTableName.name),
+            UserDBTableName.leader_card_id: bindparam(UserDBTableName.leader_card_id),
+        }
+    )
+)
+
+
 class InvalidToken(Exception):
     """指定されたtokenが不正だったときに投げる"""
 
@@ -42,87 +87,103 @@ class SafeUser(BaseModel):
         orm_mode = True
 
 
-def create_user(name: str, leader_card_id: int) -> str:
-    """Create new user and returns their token"""
+def _create_user(conn, name: str, leader_card_id: int) -> str:
     token = str(uuid.uuid4())
     # NOTE: tokenが衝突したらリトライする必要がある.
-    with engine.begin() as conn:
-        query: str = " ".join(
-            [
-                f"INSERT INTO `{ UserDBTableName.table_name }`",
-                "SET",
-                ", ".join(
-                    (
-                        f"`{ UserDBTableName.name }`=:name",
-                        f"`{ UserDBTableName.token }`=:token",
-                        f"`{ UserDBTableName.leader_card_id }`=:leader_card_id",
-                    )
-                ),
-            ]
-        )
-        result: CursorResult = conn.execute(
-            text(query),
-            {
-                "name": name,
-                "token": token,
-                "leader_card_id": leader_card_id,
-            },
-        )
-        logger.info(f"{result}")
+    result: CursorResult = conn.execute(
+        _insert_user_stmt,
+        {
+            "name": name,
+            "token": token,
+            "leader_card_id": leader_card_id,
+        },
+    )
+    logger.debug("%s", result)
     return token
 
 
+def create_user(name: str, leader_card_id: int) -> str:
+    """Create new user and returns their token"""
+    with engine.begin() as conn:
+        return _create_user(conn, name, leader_card_id)
+
+
+async def create_user_async(name: str, leader_card_id: int) -> str:
+    """Create new user and returns their token"""
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_create_user, name, leader_card_id)
+
+
 def _get_user_by_token(conn, token: str) -> Optional[SafeUser]:
-    query: str = " ".join(
-        (
-            "SELECT",
-            ", ".join(
-                (
-                    f"`{ UserDBTableName.id }`",
-                    f"`{ UserDBTableName.name }`",
-                    f"`{ UserDBTableName.leader_card_id }`",
-                )
-            ),
-            f"FROM `{ UserDBTableName.table_name }`",
-            f"WHERE `{ UserDBTableName.token }`=:token",
-        )
-    )
-    result = conn.execute(text(query), dict(token=token))
+    result = conn.execute(_select_user_by_token_stmt, dict(token=token))
     try:
         row = result.one()
     except NoResultFound:
-        logger.warning(f"No Result Found: ({query=})")
+        logger.warning("No Result Found: user by token")
         return None
     return SafeUser.from_orm(row)
 
 
+# token -> user (None for unknown tokens).
+# The cache is per process: update_user invalidates the local entry, other workers see the change after the TTL.
+# A lookup only caches its row if no update has invalidated the cache while it was reading (TTLCache.generation).
+_user_cache: TTLCache[str, Optional[SafeUser]] = TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+
+def _cache_user(token: str, user: Optional[SafeUser], generation: int) -> None:
+    if user is None:
+        _user_cache.set(token, None, ttl=settings.user_cache_negative_ttl, generation=generation)
+    else:
+        _user_cache.set(token, user, generation=generation)
+
+
+def get_user_cache_stats() -> CacheStats:
+    return _user_cache.stats()
+
+
 def get_user_by_token(token: str) -> SafeUser:
-    with engine.begin() as conn:
-        user: Optional[SafeUser] = _get_user_by_token(conn, token)
-        if user is None:
-            raise HTTPException(status_code=400, detail="Unknown user token")
-        return user
+    user: Optional[SafeUser] = _user_cache.get(token)
+    if user is MISSING:
+        generation: int = _user_cache.generation
+        with engine.begin() as conn:
+            user = _get_user_by_token(conn, token)
+        _cache_user(token, user, generation)
+    if user is None:
+        raise HTTPException(status_code=400, detail="Unknown user token")
+    return user
+
+
+async def get_user_by_token_async(token: str) -> SafeUser:
+    user: Optional[SafeUser] = _user_cache.get(token)
+    if user is MISSING:
+        generation: int = _user_cache.generation
+        async with async_engine.begin() as conn:
+            user = await conn.run_sync(_get_user_by_token, token)
+        _cache_user(token, user, generation)
+    if user is None:
+        raise HTTPException(status_code=400, detail="Unknown user token")
+    return user
+
+
+def _update_user(conn, token: str, name: str, leader_card_id: int) -> None:
+    user: Optional[SafeUser] = _get_user_by_token(conn, token)
+    if user is None:
+        logger.warning("user not found. name=%r, leader_card_id=%r", name, leader_card_id)
+        raise InvalidToken
+    result: CursorResult = conn.execute(
+        _update_user_by_token_stmt, dict(name=name, leader_card_id=leader_card_id, b_token=token)
+    )
+    logger.debug("result=%r", result)
 
 
 def update_user(token: str, name: str, leader_card_id: int) -> None:
     with engine.begin() as conn:
-        user: Optional[SafeUser] = _get_user_by_token(conn, token)
-        if user is None:
-            logger.warning(f"user not found. {name=}, {leader_card_id=}")
-            raise InvalidToken
-        query: str = " ".join(
-            (
-                f"UPDATE `{ UserDBTableName.table_name }`",
-                "SET",
-                ", ".join(
-                    (
-                        f"`{ UserDBTableName.name }`=:name",
-                        f"`{ UserDBTableName.leader_card_id }`=:leader_card_id",
-                    )
-                ),
-                f"WHERE `{ UserDBTableName.token }`=:token",
-            )
-        )
-        result: CursorResult = conn.execute(text(query), dict(name=name, leader_card_id=leader_card_id, token=token))
-        logger.info(f"{result=}")
-        logger.info(f"{dir(result)=}")
+        _update_user(conn, token, name, leader_card_id)
+    # after commit: a lookup that read the old row before the commit no longer caches it (TTLCache.generation)
+    _user_cache.invalidate(token)
+
+
+async def update_user_async(token: str, name: str, leader_card_id: int) -> None:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(_update_user, token, name, leader_card_id)
+    _user_cache.invalidate(token)
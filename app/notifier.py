@@ -0,0 +1,68 @@
+# Standard Library
+import asyncio
+import weakref
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Generic
+from typing import Hashable
+from typing import Optional
+from typing import TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class Notifier(Generic[K]):
+    """In-process change notification keyed by e.g. room_id.
+
+    Waiters call `subscribe` *before* reading the state they watch, so that a change committed between the read and
+    the wait is not missed. Notifications only reach waiters of the same process and event loop.
+    """
+
+    def __init__(self) -> None:
+        # an event is kept alive only by its subscribers
+        self._events: "weakref.WeakValueDictionary[K, asyncio.Event]" = weakref.WeakValueDictionary()
+
+    def subscribe(self, key: K) -> asyncio.Event:
+        event: Optional[asyncio.Event] = self._events.get(key)
+        if event is None:
+            event = asyncio.Event()
+            self._events[key] = event
+        return event
+
+    def notify(self, key: K) -> None:
+        event: Optional[asyncio.Event] = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    @staticmethod
+    async def wait(event: asyncio.Event, timeout: Optional[float]) -> bool:
+        """wait for the subscribed event
+
+        Returns:
+            bool: False on timeout
+        """
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """Share one in-flight call per key between concurrent callers."""
+
+    def __init__(self) -> None:
+        self._futures: Dict[K, "asyncio.Future[V]"] = {}
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        future: Optional["asyncio.Future[V]"] = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._futures[key] = future
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        # a cancelled caller must not cancel the call shared with the others
+        return await asyncio.shield(future)
@@ -0,0 +1,109 @@
+"""Presence of the waiting-room members.
+
+Every /room/wait and /room/heartbeat of a member refreshes its last-seen time in memory, so that a heartbeat costs
+no database write. ``run_presence_monitor`` removes the members not seen for ``settings.presence_timeout`` seconds
+through room_model.evict_room_user_async, i.e. the /room/leave path, and hands the host role over or dissolves
+the room when the evicted member was the host.
+
+The state lives in the process and is only touched from the event loop: it requires a single worker.
+"""
+
+# Standard Library
+import asyncio
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+# Local Library
+from . import room_model
+
+logger = getLogger(__name__)
+
+RoomMemberKey = Tuple[int, int]  # (room_id, user_id)
+
+
+class PresenceTracker:
+    """last-seen time of the waiting-room members, least recently seen first"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._last_seen: "OrderedDict[RoomMemberKey, float]" = OrderedDict()
+        # room_id -> user_ids, to forget a whole room when its live starts
+        self._members: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def touch(self, room_id: int, user_id: int) -> None:
+        key: RoomMemberKey = (room_id, user_id)
+        self._last_seen[key] = self._clock()
+        self._last_seen.move_to_end(key)
+        self._members.setdefault(room_id, set()).add(user_id)
+
+    def forget(self, room_id: int, user_id: int) -> None:
+        self._last_seen.pop((room_id, user_id), None)
+        members: Optional[Set[int]] = self._members.get(room_id)
+        if members is not None:
+            members.discard(user_id)
+            if len(members) == 0:
+                del self._members[room_id]
+
+    def forget_room(self, room_id: int) -> None:
+        for user_id in self._members.pop(room_id, set()):
+            self._last_seen.pop((room_id, user_id), None)
+
+    def pop_expired(self, timeout: float) -> List[RoomMemberKey]:
+        """remove and return the members not seen for `timeout` seconds"""
+        deadline: float = self._clock() - timeout
+        expired: List[RoomMemberKey] = []
+        while len(self._last_seen) > 0:
+            key, last_seen = next(iter(self._last_seen.items()))
+            if last_seen > deadline:
+                break
+            self.forget(*key)
+            expired.append(key)
+        return expired
+
+
+# set by the API server when settings.presence_enabled
+tracker: Optional[PresenceTracker] = None
+
+
+def touch(room_id: int, user_id: int) -> None:
+    if tracker is not None:
+        tracker.touch(room_id, user_id)
+
+
+def forget(room_id: int, user_id: int) -> None:
+    if tracker is not None:
+        tracker.forget(room_id, user_id)
+
+
+def forget_room(room_id: int) -> None:
+    if tracker is not None:
+        tracker.forget_room(room_id)
+
+
+async def run_presence_monitor(
+    presence_tracker: PresenceTracker, timeout: float, period: float, host_handover: bool
+) -> None:
+    """evict the members of presence_tracker not seen for `timeout` seconds, every `period` seconds, until cancelled"""
+    while True:
+        await asyncio.sleep(period)
+        for room_id, user_id in presence_tracker.pop_expired(timeout):
+            try:
+                evicted: bool = await room_model.evict_room_user_async(
+                    room_id=room_id, user_id=user_id, host_handover=host_handover
+                )
+            except Exception as e:
+                # e.g. the member has left at the same time
+                logger.warning("failed to evict user_id=%r from room_id=%r: e=%r", user_id, room_id, e)
+                continue
+            if evicted:
+                logger.info("evicted user_id=%r from room_id=%r: no heartbeat for %ss", user_id, room_id, timeout)
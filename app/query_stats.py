@@ -0,0 +1,119 @@
+"""Statements, transactions and database time of each request (settings.query_stats).
+
+``QueryStatsMiddleware`` tracks every request and sends the numbers back as response headers, so that an N+1 loop
+or an extra transaction shows up in the tests (see the `assert_max_queries` fixture of tests/conftest.py) and in
+the logs (settings.query_budget) instead of in production. Meant for development and CI.
+"""
+
+# Standard Library
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from typing import Iterator
+from typing import Optional
+
+# Third Party Library
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+logger = getLogger(__name__)
+
+statements_header: str = "X-Query-Count"
+transactions_header: str = "X-Query-Transactions"
+time_header: str = "X-Query-Time-Ms"
+
+
+class QueryStats:
+    __slots__ = ("statements", "transactions", "seconds")
+
+    def __init__(self) -> None:
+        self.statements: int = 0
+        self.transactions: int = 0
+        self.seconds: float = 0.0
+
+    def __repr__(self) -> str:
+        return f"QueryStats(statements={self.statements}, transactions={self.transactions}, seconds={self.seconds})"
+
+
+# stats of the request being served. It follows the request into the threadpool and into the greenlet of run_sync.
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """count the statements and transactions of the instrumented engines within the block"""
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current_stats.get() is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats: Optional[QueryStats] = _current_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.seconds += time.perf_counter() - context._query_stats_start
+
+
+def _on_begin(conn) -> None:
+    stats: Optional[QueryStats] = _current_stats.get()
+    if stats is not None:
+        stats.transactions += 1
+
+
+def instrument_engine(sync_engine: Engine) -> None:
+    """count the statements of the engine, or of the `sync_engine` of an AsyncEngine, in track_queries"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "begin", _on_begin)
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware sending the QueryStats of each request as X-Query-* headers
+
+    The headers carry the queries made before the response started, i.e. all of them except for the ones of a
+    streaming body. A request over `budget` statements is logged with its final numbers.
+    """
+
+    def __init__(self, app: ASGIApp, budget: Optional[int] = None) -> None:
+        self.app = app
+        self.budget = budget
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_queries() as stats:
+
+            async def send_with_stats(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append(statements_header, str(stats.statements))
+                    headers.append(transactions_header, str(stats.transactions))
+                    headers.append(time_header, f"{stats.seconds * 1e3:.3f}")
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
+        if self.budget is not None and stats.statements > self.budget:
+            logger.warning(
+                "%s %s: %d statements in %d transactions exceed query_budget=%d",
+                scope["method"],
+                scope["path"],
+                stats.statements,
+                stats.transactions,
+                self.budget,
+            )
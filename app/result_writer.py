@@ -0,0 +1,143 @@
+"""Write coalescing of /room/end (settings.room_end_batching).
+
+When a popular live ends, every player of hundreds of rooms calls /room/end within the same second, and each call
+would commit its own transaction. ``ResultWriter`` buffers the results of the concurrent requests and writes them
+with room_model._finish_playing_batch: one transaction of one statement per table for up to
+``settings.room_end_batch_size`` results. Each prebuilt statement is executed with the rows of the batch, so it has
+one shape whatever the batch size, and the MySQL drivers send it as one multi-row INSERT.
+
+- a request is answered once the transaction holding its result has committed, like without batching
+- a batch is written when it is full, or ``settings.room_end_batch_delay`` seconds after its first result arrived
+- at most ``settings.room_end_buffer_size`` results are buffered or being written. Further requests wait for room,
+  so that a burst holds the requests back instead of growing the buffer.
+
+The buffer lives in the process: every worker batches its own requests.
+"""
+
+# Standard Library
+import asyncio
+import contextlib
+from logging import getLogger
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Local Library
+from . import room_model
+from .db import async_engine
+from .leaderboard import BestScore
+from .room_model import RoomUserResult
+
+logger = getLogger(__name__)
+
+PendingResult = Tuple[RoomUserResult, "asyncio.Future[Optional[BestScore]]"]
+
+
+def _resolve(future: "asyncio.Future[Optional[BestScore]]", best_score: Optional[BestScore]) -> None:
+    # the future is cancelled when its request has gone away
+    if not future.done():
+        future.set_result(best_score)
+
+
+class ResultWriter:
+    """buffer of the /room/end results, written by a background task"""
+
+    def __init__(self, batch_size: int, delay: float, buffer_size: int) -> None:
+        self.batch_size: int = batch_size
+        self.delay: float = delay
+        self._buffer: List[PendingResult] = []
+        # a slot is taken by submit and given back once the result is written
+        self._slots = asyncio.Semaphore(buffer_size)
+        self._not_empty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping: bool = False
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """write what is left in the buffer and stop the background task
+
+        The task is not cancelled: a batch being written completes, so that every accepted result is written and
+        answered.
+        """
+        if self._task is not None:
+            self._stopping = True
+            # wakes the task up without waiting for the delay
+            self._not_empty.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        while len(self._buffer) > 0:
+            await self._flush()
+
+    async def submit(self, room_user_result: RoomUserResult) -> Optional[BestScore]:
+        """room_model._finish_playing of the result, in a batch
+
+        Returns:
+            Optional[BestScore]: the score offered to the leaderboard, None if the player is not in the room
+        """
+        await self._slots.acquire()
+        future: "asyncio.Future[Optional[BestScore]]" = asyncio.get_running_loop().create_future()
+        self._buffer.append((room_user_result, future))
+        self._not_empty.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            await self._not_empty.wait()
+            if not self._full.is_set() and not self._stopping:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._full.wait(), self.delay)
+            await self._flush()
+            if self._stopping and len(self._buffer) == 0:
+                return
+
+    def _take_batch(self) -> List[PendingResult]:
+        batch: List[PendingResult] = self._buffer[: self.batch_size]
+        del self._buffer[: self.batch_size]
+        if len(self._buffer) < self.batch_size:
+            self._full.clear()
+        if len(self._buffer) == 0:
+            self._not_empty.clear()
+        return batch
+
+    async def _flush(self) -> None:
+        batch: List[PendingResult] = self._take_batch()
+        if len(batch) == 0:
+            # woken up by stop
+            return
+        try:
+            try:
+                async with async_engine.begin() as conn:
+                    best_scores: List[Optional[BestScore]] = await conn.run_sync(
+                        room_model._finish_playing_batch, [room_user_result for room_user_result, _ in batch]
+                    )
+            except Exception as e:
+                # e.g. a deadlock: one failing result must not fail the others
+                logger.warning("failed to write %d results at once, writing them one by one: e=%r", len(batch), e)
+                await self._write_one_by_one(batch)
+                return
+            for (_, future), best_score in zip(batch, best_scores):
+                _resolve(future, best_score)
+            logger.debug("wrote %d results", len(batch))
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+                self._slots.release()
+
+    @staticmethod
+    async def _write_one_by_one(batch: List[PendingResult]) -> None:
+        for room_user_result, future in batch:
+            try:
+                async with async_engine.begin() as conn:
+                    best_score: Optional[BestScore] = await conn.run_sync(room_model._finish_playing, room_user_result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            _resolve(future, best_score)
@@ -1,18 +1,61 @@
 # Standard Library
+import asyncio
+import base64
+import binascii
+import itertools
+from dataclasses import dataclass
 from enum import IntEnum
 from logging import getLogger
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import Dict
 from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 # Third Party Library
 from pydantic import BaseModel
-from sqlalchemy import text
+from sqlalchemy import BigInteger
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.engine import CursorResult  # type: ignore
 from sqlalchemy.exc import NoResultFound  # type: ignore
 
 # Local Library
+from .cache import MISSING
+from .cache import TTLCache
+from .config import settings
+from .db import BigIntegerPrimaryKey
+from .db import async_engine
 from .db import engine
+from .db import metadata
+from .db import unix_timestamp
+from .leaderboard import BestScore
+from .leaderboard import _update_best_score
+from .leaderboard import _update_best_scores
+from .leaderboard import leaderboards
+from .notifier import Notifier
+from .notifier import SingleFlight
+
+if TYPE_CHECKING:
+    # Local Library
+    from .result_writer import ResultWriter
+    from .room_state import RoomStateEngine
 
 logger = getLogger(__name__)
 
@@ -20,6 +63,16 @@ logger = getLogger(__name__)
 max_user_count: int = 2
 
 
+# notified by the async API path whenever the waiting room state of a room_id changes
+room_wait_notifier: Notifier[int] = Notifier()
+# notified by the async API path whenever a player of the room_id finishes playing
+room_result_notifier: Notifier[int] = Notifier()
+# set by the API server when settings.room_engine == "memory". The async functions below are then served from it.
+room_state_engine: Optional["RoomStateEngine"] = None
+# set by the API server when settings.room_end_batching. finish_playing_async then hands the results over to it.
+room_result_writer: Optional["ResultWriter"] = None
+
+
 class RoomDBTableName:
     """table column names"""
 
@@ -28,6 +81,7 @@ class RoomDBTableName:
     live_id: str = "live_id"  # bigint NOT NULL
     joined_user_count: str = "joined_user_count"  # bigint NOT NULL
     status: str = "status"  # NOT NULL DEFAULT 1
+    updated_at: str = "updated_at"  # bigint NOT NULL DEFAULT 0, epoch seconds of the last change of the row
 
 
 class RoomUserDBTableName:
@@ -59,6 +113,77 @@ const_judge_count_order: List[str] = [
 ]
 
 
+room_table = Table(
+    RoomDBTableName.table_name,
+    metadata,
+    Column(RoomDBTableName.room_id, BigIntegerPrimaryKey, primary_key=True, autoincrement=True),
+    Column(RoomDBTableName.live_id, BigInteger, nullable=False),
+    Column(RoomDBTableName.joined_user_count, BigInteger, nullable=False),
+    Column(RoomDBTableName.status, Integer, nullable=False, server_default="1"),
+    Column(RoomDBTableName.updated_at, BigInteger, nullable=False, server_default="0"),
+    Index("status_live_id", RoomDBTableName.status, RoomDBTableName.live_id),
+    Index("status_updated_at", RoomDBTableName.status, RoomDBTableName.updated_at),
+    # never reuse the id of a deleted row, like AUTO_INCREMENT
+    sqlite_autoincrement=True,
+)
+
+room_user_table = Table(
+    RoomUserDBTableName.table_name,
+    metadata,
+    Column(RoomUserDBTableName.room_id, BigInteger, primary_key=True, autoincrement=False),
+    Column(RoomUserDBTableName.user_id, BigInteger, primary_key=True, autoincrement=False),
+    Column(RoomUserDBTableName.user_name, String(255), nullable=False),
+    Column(RoomUserDBTableName.leader_card_id, Integer),
+    Column(RoomUserDBTableName.select_difficulty, Integer, nullable=False),
+    Column(RoomUserDBTableName.is_host, Boolean, nullable=False),
+    *(Column(judge_name, Integer, server_default="0") for judge_name in const_judge_count_order),
+    Column(RoomUserDBTableName.score, Integer, server_default="0"),
+    Column(RoomUserDBTableName.end_playing, Boolean, nullable=False, server_default="0"),
+    # the rooms of a user (_select_joinable_room_for_update_stmt, the user_play_stats rebuild)
+    Index("user_id", RoomUserDBTableName.user_id),
+)
+
+
+class UserPlayStatsDBTableName:
+    """table column names"""
+
+    table_name: str = "user_play_stats"
+
+    user_id: str = "user_id"  # primary key
+    play_count: str = "play_count"
+    total_score: str = "total_score"
+    best_score: str = "best_score"
+    # and the sum of every column of const_judge_count_order
+    updated_at: str = "updated_at"  # epoch seconds of the last play
+
+
+# per-user totals of the finished plays, incremented by _finish_playing (room_user rows go away with their room)
+user_play_stats_table = Table(
+    UserPlayStatsDBTableName.table_name,
+    metadata,
+    Column(UserPlayStatsDBTableName.user_id, BigInteger, primary_key=True, autoincrement=False),
+    Column(UserPlayStatsDBTableName.play_count, BigInteger, nullable=False),
+    Column(UserPlayStatsDBTableName.total_score, BigInteger, nullable=False),
+    Column(UserPlayStatsDBTableName.best_score, Integer, nullable=False),
+    *(Column(judge_name, BigInteger, nullable=False) for judge_name in const_judge_count_order),
+    Column(UserPlayStatsDBTableName.updated_at, BigInteger, nullable=False),
+)
+
+_room = room_table.c
+_room_user = room_user_table.c
+_user_play_stats = user_play_stats_table.c
+
+# walked in the order of _select_joinable_room_for_update_stmt: the scan stops at the first unlocked room that has a
+# free slot, instead of sorting (and locking) every waiting room of the live
+Index(
+    "status_live_id_joined_user_count",
+    _room.status,
+    _room.live_id,
+    _room.joined_user_count.desc(),
+    _room.room_id,
+)
+
+
 class LiveDifficulty(IntEnum):
     normal: int = 1
     hard: int = 2
@@ -108,38 +233,310 @@ class RoomUser(BaseModel):
         orm_mode = True
 
 
+class UserPlayStats(BaseModel):
+    user_id: int
+    play_count: int = 0
+    total_score: int = 0
+    best_score: int = 0
+    # sums, in the order of const_judge_count_order
+    judge_count_list: List[int] = [0] * len(const_judge_count_order)
+
+
+# Records of the fast response path (settings.fast_response): built straight from rows without validation and
+# encoded by orjson as is. Their fields follow the response models of app/api.py, so the JSON is the same.
+
+
+@dataclass(frozen=True, slots=True)
+class RoomInfoRecord:
+    """RoomInfo"""
+
+    room_id: int
+    live_id: int
+    joined_user_count: int
+    max_user_count: int = max_user_count
+
+
+@dataclass(frozen=True, slots=True)
+class RoomListPageRecord:
+    """api.RoomListResponse"""
+
+    room_info_list: List[RoomInfoRecord]
+    next_cursor: Optional[str]
+
+
+@dataclass(frozen=True, slots=True)
+class WaitRoomUserRecord:
+    """api.WaitResponseRoomUser"""
+
+    user_id: int
+    name: str
+    leader_card_id: int
+    select_difficulty: int
+    is_me: bool
+    is_host: bool
+
+
+@dataclass(frozen=True, slots=True)
+class WaitRoomRecord:
+    """api.RoomWaitResponse"""
+
+    status: WaitRoomStatus
+    room_user_list: List[WaitRoomUserRecord]
+
+
+# statements are built once at import time so that every call hits the compiled statement cache of SQLAlchemy.
+# Bound parameters in the WHERE clause of an UPDATE are prefixed with `b_`: column names are reserved for its SET clause.
+
+# every write to a room row sets updated_at, which tells the sweeper (app/maintenance.py) that the room is alive
+_insert_room_stmt = insert(room_table).values({_room.updated_at: unix_timestamp()})
+_update_room_user_count_stmt = (
+    update(room_table)
+    .where(_room.room_id == bindparam("b_room_id"))
+    .values(
+        {_room.joined_user_count: _room.joined_user_count + bindparam("offset"), _room.updated_at: unix_timestamp()}
+    )
+)
+_insert_room_user_stmt = insert(room_user_table)
+_reserve_room_slot_stmt = (
+    update(room_table)
+    .where(
+        _room.room_id == bindparam("b_room_id"),
+        _room.status == bindparam("room_status"),
+        _room.joined_user_count < bindparam("max_user_count"),
+    )
+    .values({_room.joined_user_count: _room.joined_user_count + 1, _room.updated_at: unix_timestamp()})
+)
+_select_room_stmt = select(_room.room_id, _room.status, _room.joined_user_count).where(
+    _room.room_id == bindparam(RoomDBTableName.room_id)
+)
+_select_joinable_room_for_update_stmt = (
+    select(_room.room_id)
+    .where(
+        _room.status == bindparam("room_status"),
+        _room.live_id == bindparam(RoomDBTableName.live_id),
+        _room.joined_user_count < bindparam("max_user_count"),
+        _room.room_id.not_in(
+            select(_room_user.room_id).where(_room_user.user_id == bindparam(RoomUserDBTableName.user_id))
+        ),
+    )
+    .order_by(_room.joined_user_count.desc(), _room.room_id.asc())
+    .limit(1)
+    .with_for_update(skip_locked=True)
+)
+_select_room_users_stmt = select(
+    _room_user.room_id,
+    _room_user.user_id,
+    _room_user.user_name,
+    _room_user.leader_card_id,
+    _room_user.select_difficulty,
+    _room_user.is_host,
+).where(_room_user.room_id == bindparam(RoomUserDBTableName.room_id))
+_select_room_snapshot_stmt = (
+    select(
+        _room.status,
+        _room_user.user_id,
+        _room_user.user_name,
+        _room_user.leader_card_id,
+        _room_user.select_difficulty,
+        _room_user.is_host,
+        (unix_timestamp() - _room.updated_at).label("idle_seconds"),
+    )
+    .select_from(room_table.outerjoin(room_user_table, _room_user.room_id == _room.room_id))
+    .where(_room.room_id == bindparam(RoomDBTableName.room_id))
+)
+# /room/wait keeps a polled waiting room alive for the sweeper. The condition is evaluated on the current row, so
+# that of the members polling at the same time only one writes.
+_touch_waiting_room_stmt = (
+    update(room_table)
+    .where(
+        _room.room_id == bindparam("b_room_id"),
+        _room.status == int(WaitRoomStatus.Waiting),
+        _room.updated_at <= unix_timestamp() - bindparam("touch_interval"),
+    )
+    .values({_room.updated_at: unix_timestamp()})
+)
+_update_room_status_stmt = (
+    update(room_table)
+    .where(_room.room_id == bindparam("b_room_id"))
+    .values({_room.status: bindparam(RoomDBTableName.status), _room.updated_at: unix_timestamp()})
+)
+_update_room_user_result_stmt = (
+    update(room_user_table)
+    .where(
+        _room_user.room_id == bindparam("b_room_id"),
+        _room_user.user_id == bindparam("b_user_id"),
+    )
+    .values(
+        {
+            name: bindparam(name)
+            for name in const_judge_count_order + [RoomUserDBTableName.score, RoomUserDBTableName.end_playing]
+        }
+    )
+)
+_select_room_user_results_stmt = select(
+    _room_user.room_id,
+    _room_user.user_id,
+    *(_room_user[judge_name] for judge_name in const_judge_count_order),
+    _room_user.score,
+    _room_user.end_playing,
+).where(_room_user.room_id == bindparam(RoomUserDBTableName.room_id))
+_delete_room_users_stmt = delete(room_user_table).where(_room_user.room_id == bindparam(RoomUserDBTableName.room_id))
+_delete_room_user_stmt = delete(room_user_table).where(
+    _room_user.room_id == bindparam(RoomUserDBTableName.room_id),
+    _room_user.user_id == bindparam(RoomUserDBTableName.user_id),
+)
+_delete_room_stmt = delete(room_table).where(_room.room_id == bindparam(RoomDBTableName.room_id))
+_delete_empty_room_stmt = _delete_room_stmt.where(_room.joined_user_count <= 0)
+_select_room_member_for_update_stmt = (
+    select(_room.status, _room_user.is_host)
+    .select_from(room_table.join(room_user_table, _room_user.room_id == _room.room_id))
+    .where(
+        _room.room_id == bindparam(RoomDBTableName.room_id),
+        _room_user.user_id == bindparam(RoomUserDBTableName.user_id),
+    )
+    .with_for_update()
+)
+_select_next_host_stmt = select(func.min(_room_user.user_id)).where(
+    _room_user.room_id == bindparam(RoomUserDBTableName.room_id)
+)
+_update_room_host_stmt = (
+    update(room_user_table)
+    .where(_room_user.room_id == bindparam("b_room_id"), _room_user.user_id == bindparam("b_user_id"))
+    .values({_room_user.is_host: True})
+)
+# locks the seat: of two concurrent /room/end of the same member, the second one sees end_playing of the first
+_select_room_member_profile_for_update_stmt = (
+    select(
+        _room.live_id,
+        _room_user.select_difficulty,
+        _room_user.user_name,
+        _room_user.leader_card_id,
+        _room_user.end_playing,
+    )
+    .select_from(room_table.join(room_user_table, _room_user.room_id == _room.room_id))
+    .where(
+        _room.room_id == bindparam(RoomDBTableName.room_id),
+        _room_user.user_id == bindparam(RoomUserDBTableName.user_id),
+    )
+    .with_for_update()
+)
+
+
+def _build_upsert_user_play_stats_stmt(accumulate: bool, bound_updated_at: bool = False):
+    """INSERT of a user_play_stats row, added to the existing row (`accumulate`) or replacing it
+
+    Args:
+        bound_updated_at (bool): see leaderboard._build_upsert_best_score_stmt
+    """
+    stat_names: List[str] = [
+        UserPlayStatsDBTableName.play_count,
+        UserPlayStatsDBTableName.total_score,
+        UserPlayStatsDBTableName.best_score,
+        *const_judge_count_order,
+    ]
+    values: Dict[str, Any] = {
+        UserPlayStatsDBTableName.user_id: bindparam(UserPlayStatsDBTableName.user_id),
+        **{name: bindparam(name) for name in stat_names},
+        UserPlayStatsDBTableName.updated_at: (
+            bindparam(UserPlayStatsDBTableName.updated_at) if bound_updated_at else unix_timestamp()
+        ),
+    }
+    if settings.db_backend == "sqlite":
+        stmt = sqlite_insert(user_play_stats_table).values(values)
+        new, greatest = stmt.excluded, func.max
+    else:
+        stmt = mysql_insert(user_play_stats_table).values(values)
+        new, greatest = stmt.inserted, func.greatest
+    merged = {name: new[name] for name in stat_names + [UserPlayStatsDBTableName.updated_at]}
+    if accumulate:
+        # increments in the statement: concurrent plays of the same user never lose one another
+        merged.update({name: _user_play_stats[name] + new[name] for name in stat_names})
+        merged[UserPlayStatsDBTableName.best_score] = greatest(
+            _user_play_stats.best_score, new[UserPlayStatsDBTableName.best_score]
+        )
+    if settings.db_backend == "sqlite":
+        return stmt.on_conflict_do_update(index_elements=[_user_play_stats.user_id], set_=merged)
+    return stmt.on_duplicate_key_update(merged)
+
+
+def _build_upsert_room_user_result_stmt():
+    """_update_room_user_result_stmt as an INSERT of a whole room_user row, which only updates the result
+
+    Executed with the rows of a batch, it is sent as one multi-row INSERT by the MySQL drivers, where an UPDATE
+    would be a round trip per row. The rows must exist and be locked by the transaction (see
+    _finish_playing_batch): the INSERT never adds one.
+    """
+    result_names: List[str] = const_judge_count_order + [RoomUserDBTableName.score, RoomUserDBTableName.end_playing]
+    values: Dict[str, Any] = {column.name: bindparam(column.name) for column in room_user_table.columns}
+    if settings.db_backend == "sqlite":
+        sqlite_stmt = sqlite_insert(room_user_table).values(values)
+        return sqlite_stmt.on_conflict_do_update(
+            index_elements=[_room_user.room_id, _room_user.user_id],
+            set_={name: sqlite_stmt.excluded[name] for name in result_names},
+        )
+    mysql_stmt = mysql_insert(room_user_table).values(values)
+    return mysql_stmt.on_duplicate_key_update({name: mysql_stmt.inserted[name] for name in result_names})
+
+
+_upsert_room_user_result_stmt = _build_upsert_room_user_result_stmt()
+_add_user_play_stats_stmt = _build_upsert_user_play_stats_stmt(accumulate=True)
+_add_user_play_stats_batch_stmt = _build_upsert_user_play_stats_stmt(accumulate=True, bound_updated_at=True)
+_replace_user_play_stats_stmt = _build_upsert_user_play_stats_stmt(accumulate=False)
+_select_user_play_stats_stmt = select(user_play_stats_table).where(
+    _user_play_stats.user_id == bindparam(UserPlayStatsDBTableName.user_id)
+)
+_select_room_members_profile_for_update_stmt = (
+    select(
+        _room.live_id,
+        _room_user.room_id,
+        _room_user.user_id,
+        _room_user.user_name,
+        _room_user.leader_card_id,
+        _room_user.select_difficulty,
+        _room_user.is_host,
+        _room_user.end_playing,
+        # updated_at of the rows written by the batch
+        unix_timestamp().label("now"),
+    )
+    .select_from(room_table.join(room_user_table, _room_user.room_id == _room.room_id))
+    .where(_room.room_id.in_(bindparam("room_ids", expanding=True)))
+    .with_for_update()
+)
+_count_rooms_by_status_stmt = select(
+    _room.status, func.count(), func.coalesce(func.sum(_room.joined_user_count), 0)
+).group_by(_room.status)
+
+
+def _create_room(conn, live_id: int) -> int:
+    result: CursorResult = conn.execute(_insert_room_stmt, dict(live_id=live_id, joined_user_count=0))
+    logger.debug("result=%r", result)
+    room_id: int = result.inserted_primary_key[0]
+    logger.debug("room_id=%r", room_id)
+    return room_id
+
+
 def create_room(live_id: int) -> int:
     with engine.begin() as conn:
-        query: str = " ".join(
-            [
-                f"INSERT INTO `{ RoomDBTableName.table_name }`",
-                f"SET `{ RoomDBTableName.live_id }`=:live_id,"
-                f"`{ RoomDBTableName.joined_user_count }`=:joined_user_count",
-            ]
-        )
-        result: CursorResult = conn.execute(text(query), dict(live_id=live_id, joined_user_count=0))
-        logger.info(f"{result=}")
-        logger.info(f"{result.lastrowid=}")
-        room_id: int = result.lastrowid
-        return room_id
+        return _create_room(conn, live_id)
+
+
+async def create_room_async(live_id: int) -> int:
+    async with async_engine.begin() as conn:
+        room_id: int = await conn.run_sync(_create_room, live_id)
+    if room_state_engine is not None:
+        room_state_engine.add_room(room_id, live_id)
+    return room_id
 
 
 def _update_room_user_count(conn, room_id: int, offset: int) -> None:
-    query: str = " ".join(
-        [
-            f"UPDATE `{ RoomDBTableName.table_name }`",
-            f"SET `{ RoomDBTableName.joined_user_count }`={ RoomDBTableName.joined_user_count } + :offset",
-            f"WHERE `{ RoomDBTableName.room_id }`=:room_id",
-        ]
-    )
     result: CursorResult = conn.execute(
-        text(query),
+        _update_room_user_count_stmt,
         dict(
             offset=offset,
-            room_id=room_id,
+            b_room_id=room_id,
         ),
     )
-    logger.info(f"{result=}")
+    logger.debug("result=%r", result)
     return
 
 
@@ -152,68 +549,88 @@ def _create_room_user(
     live_difficulty: LiveDifficulty,
     is_host: bool,
 ):
-    query: str = " ".join(
-        (
-            f"INSERT INTO `{ RoomUserDBTableName.table_name }`",
-            "SET",
-            ", ".join(
-                (
-                    f"`{ RoomUserDBTableName.room_id }`=:room_id",
-                    f"`{ RoomUserDBTableName.user_id }`=:user_id",
-                    f"`{ RoomUserDBTableName.user_name }`=:user_name",
-                    f"`{ RoomUserDBTableName.leader_card_id }`=:leader_card_id",
-                    f"`{ RoomUserDBTableName.select_difficulty }`=:live_difficulty",
-                    f"`{ RoomUserDBTableName.is_host }`=:is_host",
-                )
-            ),
-        )
-    )
     result: CursorResult = conn.execute(
-        text(query),
+        _insert_room_user_stmt,
         dict(
             room_id=room_id,
             user_id=user_id,
             user_name=user_name,
             leader_card_id=leader_card_id,
-            live_difficulty=int(live_difficulty),
+            select_difficulty=int(live_difficulty),
             is_host=is_host,
         ),
     )
-    logger.info(f"{result=}")
+    logger.debug("result=%r", result)
 
 
-def _get_room_info_by_id(conn, room_id: int) -> Optional[RoomInfo]:
-    query: str = " ".join(
-        (
-            f"SELECT `{ RoomDBTableName.room_id }`, `{ RoomDBTableName.live_id }`, `{ RoomDBTableName.joined_user_count }`",
-            f"FROM `{ RoomDBTableName.table_name }`",
-            f"WHERE `{ RoomDBTableName.room_id }`=:room_id",
-        )
+def _reserve_room_slot(conn, room_id: int) -> bool:
+    """increment joined_user_count only if the room is Waiting and not full
+
+    Returns:
+        bool: True if a slot has been reserved
+    """
+    result: CursorResult = conn.execute(
+        _reserve_room_slot_stmt,
+        dict(b_room_id=room_id, room_status=int(WaitRoomStatus.Waiting), max_user_count=max_user_count),
     )
-    result = conn.execute(text(query), dict(room_id=room_id))
-    row = result.one()
+    return result.rowcount == 1
+
+
+def _get_join_room_failure(conn, room_id: int) -> JoinRoomResult:
+    """why _reserve_room_slot did not update the room"""
+    row = conn.execute(_select_room_stmt, dict(room_id=room_id)).one_or_none()
     if row is None:
-        return row
-    return RoomInfo.from_orm(row)
+        return JoinRoomResult.Disbanded
+    if row.joined_user_count >= max_user_count:
+        return JoinRoomResult.RoomFull
+    return JoinRoomResult.OhterError
 
 
 def _get_room_status(conn, room_id: int) -> RoomStatus:
-    query: str = " ".join(
-        [
-            f"SELECT `{ RoomDBTableName.room_id }`, `{ RoomDBTableName.status }`",
-            f"FROM `{ RoomDBTableName.table_name }`",
-            f"WHERE `{ RoomDBTableName.room_id }`=:room_id",
-        ]
-    )
-    result = conn.execute(text(query), dict(room_id=room_id))
+    result = conn.execute(_select_room_stmt, dict(room_id=room_id))
     try:
         row = result.one()
     except NoResultFound as e:
-        logger.error(f"{e=}", exc_info=True)
+        logger.error("e=%r", e, exc_info=True)
         raise e
     return RoomStatus.from_orm(row)
 
 
+def _join_room(
+    conn,
+    user_id: int,
+    room_id: int,
+    user_name: str,
+    leader_card_id: int,
+    live_difficulty: LiveDifficulty,
+    is_host: bool = False,
+) -> JoinRoomResult:
+    # The member row is inserted first and the slot is reserved last by a conditional UPDATE,
+    # so the room row is locked only from that UPDATE to the commit.
+    savepoint = conn.begin_nested()
+    try:
+        _create_room_user(
+            conn=conn,
+            room_id=room_id,
+            user_id=user_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+            is_host=is_host,
+        )
+        reserved: bool = _reserve_room_slot(conn, room_id=room_id)
+    except Exception as e:
+        # e.g. the user has already joined the room
+        logger.info("e=%r", e, exc_info=True)
+        savepoint.rollback()
+        return JoinRoomResult.OhterError
+    if not reserved:
+        savepoint.rollback()
+        return _get_join_room_failure(conn, room_id=room_id)
+    savepoint.commit()
+    return JoinRoomResult.Ok
+
+
 def join_room(
     user_id: int,
     room_id: int,
@@ -223,44 +640,262 @@ def join_room(
     is_host: bool = False,
 ) -> JoinRoomResult:
     with engine.begin() as conn:
-        try:
-            # lock
-            conn.execute(
-                text(
-                    f"SELECT * FROM `{ RoomDBTableName.table_name }` WHERE `{ RoomDBTableName.room_id }`=:room_id FOR UPDATE"
-                ),
-                dict(room_id=room_id),
+        return _join_room(
+            conn,
+            user_id=user_id,
+            room_id=room_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+            is_host=is_host,
+        )
+
+
+async def join_room_async(
+    user_id: int,
+    room_id: int,
+    user_name: str,
+    leader_card_id: int,
+    live_difficulty: LiveDifficulty,
+    is_host: bool = False,
+) -> JoinRoomResult:
+    join_room_result: JoinRoomResult
+    if room_state_engine is not None:
+        join_room_result = room_state_engine.join_room(
+            user_id=user_id,
+            room_id=room_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+            is_host=is_host,
+        )
+    else:
+        async with async_engine.begin() as conn:
+            join_room_result = await conn.run_sync(
+                _join_room,
+                user_id=user_id,
+                room_id=room_id,
+                user_name=user_name,
+                leader_card_id=leader_card_id,
+                live_difficulty=live_difficulty,
+                is_host=is_host,
             )
+    if join_room_result == JoinRoomResult.Ok:
+        room_wait_notifier.notify(room_id)
+    return join_room_result
+
+
+class RoomListOrder(IntEnum):
+    oldest = 1  # room_id ascending
+    newest = 2  # room_id descending
+    fewest_free_slots = 3  # joined_user_count descending, then room_id ascending
+
+
+class InvalidCursor(Exception):
+    """指定されたcursorが不正だったときに投げる"""
+
+
+class RoomListCursor(BaseModel):
+    """position after the last room of a page. Clients only see the opaque `encode()`d string."""
+
+    order: RoomListOrder
+    room_id: int
+    joined_user_count: int
 
-            room_info: Optional[RoomInfo] = _get_room_info_by_id(conn, room_id=room_id)
-            if room_info is None:
-                return JoinRoomResult.Disbanded
-            if room_info.joined_user_count >= room_info.max_user_count:
-                return JoinRoomResult.RoomFull
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(self.json().encode()).decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> "RoomListCursor":
+        try:
+            return cls.parse_raw(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, binascii.Error) as e:
+            raise InvalidCursor(f"{cursor=}") from e
+
+
+def room_list_sort_key(order: RoomListOrder, room_id: int, joined_user_count: int) -> Tuple[int, int]:
+    """ascending key matching the ORDER BY of _get_rooms_by_live_id"""
+    if order == RoomListOrder.newest:
+        return (-room_id, 0)
+    if order == RoomListOrder.fewest_free_slots:
+        return (-joined_user_count, room_id)
+    return (room_id, 0)
+
+
+class RoomListPage(BaseModel):
+    room_info_list: List[RoomInfo]
+    next_cursor: Optional[str]
+
+
+def _split_room_list_page(rooms: list, order: RoomListOrder, limit: int) -> Tuple[list, Optional[str]]:
+    """cut up to `limit + 1` rooms (RoomInfo or RoomInfoRecord) into a page and the cursor of the next page
+
+    The extra room only tells that a next page exists.
+    """
+    if len(rooms) <= limit:
+        return rooms, None
+    last = rooms[limit - 1]
+    cursor = RoomListCursor(order=order, room_id=last.room_id, joined_user_count=last.joined_user_count)
+    return rooms[:limit], cursor.encode()
+
+
+def _make_room_list_page(room_info_list: List[RoomInfo], order: RoomListOrder, limit: int) -> RoomListPage:
+    room_info_list, next_cursor = _split_room_list_page(room_info_list, order=order, limit=limit)
+    return RoomListPage(room_info_list=room_info_list, next_cursor=next_cursor)
+
+
+def _build_select_rooms_stmt(all_live: bool, order: RoomListOrder, keyset: bool, limited: bool):
+    """one variant of the SELECT of _get_rooms_by_live_id"""
+    stmt = select(_room.room_id, _room.live_id, _room.joined_user_count).where(_room.status == bindparam("room_status"))
+    if not all_live:
+        stmt = stmt.where(_room.live_id == bindparam(RoomDBTableName.live_id))
+    after_room_id = bindparam("after_room_id")
+    after_joined_user_count = bindparam("after_joined_user_count")
+    if order == RoomListOrder.newest:
+        keyset_condition = _room.room_id < after_room_id
+        order_by = (_room.room_id.desc(),)
+    elif order == RoomListOrder.fewest_free_slots:
+        keyset_condition = or_(
+            _room.joined_user_count < after_joined_user_count,
+            and_(_room.joined_user_count == after_joined_user_count, _room.room_id > after_room_id),
+        )
+        order_by = (_room.joined_user_count.desc(), _room.room_id.asc())
+    else:
+        keyset_condition = _room.room_id > after_room_id
+        order_by = (_room.room_id.asc(),)
+    if keyset:
+        stmt = stmt.where(keyset_condition)
+    stmt = stmt.order_by(*order_by)
+    if limited:
+        stmt = stmt.limit(bindparam("limit"))
+    return stmt
 
-            room_status: RoomStatus = _get_room_status(conn=conn, room_id=room_id)
-            if room_status.status != WaitRoomStatus.Waiting:
-                return JoinRoomResult.OhterError
 
-            _create_room_user(
-                conn=conn,
+# (all live, order, after a cursor, limited) -> statement
+_select_rooms_stmts = {
+    key: _build_select_rooms_stmt(*key)
+    for key in itertools.product((False, True), RoomListOrder, (False, True), (False, True))
+}
+
+
+def _find_joinable_room_for_update(conn, live_id: int, user_id: int) -> Optional[int]:
+    """lock a Waiting, non-full room of the live that the user has not joined yet
+
+    Rows locked by other joiners are skipped instead of waited for.
+    The fullest room is preferred so that rooms fill up and start quickly.
+    """
+    row = conn.execute(
+        _select_joinable_room_for_update_stmt,
+        dict(
+            room_status=int(WaitRoomStatus.Waiting),
+            live_id=live_id,
+            max_user_count=max_user_count,
+            user_id=user_id,
+        ),
+    ).one_or_none()
+    if row is None:
+        return None
+    return int(row.room_id)
+
+
+def _quick_join_room(
+    conn,
+    live_id: int,
+    user_id: int,
+    user_name: str,
+    leader_card_id: int,
+    live_difficulty: LiveDifficulty,
+) -> Tuple[int, bool]:
+    """join a free room of the live, or create one and join it as the host
+
+    Returns:
+        Tuple[int, bool]: room_id, is_host
+    """
+    room_id: Optional[int] = _find_joinable_room_for_update(conn, live_id=live_id, user_id=user_id)
+    is_host: bool = room_id is None
+    if room_id is None:
+        room_id = _create_room(conn, live_id)
+    _create_room_user(
+        conn=conn,
+        room_id=room_id,
+        user_id=user_id,
+        user_name=user_name,
+        leader_card_id=leader_card_id,
+        live_difficulty=live_difficulty,
+        is_host=is_host,
+    )
+    _update_room_user_count(conn=conn, room_id=room_id, offset=1)
+    return room_id, is_host
+
+
+def quick_join_room(
+    live_id: int,
+    user_id: int,
+    user_name: str,
+    leader_card_id: int,
+    live_difficulty: LiveDifficulty,
+) -> Tuple[int, bool]:
+    with engine.begin() as conn:
+        return _quick_join_room(
+            conn,
+            live_id=live_id,
+            user_id=user_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+        )
+
+
+async def quick_join_room_async(
+    live_id: int,
+    user_id: int,
+    user_name: str,
+    leader_card_id: int,
+    live_difficulty: LiveDifficulty,
+) -> Tuple[int, bool]:
+    room_id: Optional[int]
+    is_host: bool
+    if room_state_engine is not None:
+        room_id = room_state_engine.quick_join_room(
+            live_id=live_id,
+            user_id=user_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+        )
+        is_host = room_id is None
+        if room_id is None:
+            room_id = await create_room_async(live_id)
+            room_state_engine.join_room(
+                user_id=user_id,
                 room_id=room_id,
+                user_name=user_name,
+                leader_card_id=leader_card_id,
+                live_difficulty=live_difficulty,
+                is_host=True,
+            )
+    else:
+        async with async_engine.begin() as conn:
+            room_id, is_host = await conn.run_sync(
+                _quick_join_room,
+                live_id=live_id,
                 user_id=user_id,
                 user_name=user_name,
                 leader_card_id=leader_card_id,
                 live_difficulty=live_difficulty,
-                is_host=is_host,
             )
-            _update_room_user_count(conn=conn, room_id=room_id, offset=1)
-
-            _ = conn.execute(text("COMMIT"), {})
-            return JoinRoomResult.Ok
-        except Exception as e:
-            logger.info(f"{e=}", exc_info=True)
-            return JoinRoomResult.OhterError
+    room_wait_notifier.notify(room_id)
+    return room_id, is_host
 
 
-def _get_rooms_by_live_id(conn, live_id: int, room_status:WaitRoomStatus = WaitRoomStatus.Waiting) -> Iterator[RoomInfo]:
+def _get_rooms_by_live_id(
+    conn,
+    live_id: int,
+    room_status: WaitRoomStatus = WaitRoomStatus.Waiting,
+    order: RoomListOrder = RoomListOrder.oldest,
+    after: Optional[RoomListCursor] = None,
+    limit: Optional[int] = None,
+) -> Iterator[RoomInfo]:
     """list rooms
 
     Args:
@@ -268,59 +903,148 @@ def _get_rooms_by_live_id(conn, live_id: int, room_status:WaitRoomStatus = WaitR
         live_id (int):
             If 0, get all rooms.
             Others, get rooms by live_id.
-
+        order (RoomListOrder): ordering of the rooms
+        after (Optional[RoomListCursor]): keyset pagination, list the rooms after this position
+        limit (Optional[int]): max number of rooms
 
     Yields:
-        [type]: [description]
+        RoomInfo:
     """
-    query: str = " ".join(
-        [
-            "SELECT",
-            ", ".join(
-                (
-                    f"`{ RoomDBTableName.room_id }`",
-                    f"`{ RoomDBTableName.live_id }`",
-                    f"`{ RoomDBTableName.joined_user_count }`",
-                )
-            ),
-            f"FROM `{ RoomDBTableName.table_name }`",
-            f"WHERE `{ RoomDBTableName.status }`=:room_status",
-        ]
-        + ([] if live_id == 0 else [f"AND `{ RoomDBTableName.live_id }`=:live_id"])
-    )
-    result = conn.execute(text(query), dict(room_status=int(room_status), live_id=live_id))
-    for row in result.all():
+    for row in _select_rooms(conn, live_id, room_status=room_status, order=order, after=after, limit=limit):
         yield RoomInfo.from_orm(row)
 
 
+def _select_rooms(
+    conn,
+    live_id: int,
+    room_status: WaitRoomStatus = WaitRoomStatus.Waiting,
+    order: RoomListOrder = RoomListOrder.oldest,
+    after: Optional[RoomListCursor] = None,
+    limit: Optional[int] = None,
+) -> list:
+    """(room_id, live_id, joined_user_count) rows of _get_rooms_by_live_id"""
+    stmt = _select_rooms_stmts[(live_id == 0, order, after is not None, limit is not None)]
+    result = conn.execute(
+        stmt,
+        dict(
+            room_status=int(room_status),
+            live_id=live_id,
+            after_room_id=None if after is None else after.room_id,
+            after_joined_user_count=None if after is None else after.joined_user_count,
+            limit=limit,
+        ),
+    )
+    return result.all()
+
+
+def _get_room_info_records(
+    conn, live_id: int, order: RoomListOrder, after: Optional[RoomListCursor], limit: int
+) -> List[RoomInfoRecord]:
+    # rows are (room_id, live_id, joined_user_count)
+    return [RoomInfoRecord(*row) for row in _select_rooms(conn, live_id, order=order, after=after, limit=limit)]
+
+
 def get_rooms_by_live_id(live_id: int) -> List[RoomInfo]:
     with engine.begin() as conn:
         return list(_get_rooms_by_live_id(conn, live_id))
 
 
+async def get_rooms_by_live_id_async(live_id: int) -> List[RoomInfo]:
+    if room_state_engine is not None:
+        return room_state_engine.get_rooms_by_live_id(live_id)
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(lambda sync_conn: list(_get_rooms_by_live_id(sync_conn, live_id)))
+
+
+def _decode_room_list_cursor(order: RoomListOrder, cursor: Optional[str]) -> Optional[RoomListCursor]:
+    if cursor is None:
+        return None
+    after: RoomListCursor = RoomListCursor.decode(cursor)
+    if after.order != order:
+        raise InvalidCursor(f"the cursor was issued for {after.order=}, not for {order=}")
+    return after
+
+
+def get_room_list_page(
+    live_id: int, limit: int, order: RoomListOrder = RoomListOrder.oldest, cursor: Optional[str] = None
+) -> RoomListPage:
+    """list Waiting rooms page by page
+
+    Raises:
+        InvalidCursor: the cursor is broken or was issued for another order
+    """
+    after: Optional[RoomListCursor] = _decode_room_list_cursor(order, cursor)
+    with engine.begin() as conn:
+        room_info_list: List[RoomInfo] = list(
+            _get_rooms_by_live_id(conn, live_id, order=order, after=after, limit=limit + 1)
+        )
+    return _make_room_list_page(room_info_list, order=order, limit=limit)
+
+
+async def get_room_list_page_async(
+    live_id: int, limit: int, order: RoomListOrder = RoomListOrder.oldest, cursor: Optional[str] = None
+) -> RoomListPage:
+    after: Optional[RoomListCursor] = _decode_room_list_cursor(order, cursor)
+    room_info_list: List[RoomInfo]
+    if room_state_engine is not None:
+        room_info_list = room_state_engine.get_rooms_by_live_id(live_id, order=order, after=after, limit=limit + 1)
+    else:
+        async with async_engine.begin() as conn:
+            room_info_list = await conn.run_sync(
+                lambda sync_conn: list(
+                    _get_rooms_by_live_id(sync_conn, live_id, order=order, after=after, limit=limit + 1)
+                )
+            )
+    return _make_room_list_page(room_info_list, order=order, limit=limit)
+
+
+async def get_room_list_page_record_async(
+    live_id: int, limit: int, order: RoomListOrder = RoomListOrder.oldest, cursor: Optional[str] = None
+) -> RoomListPageRecord:
+    """get_room_list_page_async for the fast response path"""
+    after: Optional[RoomListCursor] = _decode_room_list_cursor(order, cursor)
+    room_info_list: List[RoomInfoRecord]
+    if room_state_engine is not None:
+        room_info_list = room_state_engine.get_room_info_records(live_id, order=order, after=after, limit=limit + 1)
+    else:
+        async with async_engine.begin() as conn:
+            room_info_list = await conn.run_sync(
+                _get_room_info_records, live_id, order=order, after=after, limit=limit + 1
+            )
+    room_info_list, next_cursor = _split_room_list_page(room_info_list, order=order, limit=limit)
+    return RoomListPageRecord(room_info_list=room_info_list, next_cursor=next_cursor)
+
+
 def get_room_status(room_id: int) -> RoomStatus:
     with engine.begin() as conn:
         return _get_room_status(conn, room_id)
 
 
+async def get_room_status_async(room_id: int) -> RoomStatus:
+    if room_state_engine is not None:
+        return room_state_engine.get_room_status(room_id)
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_get_room_status, room_id)
+
+
+def _count_rooms_by_status(conn) -> Dict[str, Tuple[int, int]]:
+    counts: Dict[str, Tuple[int, int]] = {status.name: (0, 0) for status in WaitRoomStatus}
+    for status, room_count, joined_user_count in conn.execute(_count_rooms_by_status_stmt):
+        counts[WaitRoomStatus(status).name] = (room_count, int(joined_user_count))
+    return counts
+
+
+def count_rooms_by_status() -> Dict[str, Tuple[int, int]]:
+    """WaitRoomStatus name -> (rooms, joined players), the room gauges of /metrics"""
+    with engine.begin() as conn:
+        return _count_rooms_by_status(conn)
+
+
 def _get_room_users(conn, room_id: int, user_id_req: int = None) -> Iterator[RoomUser]:
-    query: str = " ".join(
-        [
-            "SELECT",
-            f"`{ RoomUserDBTableName.room_id }`,",
-            f"`{ RoomUserDBTableName.user_id }`,",
-            f"`{ RoomUserDBTableName.user_name }`,",
-            f"`{ RoomUserDBTableName.leader_card_id }`,",
-            f"`{ RoomUserDBTableName.select_difficulty }`,",
-            f"`{ RoomUserDBTableName.is_host }`",
-            f"FROM `{ RoomUserDBTableName.table_name }`",
-            f"WHERE `{ RoomUserDBTableName.room_id }`=:room_id",
-        ]
-    )
-    result = conn.execute(text(query), dict(room_id=room_id))
+    result = conn.execute(_select_room_users_stmt, dict(room_id=room_id))
     for row in result.all():
         room_user: RoomUser = RoomUser.from_orm(row)
-        logger.info(f"{room_user}")
+        logger.debug("%s", room_user)
         if user_id_req is not None and room_user.user_id == user_id_req:
             room_user.is_me = True
         yield room_user
@@ -332,6 +1056,106 @@ def get_room_users(room_id: int, user_id_req: int) -> List[RoomUser]:
     return users
 
 
+async def get_room_users_async(room_id: int, user_id_req: int) -> List[RoomUser]:
+    if room_state_engine is not None:
+        return room_state_engine.get_room_users(room_id, user_id_req=user_id_req)
+    async with async_engine.begin() as conn:
+        users: List[RoomUser] = await conn.run_sync(
+            lambda sync_conn: list(_get_room_users(sync_conn, room_id, user_id_req=user_id_req))
+        )
+    return users
+
+
+class RoomSnapshot(BaseModel):
+    room_id: int
+    status: WaitRoomStatus
+    room_user_list: List[RoomUser]
+
+
+def _touch_waiting_room(conn, room_id: int, status: int, idle_seconds: int) -> None:
+    """refresh updated_at of a polled Waiting room, at most every settings.room_wait_touch_interval seconds"""
+    if status != WaitRoomStatus.Waiting or idle_seconds < settings.room_wait_touch_interval:
+        return
+    conn.execute(
+        _touch_waiting_room_stmt, dict(b_room_id=room_id, touch_interval=int(settings.room_wait_touch_interval))
+    )
+
+
+def _get_room_snapshot(conn, room_id: int, user_id_req: Optional[int] = None) -> Optional[RoomSnapshot]:
+    """status and members of a room read by a single statement
+
+    A room without members yields one row whose room_user columns are NULL.
+    A Waiting room is kept alive for the sweeper (_touch_waiting_room).
+
+    Returns:
+        Optional[RoomSnapshot]: None if the room does not exist
+    """
+    rows = conn.execute(_select_room_snapshot_stmt, dict(room_id=room_id)).all()
+    if len(rows) == 0:
+        return None
+    _touch_waiting_room(conn, room_id, status=rows[0].status, idle_seconds=rows[0].idle_seconds)
+    room_user_list: List[RoomUser] = [
+        RoomUser(
+            room_id=room_id,
+            user_id=row.user_id,
+            user_name=row.user_name,
+            leader_card_id=row.leader_card_id,
+            select_difficulty=row.select_difficulty,
+            is_me=row.user_id == user_id_req,
+            is_host=row.is_host,
+        )
+        for row in rows
+        if row.user_id is not None
+    ]
+    return RoomSnapshot(room_id=room_id, status=rows[0].status, room_user_list=room_user_list)
+
+
+def get_room_snapshot(room_id: int, user_id_req: Optional[int] = None) -> Optional[RoomSnapshot]:
+    with engine.begin() as conn:
+        return _get_room_snapshot(conn, room_id, user_id_req=user_id_req)
+
+
+async def get_room_snapshot_async(room_id: int, user_id_req: Optional[int] = None) -> Optional[RoomSnapshot]:
+    if room_state_engine is not None:
+        return room_state_engine.get_room_snapshot(room_id, user_id_req=user_id_req)
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_get_room_snapshot, room_id, user_id_req=user_id_req)
+
+
+def _get_wait_room_record(conn, room_id: int, user_id_req: Optional[int] = None) -> Optional[WaitRoomRecord]:
+    """_get_room_snapshot for the fast response path"""
+    rows = conn.execute(_select_room_snapshot_stmt, dict(room_id=room_id)).all()
+    if len(rows) == 0:
+        return None
+    _touch_waiting_room(conn, room_id, status=rows[0].status, idle_seconds=rows[0].idle_seconds)
+    room_user_list: List[WaitRoomUserRecord] = [
+        WaitRoomUserRecord(user_id, user_name, leader_card_id, select_difficulty, user_id == user_id_req, is_host)
+        for _, user_id, user_name, leader_card_id, select_difficulty, is_host, _ in rows
+        if user_id is not None
+    ]
+    return WaitRoomRecord(status=WaitRoomStatus(rows[0].status), room_user_list=room_user_list)
+
+
+async def get_wait_room_record_async(room_id: int, user_id_req: Optional[int] = None) -> Optional[WaitRoomRecord]:
+    """get_room_snapshot_async for the fast response path. None if the room does not exist."""
+    if room_state_engine is not None:
+        return room_state_engine.get_wait_room_record(room_id, user_id_req=user_id_req)
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_get_wait_room_record, room_id, user_id_req=user_id_req)
+
+
+def _start_room(conn, room_id: int) -> None:
+    result = conn.execute(
+        _update_room_status_stmt,
+        dict(
+            status=int(WaitRoomStatus.LiveStart),
+            b_room_id=room_id,
+        ),
+    )
+    logger.debug("result=%r", result)
+    return
+
+
 def start_room(room_id: int) -> None:
     """update room's status to LiveStart
 
@@ -342,22 +1166,17 @@ def start_room(room_id: int) -> None:
         [type]: [description]
     """
     with engine.begin() as conn:
-        query: str = " ".join(
-            [
-                f"UPDATE `{ RoomDBTableName.table_name }`",
-                f"SET `{ RoomDBTableName.status }`=:status",
-                f"WHERE `{ RoomDBTableName.room_id }`=:room_id",
-            ]
-        )
-        result = conn.execute(
-            text(query),
-            dict(
-                status=int(WaitRoomStatus.LiveStart),
-                room_id=room_id,
-            ),
-        )
-        logger.info(f"{result=}")
-        return
+        _start_room(conn, room_id)
+
+
+async def start_room_async(room_id: int) -> None:
+    """update room's status to LiveStart"""
+    if room_state_engine is not None:
+        room_state_engine.start_room(room_id)
+    else:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_start_room, room_id)
+    room_wait_notifier.notify(room_id)
 
 
 class RoomUserResult(BaseModel):
@@ -376,27 +1195,8 @@ class RoomUserResult(BaseModel):
 
 
 def _store_room_user_result(conn, room_user_result: RoomUserResult) -> None:
-    query: str = " ".join(
-        [
-            f"UPDATE `{ RoomUserDBTableName.table_name }`",
-            "SET",
-            ", ".join(
-                (
-                    f"`{ RoomUserDBTableName.judge_count_perfect }`=:judge_count_perfect",
-                    f"`{ RoomUserDBTableName.judge_count_great    }`=:judge_count_great",
-                    f"`{ RoomUserDBTableName.judge_count_good   }`=:judge_count_good",
-                    f"`{ RoomUserDBTableName.judge_count_bad     }`=:judge_count_bad",
-                    f"`{ RoomUserDBTableName.judge_count_miss    }`=:judge_count_miss",
-                    f"`{ RoomUserDBTableName.score }`=:score",
-                    f"`{ RoomUserDBTableName.end_playing }`=:end_playing",
-                )
-            ),
-            f"WHERE `{ RoomUserDBTableName.room_id }`=:room_id",
-            f"AND `{ RoomUserDBTableName.user_id }`=:user_id",
-        ]
-    )
     result = conn.execute(
-        text(query),
+        _update_room_user_result_stmt,
         dict(
             judge_count_perfect=room_user_result.judge_count_perfect,
             judge_count_great=room_user_result.judge_count_great,
@@ -405,46 +1205,18 @@ def _store_room_user_result(conn, room_user_result: RoomUserResult) -> None:
             judge_count_miss=room_user_result.judge_count_miss,
             score=room_user_result.score,
             end_playing=room_user_result.end_playing,
-            room_id=room_user_result.room_id,
-            user_id=room_user_result.user_id,
+            b_room_id=room_user_result.room_id,
+            b_user_id=room_user_result.user_id,
         ),
     )
-    logger.info(f"{result=}")
+    logger.debug("result=%r", result)
     return
 
 
-def _get_room_user_result(conn, room_id: int, user_id: int) -> Optional[RoomUserResult]:
-    query: str = " ".join(
-        [
-            "SELECT",
-            ", ".join(
-                (
-                    f"`{ RoomUserDBTableName.room_id }`",
-                    f"`{ RoomUserDBTableName.user_id }`",
-                    f"`{ RoomUserDBTableName.judge_count_perfect }`",
-                    f"`{ RoomUserDBTableName.judge_count_great }`",
-                    f"`{ RoomUserDBTableName.judge_count_good }`",
-                    f"`{ RoomUserDBTableName.judge_count_bad }`",
-                    f"`{ RoomUserDBTableName.judge_count_miss }`",
-                    f"`{ RoomUserDBTableName.score }`",
-                    f"`{ RoomUserDBTableName.end_playing }`",
-                )
-            ),
-            f"FROM `{ RoomUserDBTableName.table_name }`",
-            f"WHERE `{ RoomUserDBTableName.room_id }`=:room_id",
-            f"AND `{ RoomUserDBTableName.user_id }`=:user_id",
-        ]
-    )
-    result = conn.execute(
-        text(query),
-        dict(room_id=room_id, user_id=user_id),
-    )
-    try:
-        row = result.one()
-    except NoResultFound as e:
-        logger.warning(f"{e=}", exc_info=True)
-        return None
-    return RoomUserResult.from_orm(row)
+def _get_room_user_results(conn, room_id: int) -> Iterator[RoomUserResult]:
+    result = conn.execute(_select_room_user_results_stmt, dict(room_id=room_id))
+    for row in result.all():
+        yield RoomUserResult.from_orm(row)
 
 
 class ResultUser(BaseModel):
@@ -453,109 +1225,377 @@ class ResultUser(BaseModel):
     score: int
 
 
-def get_result_user_list(room_id: int) -> List[ResultUser]:
-    with engine.begin() as conn:
-        result_user_list: List[ResultUser] = []
+def _get_result_user_list(conn, room_id: int) -> List[ResultUser]:
+    result_user_list: List[ResultUser] = []
 
-        room_user: RoomUser
-        for room_user in _get_room_users(conn, room_id=room_id):
-            room_user_result: Optional[RoomUserResult] = _get_room_user_result(
-                conn,
-                room_id=room_id,
-                user_id=room_user.user_id,
+    room_user_result: RoomUserResult
+    for room_user_result in _get_room_user_results(conn, room_id=room_id):
+        if room_user_result.end_playing is False:
+            # 他のプレイヤーが結果を返すまでポーリングし続ける
+            return []
+        result_user_list.append(
+            ResultUser(
+                user_id=room_user_result.user_id,
+                judge_count_list=[getattr(room_user_result, judge_name) for judge_name in const_judge_count_order],
+                score=room_user_result.score,
             )
-            if room_user_result is None:
-                logger.warning(f"{room_user.user_id=} is empty")
-                continue
-            if room_user_result.end_playing is False:
-                # 他のプレイヤーが結果を返すまでポーリングし続ける
-                return []
-            result_user_list.append(
-                ResultUser(
-                    user_id=room_user.user_id,
-                    judge_count_list=[getattr(room_user_result, judge_name) for judge_name in const_judge_count_order],
-                    score=room_user_result.score,
-                )
-            )
-        return result_user_list
+        )
+    return result_user_list
 
 
-def _drop_room(conn, room_id: int):
-    query: str = " ".join(
-        [
-            f"DELETE FROM `{ RoomDBTableName.table_name }`",
-            f"WHERE `{ RoomDBTableName.room_id }`=:room_id",
-        ]
-    )
+# room_id -> complete result, i.e. once every player has finished playing. A repeated /room/end still overwrites
+# the result of its player: finish_playing invalidates the room after commit, and a read that started before the
+# invalidation is not cached (TTLCache.generation). Other workers keep their entry.
+_result_cache: TTLCache[int, List[ResultUser]] = TTLCache(maxsize=settings.result_cache_size, ttl=None)
+
+
+def _cache_result_user_list(room_id: int, result_user_list: List[ResultUser], generation: int) -> None:
+    if len(result_user_list) > 0:
+        _result_cache.set(room_id, result_user_list, generation=generation)
+
+
+def get_result_user_list(room_id: int) -> List[ResultUser]:
+    result_user_list: List[ResultUser] = _result_cache.get(room_id)
+    if result_user_list is MISSING:
+        generation: int = _result_cache.generation
+        with engine.begin() as conn:
+            result_user_list = _get_result_user_list(conn, room_id)
+        _cache_result_user_list(room_id, result_user_list, generation)
+    return result_user_list
+
+
+async def get_result_user_list_async(room_id: int) -> List[ResultUser]:
+    result_user_list: List[ResultUser] = _result_cache.get(room_id)
+    if result_user_list is MISSING and room_state_engine is not None:
+        # None once the room has been dropped from memory, then the tables are read
+        memory_result_user_list: Optional[List[ResultUser]] = room_state_engine.get_result_user_list(room_id)
+        if memory_result_user_list is not None:
+            result_user_list = memory_result_user_list
+    if result_user_list is MISSING:
+        generation: int = _result_cache.generation
+        async with async_engine.begin() as conn:
+            result_user_list = await conn.run_sync(_get_result_user_list, room_id)
+        _cache_result_user_list(room_id, result_user_list, generation)
+    return result_user_list
+
+
+# (room_id, subscribed event) -> shared read. A notification replaces the event of the room, so a waiter that
+# subscribes after it starts a new read instead of joining one that may have read the state before the change.
+_result_user_list_flight: SingleFlight[Tuple[int, asyncio.Event], List[ResultUser]] = SingleFlight()
+
+
+async def wait_result_user_list_async(room_id: int, timeout: float) -> List[ResultUser]:
+    """long-poll version of get_result_user_list
+
+    Wait until every player of the room has finished playing or until the timeout expires (then returns []).
+    Waiters of the same room that subscribed before the same notification share one database read.
+    Notifications only come from this process: without one, the result is read again every
+    settings.room_result_poll_interval seconds and once more at the timeout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline: float = loop.time() + timeout
+    while True:
+        event = room_result_notifier.subscribe(room_id)
+        result_user_list: List[ResultUser] = await _result_user_list_flight.do(
+            (room_id, event), lambda: get_result_user_list_async(room_id)
+        )
+        if len(result_user_list) > 0:
+            return result_user_list
+        remaining: float = deadline - loop.time()
+        if remaining <= 0:
+            return []
+        await room_result_notifier.wait(event, timeout=min(remaining, settings.room_result_poll_interval))
+
+
+def _drop_room_users(conn, room_id: int) -> int:
+    result = conn.execute(_delete_room_users_stmt, dict(room_id=room_id))
+    return result.rowcount
+
+
+def _drop_room(conn, room_id: int, only_if_empty: bool = False) -> bool:
+    """delete the room and its members in the caller's transaction
+
+    Args:
+        only_if_empty (bool): delete only if joined_user_count has reached 0.
+            The condition is evaluated by the DELETE itself on the current row, not on a previous read.
+
+    Returns:
+        bool: True if the room has been deleted
+    """
     result = conn.execute(
-        text(query),
+        _delete_empty_room_stmt if only_if_empty else _delete_room_stmt,
         dict(
             room_id=room_id,
         ),
     )
-    if result.rowcount > 0:
-        logger.info(f"successfully drop {room_id=}")
-    else:
-        logger.error(f"failed to drop {room_id=}")
+    if result.rowcount == 0:
+        if not only_if_empty:
+            logger.error("failed to drop room_id=%r", room_id)
+        return False
+    dropped_room_user_count: int = _drop_room_users(conn, room_id=room_id)
+    logger.info("successfully drop room_id=%r with %d room_user rows", room_id, dropped_room_user_count)
+    return True
 
 
-def _get_room_joined_user_count(conn, room_id: int) -> int:
-    query: str = " ".join(
-        [
-            f"SELECT `{ RoomDBTableName.joined_user_count }`",
-            f"FROM `{ RoomDBTableName.table_name }`",
-            f"WHERE `{ RoomDBTableName.room_id }`=:room_id",
-        ]
-    )
-    result = conn.execute(text(query), dict(room_id=room_id))
-    row = result.one()
-    return int(row["joined_user_count"])
+def _decrement_room_user_and_try_to_drop_room(conn, room_id: int) -> bool:
+    """decrement joined_user_count and drop the room when nobody is left
 
+    The UPDATE keeps the row locked until commit, so the conditional DELETE sees the decremented value.
 
-def _decrement_room_user_and_try_to_drop_room(conn, room_id: int) -> None:
-    joined_user_count: int = _get_room_joined_user_count(conn, room_id=room_id)
-    # decrement joined_user_count
+    Returns:
+        bool: True if the room has been dropped
+    """
     _update_room_user_count(conn=conn, room_id=room_id, offset=-1)
-    logger.info(f"_decrement_room_user_and_try_to_drop_room {room_id=}, {joined_user_count}")
-    if joined_user_count == 0:
-        # drop the room
-        _drop_room(conn=conn, room_id=room_id)
-    elif joined_user_count < 0:
-        logger.error(f"Something wrong... {joined_user_count=}")
-        raise Exception(f"Something wrong... {joined_user_count=}")
-    return
+    return _drop_room(conn, room_id=room_id, only_if_empty=True)
+
+
+def _user_play_stats_params(user_id: int, play_count: int, total_score: int, best_score: int, judge_counts: List[int]):
+    return dict(
+        user_id=user_id,
+        play_count=play_count,
+        total_score=total_score,
+        best_score=best_score,
+        **dict(zip(const_judge_count_order, judge_counts)),
+    )
+
+
+def _add_user_play(conn, room_user_result: RoomUserResult) -> None:
+    conn.execute(
+        _add_user_play_stats_stmt,
+        _user_play_stats_params(
+            user_id=room_user_result.user_id,
+            play_count=1,
+            total_score=room_user_result.score,
+            best_score=room_user_result.score,
+            judge_counts=[getattr(room_user_result, judge_name) for judge_name in const_judge_count_order],
+        ),
+    )
+
+
+def _get_user_play_stats(conn, user_id: int) -> UserPlayStats:
+    row = conn.execute(_select_user_play_stats_stmt, dict(user_id=user_id)).one_or_none()
+    if row is None:
+        return UserPlayStats(user_id=user_id)
+    return UserPlayStats(
+        user_id=user_id,
+        play_count=row.play_count,
+        total_score=row.total_score,
+        best_score=row.best_score,
+        judge_count_list=[getattr(row, judge_name) for judge_name in const_judge_count_order],
+    )
+
+
+def get_user_play_stats(user_id: int) -> UserPlayStats:
+    with engine.begin() as conn:
+        return _get_user_play_stats(conn, user_id)
+
+
+async def get_user_play_stats_async(user_id: int) -> UserPlayStats:
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_get_user_play_stats, user_id)
+
+
+def _finish_playing(conn, room_user_result: RoomUserResult) -> Optional[BestScore]:
+    """store the result, count the play in user_play_stats and keep the best score for the leaderboard
+
+    Returns:
+        Optional[BestScore]: the score offered to the leaderboard, None if the player is not in the room
+    """
+    row = conn.execute(
+        _select_room_member_profile_for_update_stmt,
+        dict(room_id=room_user_result.room_id, user_id=room_user_result.user_id),
+    ).one_or_none()
+    # The member keeps the seat until /room/leave: the others are still polling the result of the room.
+    _store_room_user_result(conn=conn, room_user_result=room_user_result)
+    if row is None:
+        return None
+    if room_user_result.end_playing and not row.end_playing:
+        # a repeated /room/end overwrites the result but is not another play
+        _add_user_play(conn, room_user_result)
+    best_score = BestScore(
+        live_id=row.live_id,
+        difficulty=row.select_difficulty,
+        user_id=room_user_result.user_id,
+        user_name=row.user_name,
+        leader_card_id=row.leader_card_id,
+        score=room_user_result.score,
+    )
+    _update_best_score(conn, best_score)
+    return best_score
+
+
+def _finish_playing_batch(conn, room_user_results: List[RoomUserResult]) -> List[Optional[BestScore]]:
+    """_finish_playing of several results with one statement per table (see app/result_writer.py)
+
+    Returns:
+        List[Optional[BestScore]]: the BestScore of each result, in order
+    """
+    rows = conn.execute(
+        _select_room_members_profile_for_update_stmt,
+        dict(room_ids=sorted({room_user_result.room_id for room_user_result in room_user_results})),
+    ).all()
+    members = {(row.room_id, row.user_id): row for row in rows}
+    best_scores: List[Optional[BestScore]] = []
+    # the last result of a seat wins, and is counted once
+    room_user_rows: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    user_play_rows: List[Dict[str, Any]] = []
+    for room_user_result in room_user_results:
+        key: Tuple[int, int] = (room_user_result.room_id, room_user_result.user_id)
+        row = members.get(key)
+        if row is None:
+            best_scores.append(None)
+            continue
+        judge_counts: List[int] = [getattr(room_user_result, judge_name) for judge_name in const_judge_count_order]
+        if room_user_result.end_playing and not row.end_playing and key not in room_user_rows:
+            user_play_rows.append(
+                _user_play_stats_params(
+                    user_id=room_user_result.user_id,
+                    play_count=1,
+                    total_score=room_user_result.score,
+                    best_score=room_user_result.score,
+                    judge_counts=judge_counts,
+                )
+            )
+        room_user_rows[key] = dict(
+            room_id=row.room_id,
+            user_id=row.user_id,
+            user_name=row.user_name,
+            leader_card_id=row.leader_card_id,
+            select_difficulty=row.select_difficulty,
+            is_host=row.is_host,
+            **dict(zip(const_judge_count_order, judge_counts)),
+            score=room_user_result.score,
+            end_playing=room_user_result.end_playing,
+        )
+        best_scores.append(
+            BestScore(
+                live_id=row.live_id,
+                difficulty=row.select_difficulty,
+                user_id=room_user_result.user_id,
+                user_name=row.user_name,
+                leader_card_id=row.leader_card_id,
+                score=room_user_result.score,
+            )
+        )
+    # Prebuilt statements executed with the rows of the batch (executemany): one statement shape whatever the
+    # size, sent as one multi-row INSERT by the MySQL drivers
+    if len(room_user_rows) > 0:
+        conn.execute(_upsert_room_user_result_stmt, list(room_user_rows.values()))
+        _update_best_scores(
+            conn, [best_score for best_score in best_scores if best_score is not None], updated_at=rows[0].now
+        )
+    if len(user_play_rows) > 0:
+        conn.execute(
+            _add_user_play_stats_batch_stmt,
+            [dict(user_play_row, updated_at=rows[0].now) for user_play_row in user_play_rows],
+        )
+    return best_scores
 
 
 def finish_playing(room_user_result: RoomUserResult) -> None:
     with engine.begin() as conn:
-        _store_room_user_result(conn=conn, room_user_result=room_user_result)
-        _decrement_room_user_and_try_to_drop_room(conn, room_id=room_user_result.room_id)
+        _finish_playing(conn, room_user_result)
+    _result_cache.invalidate(room_user_result.room_id)
+
+
+async def finish_playing_async(room_user_result: RoomUserResult) -> None:
+    best_score: Optional[BestScore]
+    if room_state_engine is not None:
+        best_score = room_state_engine.finish_playing(room_user_result)
+    elif room_result_writer is not None:
+        best_score = await room_result_writer.submit(room_user_result)
+    else:
+        async with async_engine.begin() as conn:
+            best_score = await conn.run_sync(_finish_playing, room_user_result)
+    # after commit, also when the result went through room_result_writer
+    _result_cache.invalidate(room_user_result.room_id)
+    if best_score is not None:
+        leaderboards.offer(best_score)
+    room_result_notifier.notify(room_user_result.room_id)
 
 
 def _drop_room_user(conn, room_id: int, user_id: int) -> None:
-    query: str = " ".join(
-        [
-            f"DELETE FROM `{ RoomUserDBTableName.table_name }`",
-            f"WHERE `{ RoomUserDBTableName.room_id }`=:room_id",
-            f"AND `{ RoomUserDBTableName.user_id }`=:user_id",
-        ]
-    )
     result = conn.execute(
-        text(query),
+        _delete_room_user_stmt,
         dict(
             room_id=room_id,
             user_id=user_id,
         ),
     )
     if result.rowcount > 0:
-        logger.info(f"{user_id=} is left {room_id=}")
+        logger.info("user_id=%r is left room_id=%r", user_id, room_id)
     else:
-        logger.warning(f"{user_id=} is not in {room_id=}")
+        logger.warning("user_id=%r is not in room_id=%r", user_id, room_id)
         raise Exception(f"{user_id=} is not in {room_id=}")
 
 
+def _leave_room(conn, room_id: int, user_id: int) -> None:
+    _drop_room_user(conn, room_id=room_id, user_id=user_id)
+    _decrement_room_user_and_try_to_drop_room(conn, room_id=room_id)
+
+
 def leave_room(room_id: int, user_id: int) -> None:
     with engine.begin() as conn:
-        _drop_room_user(conn, room_id=room_id, user_id=user_id)
-        _decrement_room_user_and_try_to_drop_room(conn, room_id=room_id)
-        return
+        _leave_room(conn, room_id=room_id, user_id=user_id)
+
+
+async def leave_room_async(room_id: int, user_id: int) -> None:
+    if room_state_engine is not None:
+        room_state_engine.leave_room(room_id=room_id, user_id=user_id)
+    else:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_leave_room, room_id=room_id, user_id=user_id)
+    room_wait_notifier.notify(room_id)
+
+
+def _hand_over_host(conn, room_id: int, user_id: int) -> None:
+    conn.execute(_update_room_host_stmt, dict(b_room_id=room_id, b_user_id=user_id))
+    logger.info("user_id=%r is the new host of room_id=%r", user_id, room_id)
+
+
+def _dissolve_room(conn, room_id: int) -> None:
+    conn.execute(_update_room_status_stmt, dict(status=int(WaitRoomStatus.Dissolution), b_room_id=room_id))
+    logger.info("dissolved room_id=%r", room_id)
+
+
+def _evict_room_user(conn, room_id: int, user_id: int, host_handover: bool) -> bool:
+    """_leave_room on behalf of a member of a Waiting room who stopped sending heartbeats (see app/presence.py)
+
+    If the member was the host, the role goes to the remaining member with the smallest user_id (host_handover)
+    or the room is dissolved. The members left in a dissolved room are evicted too, so that the last one drops it.
+
+    Returns:
+        bool: True if the member has been evicted, False if it is no longer in a Waiting or dissolved room
+    """
+    row = conn.execute(_select_room_member_for_update_stmt, dict(room_id=room_id, user_id=user_id)).one_or_none()
+    if row is None or row.status not in (WaitRoomStatus.Waiting, WaitRoomStatus.Dissolution):
+        return False
+    _leave_room(conn, room_id=room_id, user_id=user_id)
+    if row.status == WaitRoomStatus.Dissolution:
+        return True
+    if row.is_host:
+        if not host_handover:
+            _dissolve_room(conn, room_id=room_id)
+            return True
+        next_host_user_id: Optional[int] = conn.execute(_select_next_host_stmt, dict(room_id=room_id)).scalar()
+        if next_host_user_id is not None:
+            _hand_over_host(conn, room_id=room_id, user_id=next_host_user_id)
+    return True
+
+
+def evict_room_user(room_id: int, user_id: int, host_handover: bool = True) -> bool:
+    with engine.begin() as conn:
+        return _evict_room_user(conn, room_id=room_id, user_id=user_id, host_handover=host_handover)
+
+
+async def evict_room_user_async(room_id: int, user_id: int, host_handover: bool = True) -> bool:
+    if room_state_engine is not None:
+        evicted: bool = room_state_engine.evict_room_user(room_id=room_id, user_id=user_id, host_handover=host_handover)
+    else:
+        async with async_engine.begin() as conn:
+            evicted = await conn.run_sync(
+                _evict_room_user, room_id=room_id, user_id=user_id, host_handover=host_handover
+            )
+    if evicted:
+        room_wait_notifier.notify(room_id)
+    return evicted
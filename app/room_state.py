@@ -0,0 +1,502 @@
+# Standard Library
+import asyncio
+import heapq
+from logging import getLogger
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Third Party Library
+from sqlalchemy import select
+from sqlalchemy.exc import NoResultFound  # type: ignore
+
+# Local Library
+from . import room_model
+from .db import async_engine
+from .leaderboard import BestScore
+from .room_model import JoinRoomResult
+from .room_model import LiveDifficulty
+from .room_model import ResultUser
+from .room_model import RoomDBTableName
+from .room_model import RoomInfo
+from .room_model import RoomInfoRecord
+from .room_model import RoomListCursor
+from .room_model import RoomListOrder
+from .room_model import RoomSnapshot
+from .room_model import RoomStatus
+from .room_model import RoomUser
+from .room_model import RoomUserDBTableName
+from .room_model import RoomUserResult
+from .room_model import WaitRoomRecord
+from .room_model import WaitRoomStatus
+from .room_model import WaitRoomUserRecord
+from .room_model import const_judge_count_order
+from .room_model import room_list_sort_key
+from .room_model import room_table
+from .room_model import room_user_table
+
+logger = getLogger(__name__)
+
+PersistOperation = Tuple[Callable[..., None], Dict[str, Any]]
+
+
+class RoomMember:
+    __slots__ = (
+        "user_id",
+        "user_name",
+        "leader_card_id",
+        "select_difficulty",
+        "is_host",
+        "judge_count_list",
+        "score",
+        "end_playing",
+    )
+
+    def __init__(
+        self,
+        user_id: int,
+        user_name: str,
+        leader_card_id: int,
+        select_difficulty: int,
+        is_host: bool,
+        judge_count_list: Optional[List[int]] = None,
+        score: int = 0,
+        end_playing: bool = False,
+    ) -> None:
+        self.user_id: int = user_id
+        self.user_name: str = user_name
+        self.leader_card_id: int = leader_card_id
+        self.select_difficulty: int = select_difficulty
+        self.is_host: bool = is_host
+        self.judge_count_list: List[int] = judge_count_list or [0] * len(const_judge_count_order)
+        self.score: int = score
+        self.end_playing: bool = end_playing
+
+
+class RoomState:
+    __slots__ = ("room_id", "live_id", "status", "joined_user_count", "members")
+
+    def __init__(self, room_id: int, live_id: int, status: WaitRoomStatus, joined_user_count: int) -> None:
+        self.room_id: int = room_id
+        self.live_id: int = live_id
+        self.status: WaitRoomStatus = status
+        self.joined_user_count: int = joined_user_count
+        self.members: Dict[int, RoomMember] = {}  # user_id -> member, in join order
+
+
+def _persist_join(
+    conn,
+    room_id: int,
+    user_id: int,
+    user_name: str,
+    leader_card_id: int,
+    live_difficulty: LiveDifficulty,
+    is_host: bool,
+) -> None:
+    room_model._create_room_user(
+        conn,
+        room_id=room_id,
+        user_id=user_id,
+        user_name=user_name,
+        leader_card_id=leader_card_id,
+        live_difficulty=live_difficulty,
+        is_host=is_host,
+    )
+    room_model._update_room_user_count(conn, room_id=room_id, offset=1)
+
+
+_select_rooms_stmt = select(
+    room_table.c[RoomDBTableName.room_id],
+    room_table.c[RoomDBTableName.live_id],
+    room_table.c[RoomDBTableName.status],
+    room_table.c[RoomDBTableName.joined_user_count],
+)
+_select_room_members_stmt = select(
+    *(
+        room_user_table.c[column]
+        for column in (
+            RoomUserDBTableName.room_id,
+            RoomUserDBTableName.user_id,
+            RoomUserDBTableName.user_name,
+            RoomUserDBTableName.leader_card_id,
+            RoomUserDBTableName.select_difficulty,
+            RoomUserDBTableName.is_host,
+            *const_judge_count_order,
+            RoomUserDBTableName.score,
+            RoomUserDBTableName.end_playing,
+        )
+    )
+).join_from(
+    room_user_table,
+    room_table,
+    room_table.c[RoomDBTableName.room_id] == room_user_table.c[RoomUserDBTableName.room_id],
+)
+
+
+def _load_rooms(conn) -> Dict[int, RoomState]:
+    rooms: Dict[int, RoomState] = {}
+    for row in conn.execute(_select_rooms_stmt).all():
+        rooms[row.room_id] = RoomState(
+            room_id=row.room_id,
+            live_id=row.live_id,
+            status=WaitRoomStatus(row.status),
+            joined_user_count=row.joined_user_count,
+        )
+
+    for row in conn.execute(_select_room_members_stmt).all():
+        rooms[row.room_id].members[row.user_id] = RoomMember(
+            user_id=row.user_id,
+            user_name=row.user_name,
+            leader_card_id=row.leader_card_id,
+            select_difficulty=row.select_difficulty,
+            is_host=bool(row.is_host),
+            judge_count_list=[getattr(row, judge_name) for judge_name in const_judge_count_order],
+            score=row.score,
+            end_playing=bool(row.end_playing),
+        )
+    return rooms
+
+
+class RoomStateEngine:
+    """Authoritative in-memory state of the rooms with write-behind persistence.
+
+    Every state transition is a plain (non-async) method, so it runs without yielding to the event loop and is
+    atomic with respect to the other requests of this process, just like the `FOR UPDATE` lock of
+    room_model.join_room. This only holds for a single server process.
+
+    The transitions are queued and replayed on the `room` / `room_user` tables by a background task, using the
+    same helpers as the database path, and the state is rebuilt from those tables by `start`.
+    """
+
+    def __init__(self) -> None:
+        self._rooms: Dict[int, RoomState] = {}
+        # secondary index of the Waiting rooms: live_id -> room_id -> room (dicts keep creation order)
+        self._waiting_rooms_by_live_id: Dict[int, Dict[int, RoomState]] = {}
+        self._queue: "asyncio.Queue[PersistOperation]" = asyncio.Queue()
+        self._persist_task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        async with async_engine.begin() as conn:
+            self._rooms = await conn.run_sync(_load_rooms)
+        self._waiting_rooms_by_live_id = {}
+        for room in self._rooms.values():
+            if room.status == WaitRoomStatus.Waiting:
+                self._index_waiting_room(room)
+        logger.info("loaded %d rooms", len(self._rooms))
+        self._persist_task = asyncio.create_task(self._persist_loop())
+
+    async def stop(self) -> None:
+        """flush pending writes and stop the background task"""
+        await self._queue.join()
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            self._persist_task = None
+
+    def _persist(self, fn: Callable[..., None], **kwargs: Any) -> None:
+        self._queue.put_nowait((fn, kwargs))
+
+    async def _persist_loop(self) -> None:
+        while True:
+            operations: List[PersistOperation] = [await self._queue.get()]
+            while not self._queue.empty():
+                operations.append(self._queue.get_nowait())
+            try:
+                async with async_engine.begin() as conn:
+                    await conn.run_sync(self._apply, operations)
+            except Exception as e:
+                logger.error("failed to persist room state: e=%r", e, exc_info=True)
+            finally:
+                for _ in operations:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _apply(conn, operations: List[PersistOperation]) -> None:
+        for fn, kwargs in operations:
+            try:
+                # a failed operation must not roll back the rest of the batch
+                with conn.begin_nested():
+                    fn(conn, **kwargs)
+            except Exception as e:
+                logger.error("failed to persist %s(%r): e=%r", fn.__name__, kwargs, e, exc_info=True)
+
+    def _get_room(self, room_id: int) -> RoomState:
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            raise NoResultFound(f"{room_id=} is not found")
+        return room
+
+    def _index_waiting_room(self, room: RoomState) -> None:
+        self._waiting_rooms_by_live_id.setdefault(room.live_id, {})[room.room_id] = room
+
+    def _unindex_waiting_room(self, room: RoomState) -> None:
+        waiting_rooms: Optional[Dict[int, RoomState]] = self._waiting_rooms_by_live_id.get(room.live_id)
+        if waiting_rooms is None:
+            return
+        waiting_rooms.pop(room.room_id, None)
+        if len(waiting_rooms) == 0:
+            del self._waiting_rooms_by_live_id[room.live_id]
+
+    def _drop_room(self, room: RoomState) -> None:
+        del self._rooms[room.room_id]
+        self._unindex_waiting_room(room)
+
+    def add_room(self, room_id: int, live_id: int) -> None:
+        """register a room already inserted by room_model.create_room"""
+        room = RoomState(room_id=room_id, live_id=live_id, status=WaitRoomStatus.Waiting, joined_user_count=0)
+        self._rooms[room_id] = room
+        self._index_waiting_room(room)
+
+    def join_room(
+        self,
+        user_id: int,
+        room_id: int,
+        user_name: str,
+        leader_card_id: int,
+        live_difficulty: LiveDifficulty,
+        is_host: bool = False,
+    ) -> JoinRoomResult:
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            return JoinRoomResult.Disbanded
+        if room.joined_user_count >= room_model.max_user_count:
+            return JoinRoomResult.RoomFull
+        if room.status != WaitRoomStatus.Waiting:
+            return JoinRoomResult.OhterError
+        if user_id in room.members:
+            return JoinRoomResult.OhterError
+        room.members[user_id] = RoomMember(
+            user_id=user_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            select_difficulty=int(live_difficulty),
+            is_host=is_host,
+        )
+        room.joined_user_count += 1
+        self._persist(
+            _persist_join,
+            room_id=room_id,
+            user_id=user_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+            is_host=is_host,
+        )
+        return JoinRoomResult.Ok
+
+    def quick_join_room(
+        self,
+        live_id: int,
+        user_id: int,
+        user_name: str,
+        leader_card_id: int,
+        live_difficulty: LiveDifficulty,
+    ) -> Optional[int]:
+        """join the fullest non-full Waiting room of the live
+
+        Returns:
+            Optional[int]: the joined room_id, None if there is no room to join (the caller creates one)
+        """
+        joinable_rooms: List[RoomState] = [
+            room
+            for room in self._waiting_rooms_by_live_id.get(live_id, {}).values()
+            if room.joined_user_count < room_model.max_user_count and user_id not in room.members
+        ]
+        if len(joinable_rooms) == 0:
+            return None
+        room: RoomState = min(
+            joinable_rooms,
+            key=lambda room: room_list_sort_key(RoomListOrder.fewest_free_slots, room.room_id, room.joined_user_count),
+        )
+        self.join_room(
+            user_id=user_id,
+            room_id=room.room_id,
+            user_name=user_name,
+            leader_card_id=leader_card_id,
+            live_difficulty=live_difficulty,
+        )
+        return room.room_id
+
+    def get_rooms_by_live_id(
+        self,
+        live_id: int,
+        order: RoomListOrder = RoomListOrder.oldest,
+        after: Optional[RoomListCursor] = None,
+        limit: Optional[int] = None,
+    ) -> List[RoomInfo]:
+        """list Waiting rooms (all of them if live_id is 0) without scanning the other rooms
+
+        Same ordering and keyset pagination as room_model._get_rooms_by_live_id.
+        """
+        return [
+            RoomInfo(room_id=room.room_id, live_id=room.live_id, joined_user_count=room.joined_user_count)
+            for room in self._list_waiting_rooms(live_id, order=order, after=after, limit=limit)
+        ]
+
+    def get_room_info_records(
+        self,
+        live_id: int,
+        order: RoomListOrder = RoomListOrder.oldest,
+        after: Optional[RoomListCursor] = None,
+        limit: Optional[int] = None,
+    ) -> List[RoomInfoRecord]:
+        """get_rooms_by_live_id for the fast response path"""
+        return [
+            RoomInfoRecord(room.room_id, room.live_id, room.joined_user_count)
+            for room in self._list_waiting_rooms(live_id, order=order, after=after, limit=limit)
+        ]
+
+    def _list_waiting_rooms(
+        self, live_id: int, order: RoomListOrder, after: Optional[RoomListCursor], limit: Optional[int]
+    ) -> List[RoomState]:
+        waiting_rooms: Iterable[RoomState]
+        if live_id == 0:
+            waiting_rooms = (room for rooms in self._waiting_rooms_by_live_id.values() for room in rooms.values())
+        else:
+            waiting_rooms = self._waiting_rooms_by_live_id.get(live_id, {}).values()
+
+        def sort_key(room: RoomState) -> Tuple[int, int]:
+            return room_list_sort_key(order, room.room_id, room.joined_user_count)
+
+        if after is not None:
+            after_key: Tuple[int, int] = room_list_sort_key(order, after.room_id, after.joined_user_count)
+            waiting_rooms = (room for room in waiting_rooms if sort_key(room) > after_key)
+        if limit is None:
+            return sorted(waiting_rooms, key=sort_key)
+        return heapq.nsmallest(limit, waiting_rooms, key=sort_key)
+
+    def get_room_status(self, room_id: int) -> RoomStatus:
+        room: RoomState = self._get_room(room_id)
+        return RoomStatus(room_id=room_id, status=room.status)
+
+    def get_room_users(self, room_id: int, user_id_req: Optional[int] = None) -> List[RoomUser]:
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            return []
+        return [
+            RoomUser(
+                room_id=room_id,
+                user_id=member.user_id,
+                user_name=member.user_name,
+                leader_card_id=member.leader_card_id,
+                select_difficulty=member.select_difficulty,
+                is_me=member.user_id == user_id_req,
+                is_host=member.is_host,
+            )
+            for member in room.members.values()
+        ]
+
+    def get_room_snapshot(self, room_id: int, user_id_req: Optional[int] = None) -> Optional[RoomSnapshot]:
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            return None
+        return RoomSnapshot(
+            room_id=room_id, status=room.status, room_user_list=self.get_room_users(room_id, user_id_req)
+        )
+
+    def get_wait_room_record(self, room_id: int, user_id_req: Optional[int] = None) -> Optional[WaitRoomRecord]:
+        """get_room_snapshot for the fast response path"""
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            return None
+        return WaitRoomRecord(
+            status=room.status,
+            room_user_list=[
+                WaitRoomUserRecord(
+                    member.user_id,
+                    member.user_name,
+                    member.leader_card_id,
+                    member.select_difficulty,
+                    member.user_id == user_id_req,
+                    member.is_host,
+                )
+                for member in room.members.values()
+            ],
+        )
+
+    def start_room(self, room_id: int) -> None:
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            return
+        room.status = WaitRoomStatus.LiveStart
+        self._unindex_waiting_room(room)
+        self._persist(room_model._start_room, room_id=room_id)
+
+    def get_result_user_list(self, room_id: int) -> Optional[List[ResultUser]]:
+        """
+        Returns:
+            Optional[List[ResultUser]]: None if the room is not held in memory
+        """
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None:
+            return None
+        if not all(member.end_playing for member in room.members.values()):
+            return []
+        return [
+            ResultUser(user_id=member.user_id, judge_count_list=list(member.judge_count_list), score=member.score)
+            for member in room.members.values()
+        ]
+
+    def finish_playing(self, room_user_result: RoomUserResult) -> Optional[BestScore]:
+        """
+        Returns:
+            Optional[BestScore]: the score offered to the leaderboard, None if the player is not in the room
+        """
+        self._persist(room_model._finish_playing, room_user_result=room_user_result)
+        room: Optional[RoomState] = self._rooms.get(room_user_result.room_id)
+        member: Optional[RoomMember] = None if room is None else room.members.get(room_user_result.user_id)
+        if room is None or member is None:
+            return None
+        member.judge_count_list = [getattr(room_user_result, judge_name) for judge_name in const_judge_count_order]
+        member.score = room_user_result.score
+        member.end_playing = room_user_result.end_playing
+        return BestScore(
+            live_id=room.live_id,
+            difficulty=member.select_difficulty,
+            user_id=member.user_id,
+            user_name=member.user_name,
+            leader_card_id=member.leader_card_id,
+            score=member.score,
+        )
+
+    def leave_room(self, room_id: int, user_id: int) -> None:
+        """same rule as room_model._leave_room: the room is dropped with the last member"""
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None or user_id not in room.members:
+            raise Exception(f"{user_id=} is not in {room_id=}")
+        del room.members[user_id]
+        room.joined_user_count -= 1
+        if room.joined_user_count <= 0:
+            self._drop_room(room)
+        self._persist(room_model._leave_room, room_id=room_id, user_id=user_id)
+
+    def evict_room_user(self, room_id: int, user_id: int, host_handover: bool) -> bool:
+        """same rule as room_model._evict_room_user, the next host is the member that joined first
+
+        The members of a dissolved room are evicted as well, and the last one drops the room: the room sweeper
+        does not run with this engine.
+        """
+        room: Optional[RoomState] = self._rooms.get(room_id)
+        if room is None or user_id not in room.members:
+            return False
+        if room.status == WaitRoomStatus.Dissolution:
+            self.leave_room(room_id=room_id, user_id=user_id)
+            return True
+        if room.status != WaitRoomStatus.Waiting:
+            return False
+        was_host: bool = room.members[user_id].is_host
+        self.leave_room(room_id=room_id, user_id=user_id)
+        if not was_host or room.joined_user_count <= 0:
+            return True
+        if host_handover:
+            next_host: RoomMember = next(iter(room.members.values()))
+            next_host.is_host = True
+            self._persist(room_model._hand_over_host, room_id=room_id, user_id=next_host.user_id)
+        else:
+            room.status = WaitRoomStatus.Dissolution
+            self._unindex_waiting_room(room)
+            self._persist(room_model._dissolve_room, room_id=room_id)
+        return True
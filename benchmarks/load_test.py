@@ -0,0 +1,299 @@
+"""End-to-end load generator for the room lifecycle
+
+Every simulated player runs the real flow against a running server:
+
+    /user/create -> /room/list + /room/join (or /room/create) -> /room/wait polling -> /room/start (host)
+    -> /room/end -> /room/result polling -> /room/leave
+
+and the harness reports the p50/p95/p99 latency of each endpoint, requests per second and the error and RoomFull
+rates. `--output` saves the report as JSON, `--compare` checks the run against such a baseline.
+
+usage:
+    uvicorn app.api:app &
+    python -m benchmarks.load_test --players 200 --room-size 2 --poll-interval 0.2 --output baseline.json
+    python -m benchmarks.load_test --players 200 --room-size 2 --poll-interval 0.2 --compare baseline.json
+"""
+
+# Standard Library
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+# Third Party Library
+import requests
+
+
+# API enums of app.room_model, mirrored so that the generator does not load the database settings of the server
+class JoinRoomResult(IntEnum):
+    Ok = 1
+    RoomFull = 2
+    Disbanded = 3
+    OhterError = 4
+
+
+class WaitRoomStatus(IntEnum):
+    Waiting = 1
+    LiveStart = 2
+    Dissolution = 3
+
+
+@dataclass
+class LoadTestConfig:
+    base_url: str = "http://127.0.0.1:8000"
+    players: int = 100
+    # the host starts the live once this many players are in the room (or after start_timeout)
+    room_size: int = 2
+    poll_interval: float = 0.5
+    start_timeout: float = 10.0
+    result_timeout: float = 30.0
+    live_id: int = 1
+    # attempts of /room/list + /room/join before the player creates a room
+    join_attempts: int = 3
+
+
+class Recorder:
+    """thread-safe collector of request latencies and outcomes"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.join_results: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def record_join(self, join_room_result: JoinRoomResult) -> None:
+        with self._lock:
+            self.join_results[join_room_result.name] = self.join_results.get(join_room_result.name, 0) + 1
+
+
+class RequestFailed(Exception):
+    """a request of the flow returned a non 2xx status or could not be sent"""
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """nearest-rank percentile, q in [0, 100]"""
+    if len(sorted_values) == 0:
+        return 0.0
+    rank: int = max(1, -(-len(sorted_values) * q // 100))  # ceil
+    return sorted_values[int(rank) - 1]
+
+
+class Player:
+    def __init__(self, index: int, config: LoadTestConfig, recorder: Recorder, session: requests.Session) -> None:
+        self.index = index
+        self.config = config
+        self.recorder = recorder
+        self.session = session
+        self.headers: Dict[str, str] = {}
+
+    def _post(self, endpoint: str, body: Dict[str, Any]) -> Any:
+        start: float = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.config.base_url}{endpoint}", json=body, headers=self.headers)
+        except requests.RequestException as e:
+            self.recorder.record(endpoint, time.perf_counter() - start, ok=False)
+            raise RequestFailed(f"{endpoint}: {e}") from e
+        ok: bool = 200 <= response.status_code < 300
+        self.recorder.record(endpoint, time.perf_counter() - start, ok=ok)
+        if not ok:
+            raise RequestFailed(f"{endpoint}: {response.status_code} {response.text}")
+        return response.json()
+
+    def _join_or_create_room(self, select_difficulty: int) -> Optional[int]:
+        """room_id of the joined room, or None if the player has created a room and is its host"""
+        for _ in range(self.config.join_attempts):
+            room_info_list = self._post("/room/list", {"live_id": self.config.live_id})["room_info_list"]
+            for room_info in room_info_list:
+                join_room_result = JoinRoomResult(
+                    self._post("/room/join", {"room_id": room_info["room_id"], "select_difficulty": select_difficulty})[
+                        "join_room_result"
+                    ]
+                )
+                self.recorder.record_join(join_room_result)
+                if join_room_result == JoinRoomResult.Ok:
+                    return room_info["room_id"]
+            if len(room_info_list) == 0:
+                break
+        return None
+
+    def _wait_for_start(self, room_id: int, is_host: bool) -> bool:
+        """poll /room/wait until the live starts. The host starts it. False if the room has been dissolved."""
+        deadline: float = time.monotonic() + self.config.start_timeout
+        while True:
+            wait_response = self._post("/room/wait", {"room_id": room_id})
+            status = WaitRoomStatus(wait_response["status"])
+            if status == WaitRoomStatus.LiveStart:
+                return True
+            if status == WaitRoomStatus.Dissolution:
+                return False
+            if is_host and (
+                len(wait_response["room_user_list"]) >= self.config.room_size or time.monotonic() >= deadline
+            ):
+                self._post("/room/start", {"room_id": room_id})
+                return True
+            time.sleep(self.config.poll_interval)
+
+    def _wait_for_result(self, room_id: int) -> None:
+        deadline: float = time.monotonic() + self.config.result_timeout
+        while time.monotonic() < deadline:
+            if len(self._post("/room/result", {"room_id": room_id})["result_user_list"]) > 0:
+                return
+            time.sleep(self.config.poll_interval)
+
+    def run(self) -> None:
+        token: str = self._post("/user/create", {"user_name": f"load_{self.index}", "leader_card_id": 1000})[
+            "user_token"
+        ]
+        self.headers = {"Authorization": f"bearer {token}"}
+        select_difficulty: int = random.choice([1, 2])
+        room_id: Optional[int] = self._join_or_create_room(select_difficulty)
+        is_host: bool = room_id is None
+        if room_id is None:
+            room_id = self._post(
+                "/room/create", {"live_id": self.config.live_id, "select_difficulty": select_difficulty}
+            )["room_id"]
+        if not self._wait_for_start(room_id, is_host=is_host):
+            return
+        judge_count_list: List[int] = [random.randint(0, 100) for _ in range(5)]
+        self._post(
+            "/room/end", {"room_id": room_id, "judge_count_list": judge_count_list, "score": sum(judge_count_list)}
+        )
+        self._wait_for_result(room_id)
+        self._post("/room/leave", {"room_id": room_id})
+
+
+def _run_player(index: int, config: LoadTestConfig, recorder: Recorder) -> bool:
+    with requests.Session() as session:
+        try:
+            Player(index, config, recorder, session).run()
+        except RequestFailed:
+            return False
+    return True
+
+
+def summarize(config: LoadTestConfig, recorder: Recorder, elapsed: float, completed_players: int) -> Dict[str, Any]:
+    endpoints: Dict[str, Dict[str, Any]] = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        sorted_latencies: List[float] = sorted(latencies)
+        endpoints[endpoint] = {
+            "count": len(sorted_latencies),
+            "errors": recorder.errors.get(endpoint, 0),
+            "p50_ms": _percentile(sorted_latencies, 50) * 1e3,
+            "p95_ms": _percentile(sorted_latencies, 95) * 1e3,
+            "p99_ms": _percentile(sorted_latencies, 99) * 1e3,
+        }
+    requests_count: int = sum(endpoint["count"] for endpoint in endpoints.values())
+    join_count: int = sum(recorder.join_results.values())
+    return {
+        "config": asdict(config),
+        "elapsed_seconds": elapsed,
+        "completed_players": completed_players,
+        "requests": requests_count,
+        "rps": requests_count / elapsed if elapsed > 0 else 0.0,
+        "error_rate": sum(recorder.errors.values()) / requests_count if requests_count > 0 else 0.0,
+        "room_full_rate": (
+            recorder.join_results.get(JoinRoomResult.RoomFull.name, 0) / join_count if join_count > 0 else 0.0
+        ),
+        "join_results": dict(recorder.join_results),
+        "endpoints": endpoints,
+    }
+
+
+def run_load_test(config: LoadTestConfig) -> Dict[str, Any]:
+    recorder = Recorder()
+    start: float = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config.players) as executor:
+        results: List[bool] = list(executor.map(lambda i: _run_player(i, config, recorder), range(config.players)))
+    return summarize(config, recorder, time.perf_counter() - start, completed_players=sum(results))
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """regressions of the report against the baseline
+
+    A regression is a p95 latency or an error rate more than `tolerance` (relative) above the baseline,
+    or an rps more than `tolerance` below it.
+    """
+    regressions: List[str] = []
+    for endpoint, stats in report["endpoints"].items():
+        base: Optional[Dict[str, Any]] = baseline["endpoints"].get(endpoint)
+        if base is not None and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint} p95 {base['p95_ms']:.1f}ms -> {stats['p95_ms']:.1f}ms")
+    if report["rps"] < baseline["rps"] * (1 - tolerance):
+        regressions.append(f"rps {baseline['rps']:.1f} -> {report['rps']:.1f}")
+    if report["error_rate"] > baseline["error_rate"] * (1 + tolerance) and report["error_rate"] > 0:
+        regressions.append(f"error rate {baseline['error_rate']:.2%} -> {report['error_rate']:.2%}")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'endpoint':<14} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in report["endpoints"].items():
+        print(
+            f"{endpoint:<14} {stats['count']:>7} {stats['errors']:>7}"
+            f" {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+        )
+    print(
+        f"players {report['completed_players']}/{report['config']['players']} completed"
+        f", {report['requests']} requests in {report['elapsed_seconds']:.1f}s ({report['rps']:.1f} rps)"
+        f", error rate {report['error_rate']:.2%}, RoomFull rate {report['room_full_rate']:.2%}"
+    )
+
+
+def main() -> int:
+    defaults = LoadTestConfig()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default=defaults.base_url)
+    parser.add_argument("--players", type=int, default=defaults.players)
+    parser.add_argument("--room-size", type=int, default=defaults.room_size)
+    parser.add_argument("--poll-interval", type=float, default=defaults.poll_interval)
+    parser.add_argument("--start-timeout", type=float, default=defaults.start_timeout)
+    parser.add_argument("--result-timeout", type=float, default=defaults.result_timeout)
+    parser.add_argument("--live-id", type=int, default=defaults.live_id)
+    parser.add_argument("--join-attempts", type=int, default=defaults.join_attempts)
+    parser.add_argument("--output", help="save the report as JSON (a baseline for --compare)")
+    parser.add_argument("--compare", help="baseline JSON. Exits with 1 on a regression.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    config = LoadTestConfig(
+        base_url=args.base_url,
+        players=args.players,
+        room_size=args.room_size,
+        poll_interval=args.poll_interval,
+        start_timeout=args.start_timeout,
+        result_timeout=args.result_timeout,
+        live_id=args.live_id,
+        join_attempts=args.join_attempts,
+    )
+    report: Dict[str, Any] = run_load_test(config)
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, mode="wt") as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, mode="rt") as f:
+            regressions: List[str] = compare(report, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
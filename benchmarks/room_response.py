@@ -0,0 +1,146 @@
+"""CPU time of building the /room/list and /room/wait responses with and without settings.fast_response
+
+Both modes read the same in-memory SQLite database through the real room_model helpers, then build the body the
+endpoint sends:
+
+- pydantic: rows -> from_orm models -> response model -> FastAPI response_model validation -> JSONResponse
+- fast: rows -> room_model records -> ORJSONResponse
+
+usage:
+    python -m benchmarks.room_response [--number 2000] [--rooms 50]
+"""
+
+# Standard Library
+import argparse
+import asyncio
+import time
+from typing import Awaitable
+from typing import Callable
+
+# Third Party Library
+from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import APIRoute
+from fastapi.routing import serialize_response
+from sqlalchemy import create_engine
+
+# First Party Library
+from app import api
+from app import room_model
+from app.db import metadata
+
+live_id: int = 1
+order: room_model.RoomListOrder = room_model.RoomListOrder.oldest
+
+
+def _response_field(path: str):
+    route = next(route for route in api.app.routes if isinstance(route, APIRoute) and route.path == path)
+    return route.secure_cloned_response_field
+
+
+async def _render(response_field, response_content) -> bytes:
+    """what FastAPI does with the return value of an endpoint declaring response_model"""
+    content = await serialize_response(field=response_field, response_content=response_content)
+    return JSONResponse(content).body
+
+
+def _cpu_time_per_call(fn: Callable[[], Awaitable[bytes]], number: int) -> float:
+    async def run() -> float:
+        await fn()  # warm up
+        start: float = time.process_time()
+        for _ in range(number):
+            await fn()
+        return (time.process_time() - start) / number
+
+    return asyncio.run(run())
+
+
+def main(number: int, rooms: int) -> None:
+    engine = create_engine("sqlite://", future=True)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            room_model._insert_room_stmt,
+            [dict(room_id=room_id, live_id=live_id, joined_user_count=1) for room_id in range(1, rooms + 2)],
+        )
+        conn.execute(
+            room_model._insert_room_user_stmt,
+            [
+                dict(
+                    room_id=1,
+                    user_id=user_id,
+                    user_name=f"user_{user_id}",
+                    leader_card_id=1,
+                    select_difficulty=1,
+                    is_host=user_id == 1,
+                )
+                for user_id in range(1, room_model.max_user_count + 1)
+            ],
+        )
+    room_list_field = _response_field("/room/list")
+    room_wait_field = _response_field("/room/wait")
+    conn = engine.connect()
+
+    async def room_list_pydantic() -> bytes:
+        page = room_model._make_room_list_page(
+            list(room_model._get_rooms_by_live_id(conn, live_id, order=order, limit=rooms + 1)),
+            order=order,
+            limit=rooms,
+        )
+        return await _render(
+            room_list_field, api.RoomListResponse(room_info_list=page.room_info_list, next_cursor=page.next_cursor)
+        )
+
+    async def room_list_fast() -> bytes:
+        room_info_list, next_cursor = room_model._split_room_list_page(
+            room_model._get_room_info_records(conn, live_id, order=order, after=None, limit=rooms + 1),
+            order=order,
+            limit=rooms,
+        )
+        return ORJSONResponse(
+            room_model.RoomListPageRecord(room_info_list=room_info_list, next_cursor=next_cursor)
+        ).body
+
+    async def room_wait_pydantic() -> bytes:
+        snapshot = room_model._get_room_snapshot(conn, 1, user_id_req=1)
+        assert snapshot is not None
+        response = api.RoomWaitResponse(
+            status=snapshot.status,
+            room_user_list=[
+                api.WaitResponseRoomUser(
+                    user_id=room_user.user_id,
+                    name=room_user.user_name,
+                    leader_card_id=room_user.leader_card_id,
+                    select_difficulty=room_user.select_difficulty,
+                    is_me=room_user.is_me,
+                    is_host=room_user.is_host,
+                )
+                for room_user in snapshot.room_user_list
+            ],
+        )
+        return await _render(room_wait_field, response)
+
+    async def room_wait_fast() -> bytes:
+        return ORJSONResponse(room_model._get_wait_room_record(conn, 1, user_id_req=1)).body
+
+    print(f"{'endpoint':<12} {'pydantic us/req':>16} {'fast us/req':>12} {'saved us/req':>13} {'saved':>6}")
+    for endpoint, pydantic_path, fast_path in (
+        ("/room/list", room_list_pydantic, room_list_fast),
+        ("/room/wait", room_wait_pydantic, room_wait_fast),
+    ):
+        assert asyncio.run(pydantic_path()).replace(b" ", b"") == asyncio.run(fast_path()).replace(b" ", b"")
+        pydantic_time: float = _cpu_time_per_call(pydantic_path, number)
+        fast_time: float = _cpu_time_per_call(fast_path, number)
+        print(
+            f"{endpoint:<12} {pydantic_time * 1e6:>16.1f} {fast_time * 1e6:>12.1f}"
+            f" {(pydantic_time - fast_time) * 1e6:>13.1f} {1 - fast_time / pydantic_time:>6.0%}"
+        )
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000, help="requests per endpoint and mode")
+    parser.add_argument("--rooms", type=int, default=50, help="rooms per /room/list page")
+    args = parser.parse_args()
+    main(args.number, args.rooms)
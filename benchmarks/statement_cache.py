@@ -0,0 +1,140 @@
+"""Per-call overhead of the SQL statements of app.model and app.room_model
+
+Compares the former style, which joined f-strings into a new `text()` on every call, with the statements prebuilt
+at import time. Both run against an in-memory SQLite database so that the numbers are dominated by the Python
+side (string building, `text()` parsing, cache key generation) rather than by the network round trip.
+
+usage:
+    python -m benchmarks.statement_cache [--number 20000]
+"""
+
+# Standard Library
+import argparse
+import timeit
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+
+# Third Party Library
+from sqlalchemy import create_engine
+from sqlalchemy import text
+
+# First Party Library
+from app import model
+from app import room_model
+from app.db import metadata
+from app.model import UserDBTableName
+from app.room_model import RoomUserDBTableName
+
+
+def _legacy_get_user_by_token(conn, token: str):
+    query: str = " ".join(
+        (
+            "SELECT",
+            ", ".join(
+                (
+                    f"`{ UserDBTableName.id }`",
+                    f"`{ UserDBTableName.name }`",
+                    f"`{ UserDBTableName.leader_card_id }`",
+                )
+            ),
+            f"FROM `{ UserDBTableName.table_name }`",
+            f"WHERE `{ UserDBTableName.token }`=:token",
+        )
+    )
+    return conn.execute(text(query), dict(token=token)).all()
+
+
+def _legacy_get_room_users(conn, room_id: int):
+    query: str = " ".join(
+        [
+            "SELECT",
+            f"`{ RoomUserDBTableName.room_id }`,",
+            f"`{ RoomUserDBTableName.user_id }`,",
+            f"`{ RoomUserDBTableName.user_name }`,",
+            f"`{ RoomUserDBTableName.leader_card_id }`,",
+            f"`{ RoomUserDBTableName.select_difficulty }`,",
+            f"`{ RoomUserDBTableName.is_host }`",
+            f"FROM `{ RoomUserDBTableName.table_name }`",
+            f"WHERE `{ RoomUserDBTableName.room_id }`=:room_id",
+        ]
+    )
+    return conn.execute(text(query), dict(room_id=room_id)).all()
+
+
+def _legacy_store_room_user_result(conn, room_id: int, user_id: int):
+    query: str = " ".join(
+        [
+            f"UPDATE `{ RoomUserDBTableName.table_name }`",
+            "SET",
+            ", ".join(
+                [f"`{ judge_name }`=:{ judge_name }" for judge_name in room_model.const_judge_count_order]
+                + [
+                    f"`{ RoomUserDBTableName.score }`=:score",
+                    f"`{ RoomUserDBTableName.end_playing }`=:end_playing",
+                ]
+            ),
+            f"WHERE `{ RoomUserDBTableName.room_id }`=:room_id",
+            f"AND `{ RoomUserDBTableName.user_id }`=:user_id",
+        ]
+    )
+    params: Dict = {judge_name: 1 for judge_name in room_model.const_judge_count_order}
+    params.update(score=100, end_playing=True, room_id=room_id, user_id=user_id)
+    return conn.execute(text(query), params)
+
+
+def _prebuilt_get_user_by_token(conn, token: str):
+    return conn.execute(model._select_user_by_token_stmt, dict(token=token)).all()
+
+
+def _prebuilt_get_room_users(conn, room_id: int):
+    return conn.execute(room_model._select_room_users_stmt, dict(room_id=room_id)).all()
+
+
+def _prebuilt_store_room_user_result(conn, room_id: int, user_id: int):
+    params: Dict = {judge_name: 1 for judge_name in room_model.const_judge_count_order}
+    params.update(score=100, end_playing=True, b_room_id=room_id, b_user_id=user_id)
+    return conn.execute(room_model._update_room_user_result_stmt, params)
+
+
+def main(number: int) -> None:
+    engine = create_engine("sqlite://", future=True)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            model._insert_user_stmt,
+            dict(id=1, name="bench", token="bench-token", leader_card_id=1),
+        )
+        conn.execute(
+            room_model._insert_room_user_stmt,
+            [
+                dict(
+                    room_id=1, user_id=user_id, user_name="bench", leader_card_id=1, select_difficulty=1, is_host=False
+                )
+                for user_id in range(room_model.max_user_count)
+            ],
+        )
+    cases: Dict[str, Tuple[Callable, Callable, Tuple]] = {
+        "get_user_by_token": (_legacy_get_user_by_token, _prebuilt_get_user_by_token, ("bench-token",)),
+        "get_room_users": (_legacy_get_room_users, _prebuilt_get_room_users, (1,)),
+        "store_room_user_result": (_legacy_store_room_user_result, _prebuilt_store_room_user_result, (1, 0)),
+    }
+    print(f"{'statement':<24} {'legacy us/call':>15} {'prebuilt us/call':>17} {'speedup':>8}")
+    with engine.begin() as conn:
+        for name, (legacy, prebuilt, args) in cases.items():
+            # warm up the compiled statement cache of both variants
+            legacy(conn, *args)
+            prebuilt(conn, *args)
+            legacy_time: float = timeit.timeit(lambda: legacy(conn, *args), number=number) / number
+            prebuilt_time: float = timeit.timeit(lambda: prebuilt(conn, *args), number=number) / number
+            print(
+                f"{name:<24} {legacy_time * 1e6:>15.1f} {prebuilt_time * 1e6:>17.1f}"
+                f" {legacy_time / prebuilt_time:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000, help="calls per statement")
+    args = parser.parse_args()
+    main(args.number)
@@ -0,0 +1,2 @@
+-- /room/list filters waiting rooms by live_id (room_model._get_rooms_by_live_id)
+ALTER TABLE `room` ADD INDEX `status_live_id` (`status`, `live_id`);
@@ -0,0 +1,6 @@
+-- last change of a room, read by the room sweeper (app/maintenance.py sweep_rooms)
+ALTER TABLE `room`
+  ADD COLUMN `updated_at` bigint NOT NULL DEFAULT 0,
+  ADD INDEX `status_updated_at` (`status`, `updated_at`);
+-- rooms that exist at migration time get the full timeout before they are swept
+UPDATE `room` SET `updated_at` = UNIX_TIMESTAMP();
@@ -0,0 +1,12 @@
+-- best score per live, difficulty and player (app/leaderboard.py)
+CREATE TABLE `live_best_score` (
+  `live_id` bigint NOT NULL,
+  `difficulty` int NOT NULL,
+  `user_id` bigint NOT NULL,
+  `user_name` varchar(255) NOT NULL,
+  `leader_card_id` int DEFAULT NULL,
+  `score` int NOT NULL,
+  `updated_at` bigint NOT NULL,
+  PRIMARY KEY (`live_id`, `difficulty`, `user_id`),
+  KEY `live_difficulty_score` (`live_id`, `difficulty`, `score`)
+);
@@ -0,0 +1,15 @@
+-- play statistics per user, counted by /room/end (app/room_model.py _finish_playing).
+-- Then `python -m app.maintenance rebuild_user_play_stats` counts the plays still held in room_user.
+CREATE TABLE `user_play_stats` (
+  `user_id` bigint NOT NULL,
+  `play_count` bigint NOT NULL,
+  `total_score` bigint NOT NULL,
+  `best_score` int NOT NULL,
+  `judge_count_perfect` bigint NOT NULL,
+  `judge_count_great` bigint NOT NULL,
+  `judge_count_good` bigint NOT NULL,
+  `judge_count_bad` bigint NOT NULL,
+  `judge_count_miss` bigint NOT NULL,
+  `updated_at` bigint NOT NULL,
+  PRIMARY KEY (`user_id`)
+);
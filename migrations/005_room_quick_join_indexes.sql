@@ -0,0 +1,5 @@
+-- /room/quick_join picks the fullest waiting room of the live (room_model._select_joinable_room_for_update_stmt):
+-- walking this index in its order, the scan stops at the first unlocked room with a free slot.
+ALTER TABLE `room` ADD INDEX `status_live_id_joined_user_count` (`status`, `live_id`, `joined_user_count` DESC, `room_id`);
+-- the rooms a user has already joined, excluded by the same statement
+ALTER TABLE `room_user` ADD INDEX `user_id` (`user_id`);
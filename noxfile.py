@@ -10,6 +10,7 @@ import nox
 proj_root_path: Path = Path(__file__).parent
 python_code_path_list: List[str] = [
     str(proj_root_path / "app"),
+    str(proj_root_path / "benchmarks"),
     str(proj_root_path / "tests"),
     "noxfile.py",
 ]
@@ -1,3 +1,5 @@
 TRUNCATE TABLE `user`;
 TRUNCATE TABLE `room`;
 TRUNCATE TABLE `room_user`;
+TRUNCATE TABLE `live_best_score`;
+TRUNCATE TABLE `user_play_stats`;
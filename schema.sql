@@ -14,7 +14,11 @@ CREATE TABLE `room` (
   `live_id` bigint NOT NULL,
   `joined_user_count` bigint NOT NULL,
   `status` int NOT NULL DEFAULT 1,
-  PRIMARY KEY (`room_id`)
+  `updated_at` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`room_id`),
+  KEY `status_live_id` (`status`, `live_id`),
+  KEY `status_live_id_joined_user_count` (`status`, `live_id`, `joined_user_count` DESC, `room_id`),
+  KEY `status_updated_at` (`status`, `updated_at`)
 );
 
 DROP TABLE IF EXISTS `room_user`;
@@ -32,5 +36,34 @@ CREATE TABLE `room_user` (
   `judge_count_miss` int DEFAULT 0,
   `score` int DEFAULT 0,
   `end_playing` boolean NOT NULL DEFAULT false,
-  PRIMARY KEY (`room_id`, `user_id`)
+  PRIMARY KEY (`room_id`, `user_id`),
+  KEY `user_id` (`user_id`)
+);
+
+DROP TABLE IF EXISTS `live_best_score`;
+CREATE TABLE `live_best_score` (
+  `live_id` bigint NOT NULL,
+  `difficulty` int NOT NULL,
+  `user_id` bigint NOT NULL,
+  `user_name` varchar(255) NOT NULL,
+  `leader_card_id` int DEFAULT NULL,
+  `score` int NOT NULL,
+  `updated_at` bigint NOT NULL,
+  PRIMARY KEY (`live_id`, `difficulty`, `user_id`),
+  KEY `live_difficulty_score` (`live_id`, `difficulty`, `score`)
+);
+
+DROP TABLE IF EXISTS `user_play_stats`;
+CREATE TABLE `user_play_stats` (
+  `user_id` bigint NOT NULL,
+  `play_count` bigint NOT NULL,
+  `total_score` bigint NOT NULL,
+  `best_score` int NOT NULL,
+  `judge_count_perfect` bigint NOT NULL,
+  `judge_count_great` bigint NOT NULL,
+  `judge_count_good` bigint NOT NULL,
+  `judge_count_bad` bigint NOT NULL,
+  `judge_count_miss` bigint NOT NULL,
+  `updated_at` bigint NOT NULL,
+  PRIMARY KEY (`user_id`)
 );
@@ -2,10 +2,21 @@
 from logging import getLogger
 from logging.config import dictConfig
 from pathlib import Path
+from typing import Callable
+from typing import List
+from typing import Optional
 
 # Third Party Library
+import pytest
 import yaml
 
+# First Party Library
+from app import db
+from app import model  # noqa: F401 (defines the tables of db.metadata)
+from app import query_stats
+from app import room_model
+from app.config import settings
+
 filepath = Path(__file__).parents[1] / "conf" / "logging.yml"
 with open(file=str(filepath), mode="rt") as f:
     config_dict = yaml.safe_load(f)
@@ -14,3 +25,88 @@ del filepath, config_dict
 
 
 logger = getLogger(__name__)
+
+if settings.db_backend == "sqlite":
+    # the embedded database has no schema.sql (`make init_db`)
+    db.create_tables()
+
+
+@pytest.fixture
+def assert_max_queries() -> Callable[..., None]:
+    """check the X-Query-* headers of a response (settings.query_stats) against a query budget
+
+    usage:
+        def test_xxx(assert_max_queries):
+            response = client.post("/room/wait", ...)
+            assert_max_queries(response, statements=1, transactions=1)
+    """
+    if not settings.query_stats:
+        pytest.skip(f"query_stats is disabled in the {settings.profile!r} profile")
+
+    def check(response, statements: int, transactions: Optional[int] = None) -> None:
+        endpoint: str = f"{response.request.method} {response.request.url.path}"
+        assert int(response.headers[query_stats.statements_header]) <= statements, (
+            f"{endpoint} ran {response.headers[query_stats.statements_header]} statements"
+            f" ({response.headers[query_stats.transactions_header]} transactions), the budget is {statements}"
+        )
+        if transactions is not None:
+            assert int(response.headers[query_stats.transactions_header]) <= transactions, (
+                f"{endpoint} ran {response.headers[query_stats.transactions_header]} transactions,"
+                f" the budget is {transactions}"
+            )
+
+    return check
+
+
+@pytest.fixture
+def create_room() -> Callable[[int, List[int]], int]:
+    """create a room of a live joined by the users, the first one as the host
+
+    usage:
+        def test_xxx(create_room):
+            room_id: int = create_room(1001, [1, 2])
+    """
+
+    def create(live_id: int, user_ids: List[int]) -> int:
+        room_id: int = room_model.create_room(live_id)
+        for i, user_id in enumerate(user_ids):
+            assert (
+                room_model.join_room(
+                    user_id=user_id,
+                    room_id=room_id,
+                    user_name=f"user_{user_id}",
+                    leader_card_id=1,
+                    live_difficulty=room_model.LiveDifficulty.normal,
+                    is_host=i == 0,
+                )
+                == room_model.JoinRoomResult.Ok
+            )
+        return room_id
+
+    return create
+
+
+@pytest.fixture
+def room_user_result() -> Callable[..., room_model.RoomUserResult]:
+    """the finished play of a room member, for /room/end
+
+    usage:
+        def test_xxx(room_user_result):
+            result: room_model.RoomUserResult = room_user_result(room_id, user_id, score=100)
+    """
+
+    def make(
+        room_id: int, user_id: int, score: int, judge_count_list: Optional[List[int]] = None
+    ) -> room_model.RoomUserResult:
+        if judge_count_list is None:
+            # distinct counts, so that a judge stored in the wrong column shows
+            judge_count_list = list(range(len(room_model.const_judge_count_order)))
+        return room_model.RoomUserResult(
+            room_id=room_id,
+            user_id=user_id,
+            **dict(zip(room_model.const_judge_count_order, judge_count_list)),
+            score=score,
+            end_playing=True,
+        )
+
+    return make
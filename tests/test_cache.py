@@ -0,0 +1,62 @@
+# First Party Library
+from app.cache import MISSING
+from app.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(maxsize=4, ttl=10.0, clock=clock)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    clock.now = 10.0
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+
+
+def test_negative_entry_uses_own_ttl():
+    clock = FakeClock()
+    cache: TTLCache[str, None] = TTLCache(maxsize=4, ttl=10.0, clock=clock)
+    cache.set("unknown", None, ttl=1.0)
+    assert cache.get("unknown") is None
+    clock.now = 1.0
+    assert cache.get("unknown") is MISSING
+
+
+def test_lru_eviction():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" becomes the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_invalidate_and_stats():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    cache.invalidate("a")
+    assert cache.get("a") is MISSING
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size, stats.maxsize) == (1, 1, 0, 2)
+
+
+def test_set_skips_value_read_before_invalidation():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=None)
+    generation: int = cache.generation
+    # a reader reads the old value, a writer commits and invalidates, then the reader caches what it read
+    cache.invalidate("a")
+    cache.set("a", 1, generation=generation)
+    assert cache.get("a") is MISSING
+    cache.set("a", 2, generation=cache.generation)
+    assert cache.get("a") == 2
@@ -0,0 +1,46 @@
+# Standard Library
+from pathlib import Path
+
+# Third Party Library
+import pytest
+
+# First Party Library
+from app.config import load_settings
+
+
+def _write_config(tmp_path: Path) -> Path:
+    config_path = tmp_path / "settings.yml"
+    config_path.write_text(
+        "\n".join(
+            [
+                "profiles:",
+                "  small:",
+                "    db_pool_size: 2",
+                "    db_echo: true",
+            ]
+        )
+    )
+    return config_path
+
+
+def test_load_profile(tmp_path: Path):
+    settings = load_settings(profile="small", config_path=_write_config(tmp_path))
+    assert settings.profile == "small"
+    assert settings.db_pool_size == 2
+    assert settings.db_echo is True
+
+
+def test_env_overrides_profile(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("APP_DB_POOL_SIZE", "7")
+    settings = load_settings(profile="small", config_path=_write_config(tmp_path))
+    assert settings.db_pool_size == 7
+
+
+def test_unknown_profile(tmp_path: Path):
+    with pytest.raises(ValueError):
+        load_settings(profile="nothing", config_path=_write_config(tmp_path))
+
+
+@pytest.mark.parametrize("profile", ["dev", "prod"])
+def test_bundled_profiles(profile: str):
+    assert load_settings(profile=profile).profile == profile
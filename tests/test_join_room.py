@@ -0,0 +1,95 @@
+# Standard Library
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Third Party Library
+from sqlalchemy import select
+
+# First Party Library
+from app import room_model
+from app.db import engine
+from app.room_model import JoinRoomResult
+from app.room_model import WaitRoomStatus
+from app.room_model import room_table
+from app.room_model import room_user_table
+
+RoomRows = Tuple[Optional[int], List[Tuple[int, bool]]]
+
+
+def _join(room_id: int, user_id: int, is_host: bool = False) -> JoinRoomResult:
+    return room_model.join_room(
+        user_id=user_id,
+        room_id=room_id,
+        user_name=f"join_{user_id}",
+        leader_card_id=1,
+        live_difficulty=room_model.LiveDifficulty.normal,
+        is_host=is_host,
+    )
+
+
+def _room_rows(room_id: int) -> RoomRows:
+    """joined_user_count of the room (None if it is gone) and its (user_id, is_host) members"""
+    with engine.begin() as conn:
+        joined_user_count: Optional[int] = conn.execute(
+            select(room_table.c.joined_user_count).where(room_table.c.room_id == room_id)
+        ).scalar()
+        members = conn.execute(
+            select(room_user_table.c.user_id, room_user_table.c.is_host)
+            .where(room_user_table.c.room_id == room_id)
+            .order_by(room_user_table.c.user_id)
+        ).all()
+    return joined_user_count, [(member.user_id, member.is_host) for member in members]
+
+
+# Every failure below is rolled back to the savepoint of _join_room: neither the member row inserted first nor the
+# slot is left behind.
+
+
+def test_join_full_room(create_room):
+    room_id: int = create_room(5001, [5001 + i for i in range(room_model.max_user_count)])
+    before: RoomRows = _room_rows(room_id)
+    assert before[0] == room_model.max_user_count
+
+    assert _join(room_id, 5100) == JoinRoomResult.RoomFull
+    assert _room_rows(room_id) == before
+
+
+def test_join_room_twice(create_room):
+    room_id: int = create_room(5001, [5201])
+    before: RoomRows = _room_rows(room_id)
+    assert before == (1, [(5201, True)])
+
+    # the member row already exists: the insert fails before the slot is reserved
+    assert _join(room_id, 5201) == JoinRoomResult.OhterError
+    assert _room_rows(room_id) == before
+
+
+def test_join_started_room(create_room):
+    room_id: int = create_room(5001, [5301])
+    room_model.start_room(room_id)
+    before: RoomRows = _room_rows(room_id)
+
+    assert _join(room_id, 5302) == JoinRoomResult.OhterError
+    assert _room_rows(room_id) == before
+
+
+def test_join_dissolved_room(create_room):
+    room_id: int = create_room(5001, [5401, 5402])
+    # the host was evicted without handing over: the room is dissolved but still holds the other member
+    assert room_model.evict_room_user(room_id, 5401, host_handover=False)
+    assert room_model.get_room_status(room_id).status == WaitRoomStatus.Dissolution
+    before: RoomRows = _room_rows(room_id)
+    assert before == (1, [(5402, False)])
+
+    assert _join(room_id, 5403) == JoinRoomResult.OhterError
+    assert _room_rows(room_id) == before
+
+
+def test_join_dropped_room(create_room):
+    room_id: int = create_room(5001, [5501])
+    room_model.leave_room(room_id, 5501)
+    assert _room_rows(room_id) == (None, [])
+
+    assert _join(room_id, 5502) == JoinRoomResult.Disbanded
+    assert _room_rows(room_id) == (None, [])
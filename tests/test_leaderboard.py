@@ -0,0 +1,151 @@
+# Standard Library
+import asyncio
+import random
+from typing import List
+
+# Third Party Library
+from fastapi.testclient import TestClient
+
+# First Party Library
+from app import api
+from app import leaderboard
+from app import room_model
+from app.leaderboard import BestScore
+from app.leaderboard import TopK
+
+
+def _best_score(user_id: int, score: int) -> BestScore:
+    return BestScore(live_id=1, difficulty=1, user_id=user_id, user_name=f"u{user_id}", leader_card_id=1, score=score)
+
+
+def test_top_k():
+    board = TopK(k=3)
+    for user_id, score in [(1, 100), (2, 300), (3, 200), (4, 50)]:
+        board.offer(_best_score(user_id, score))
+    assert [(entry.rank, entry.user_id) for entry in board.top(10)] == [(1, 2), (2, 3), (3, 1)]
+    assert board.rank(4) is None  # below the top k
+
+    board.offer(_best_score(1, 90))  # not an improvement
+    assert board.rank(1).score == 100
+    board.offer(_best_score(1, 400))
+    assert [(entry.rank, entry.user_id) for entry in board.top(10)] == [(1, 1), (2, 2), (3, 3)]
+    board.offer(_best_score(5, 300))  # tie: ordered by user_id, user 3 is evicted
+    assert [(entry.rank, entry.user_id, entry.score) for entry in board.top(10)] == [
+        (1, 1, 400),
+        (2, 2, 300),
+        (2, 5, 300),
+    ]
+    assert board.rank(3) is None
+    assert len(board) == 3
+
+
+def _finish(live_id: int, user_id: int, score: int, difficulty: room_model.LiveDifficulty) -> None:
+    room_id: int = room_model.create_room(live_id)
+    assert (
+        room_model.join_room(
+            user_id=user_id,
+            room_id=room_id,
+            user_name=f"leaderboard_{user_id}",
+            leader_card_id=1,
+            live_difficulty=difficulty,
+            is_host=True,
+        )
+        == room_model.JoinRoomResult.Ok
+    )
+    room_model.finish_playing(
+        room_model.RoomUserResult(
+            room_id=room_id,
+            user_id=user_id,
+            judge_count_perfect=0,
+            judge_count_great=0,
+            judge_count_good=0,
+            judge_count_bad=0,
+            judge_count_miss=0,
+            score=score,
+            end_playing=True,
+        )
+    )
+
+
+def test_best_score_is_kept():
+    live_id: int = random.randint(10**8, 10**9)
+    normal = room_model.LiveDifficulty.normal
+    _finish(live_id, 1, 500, normal)
+    _finish(live_id, 2, 700, normal)
+    _finish(live_id, 1, 300, normal)  # not an improvement
+    _finish(live_id, 3, 900, room_model.LiveDifficulty.hard)  # another board
+
+    ranked_score = leaderboard.get_rank(live_id, int(normal), 1)
+    assert ranked_score is not None
+    assert (ranked_score.rank, ranked_score.score) == (2, 500)
+    _finish(live_id, 1, 800, normal)
+    ranked_score = leaderboard.get_rank(live_id, int(normal), 1)
+    assert ranked_score is not None
+    assert (ranked_score.rank, ranked_score.score) == (1, 800)
+    assert leaderboard.get_rank(live_id, int(normal), 3) is None
+
+
+def test_scores_of_other_workers():
+    live_id: int = random.randint(10**8, 10**9)
+    normal = room_model.LiveDifficulty.normal
+    now: List[float] = [0.0]
+    boards = leaderboard.Leaderboards(k=10, maxsize=10, ttl=5.0, clock=lambda: now[0])
+    _finish(live_id, 1, 500, normal)
+    assert [entry.score for entry in asyncio.run(boards.top(live_id, int(normal), 10))] == [500]
+
+    # finish_playing does not feed `boards`, like a /room/end served by another worker
+    _finish(live_id, 2, 700, normal)
+    ranked_score = asyncio.run(boards.rank(live_id, int(normal), 2))
+    assert ranked_score is not None
+    assert (ranked_score.rank, ranked_score.score) == (1, 700)
+    assert [entry.score for entry in asyncio.run(boards.top(live_id, int(normal), 10))] == [500]
+    now[0] = 5.0
+    assert [entry.score for entry in asyncio.run(boards.top(live_id, int(normal), 10))] == [700, 500]
+
+
+def test_leaderboard_api():
+    client = TestClient(api.app)
+    live_id: int = random.randint(10**8, 10**9)
+    difficulty: int = int(room_model.LiveDifficulty.normal)
+    tokens: List[str] = [
+        client.post("/user/create", json={"user_name": f"leaderboard{i}", "leader_card_id": 1}).json()["user_token"]
+        for i in range(3)
+    ]
+
+    def play(token: str, score: int) -> None:
+        headers = {"Authorization": f"bearer {token}"}
+        response = client.post(
+            "/room/create", headers=headers, json={"live_id": live_id, "select_difficulty": difficulty}
+        )
+        assert response.status_code == 200
+        room_id: int = response.json()["room_id"]
+        response = client.post(
+            "/room/end", headers=headers, json={"room_id": room_id, "score": score, "judge_count_list": [0] * 5}
+        )
+        assert response.status_code == 200
+
+    play(tokens[0], 100)
+    # loads the board, the next scores are offered to it
+    response = client.post("/leaderboard/top", json={"live_id": live_id, "difficulty": difficulty})
+    assert [entry["score"] for entry in response.json()["entries"]] == [100]
+    play(tokens[1], 300)
+    play(tokens[0], 200)
+
+    response = client.post("/leaderboard/top", json={"live_id": live_id, "difficulty": difficulty, "limit": 1})
+    assert response.status_code == 200
+    assert [(entry["rank"], entry["score"]) for entry in response.json()["entries"]] == [(1, 300)]
+
+    response = client.post(
+        "/leaderboard/rank",
+        headers={"Authorization": f"bearer {tokens[0]}"},
+        json={"live_id": live_id, "difficulty": difficulty},
+    )
+    assert response.status_code == 200
+    assert response.json()["entry"]["rank"] == 2
+    assert response.json()["entry"]["score"] == 200
+    response = client.post(
+        "/leaderboard/rank",
+        headers={"Authorization": f"bearer {tokens[2]}"},
+        json={"live_id": live_id, "difficulty": difficulty},
+    )
+    assert response.json() == {"entry": None}
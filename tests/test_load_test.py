@@ -0,0 +1,39 @@
+# First Party Library
+from benchmarks.load_test import JoinRoomResult
+from benchmarks.load_test import LoadTestConfig
+from benchmarks.load_test import Recorder
+from benchmarks.load_test import _percentile
+from benchmarks.load_test import compare
+from benchmarks.load_test import summarize
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert _percentile(values, 50) == 50.0
+    assert _percentile(values, 95) == 95.0
+    assert _percentile(values, 99) == 99.0
+    assert _percentile([3.0], 99) == 3.0
+    assert _percentile([], 50) == 0.0
+
+
+def test_summarize_and_compare():
+    recorder = Recorder()
+    for i in range(100):
+        recorder.record("/room/wait", 0.001 * (i + 1), ok=i != 0)
+    recorder.record_join(JoinRoomResult.Ok)
+    recorder.record_join(JoinRoomResult.RoomFull)
+
+    report = summarize(LoadTestConfig(players=1), recorder, elapsed=2.0, completed_players=1)
+    assert report["requests"] == 100
+    assert report["rps"] == 50.0
+    assert report["error_rate"] == 0.01
+    assert report["room_full_rate"] == 0.5
+    assert report["endpoints"]["/room/wait"]["p95_ms"] == 95.0
+
+    assert compare(report, report, tolerance=0.2) == []
+    slower = {
+        **report,
+        "rps": 10.0,
+        "endpoints": {"/room/wait": {**report["endpoints"]["/room/wait"], "p95_ms": 200.0}},
+    }
+    assert len(compare(slower, report, tolerance=0.2)) == 2
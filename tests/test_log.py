@@ -0,0 +1,113 @@
+# Standard Library
+import logging
+import threading
+from logging.handlers import QueueHandler
+from pathlib import Path
+from typing import Iterator
+
+# Third Party Library
+import pytest
+
+# First Party Library
+from app.config import Settings
+from app.config import settings
+from app.log import setup_logging
+from app.log import stop_logging
+
+
+class _RecordingHandler(logging.Handler):
+    records: list = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        _RecordingHandler.records.append((record.getMessage(), threading.current_thread()))
+
+
+class _AccessRecordingHandler(logging.Handler):
+    records: list = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        _AccessRecordingHandler.records.append(record.getMessage())
+
+
+@pytest.fixture
+def log_config_path(tmp_path: Path) -> Iterator[Path]:
+    config_path = tmp_path / "logging.yml"
+    config_path.write_text(
+        "\n".join(
+            [
+                "version: 1",
+                "handlers:",
+                "  recording_handler:",
+                f"    class: {__name__}._RecordingHandler",
+                "    level: INFO",
+                "loggers:",
+                "  app:",
+                "    level: DEBUG",
+                "    handlers:",
+                "      - recording_handler",
+                "disable_existing_loggers: false",
+            ]
+        )
+    )
+    _RecordingHandler.records = []
+    yield config_path
+    setup_logging(settings)
+
+
+def test_queue_logging(log_config_path: Path):
+    setup_logging(Settings(log_config_path=log_config_path, log_level="INFO", log_queue=True))
+    logger = logging.getLogger("app.test_log")
+    assert all(isinstance(handler, QueueHandler) for handler in logging.getLogger("app").handlers)
+
+    logger.debug("dropped %s", "by the level of the logger")
+    logger.info("written %s", "by the listener")
+    stop_logging()
+
+    assert [message for message, _ in _RecordingHandler.records] == ["written by the listener"]
+    assert _RecordingHandler.records[0][1] is not threading.current_thread()
+
+
+def test_queue_logging_keeps_handlers_per_logger(tmp_path: Path):
+    config_path = tmp_path / "logging.yml"
+    config_path.write_text(
+        "\n".join(
+            [
+                "version: 1",
+                "handlers:",
+                "  recording_handler:",
+                f"    class: {__name__}._RecordingHandler",
+                "  access_handler:",
+                f"    class: {__name__}._AccessRecordingHandler",
+                "loggers:",
+                "  app:",
+                "    level: INFO",
+                "    handlers:",
+                "      - recording_handler",
+                "  uvicorn.access:",
+                "    level: INFO",
+                "    handlers:",
+                "      - access_handler",
+                "    propagate: false",
+                "disable_existing_loggers: false",
+            ]
+        )
+    )
+    _RecordingHandler.records = []
+    _AccessRecordingHandler.records = []
+    try:
+        setup_logging(Settings(log_config_path=config_path, log_queue=True))
+        logging.getLogger("app.test_log").info("app")
+        logging.getLogger("uvicorn.access").info("access")
+        stop_logging()
+    finally:
+        setup_logging(settings)
+
+    assert [message for message, _ in _RecordingHandler.records] == ["app"]
+    assert _AccessRecordingHandler.records == ["access"]
+
+
+def test_direct_logging(log_config_path: Path):
+    setup_logging(Settings(log_config_path=log_config_path, log_queue=False))
+    logging.getLogger("app.test_log").info("written %s", "by the caller")
+
+    assert _RecordingHandler.records == [("written by the caller", threading.current_thread())]
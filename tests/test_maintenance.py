@@ -0,0 +1,103 @@
+# Standard Library
+import asyncio
+from typing import Dict
+from typing import Optional
+
+# Third Party Library
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy import update
+
+# First Party Library
+from app import maintenance
+from app import room_model
+from app.db import engine
+from app.room_model import WaitRoomStatus
+from app.room_model import room_table
+from app.room_model import room_user_table
+from app.room_model import user_play_stats_table
+
+
+def _make_stale(room_id: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(update(room_table).where(room_table.c.room_id == room_id).values(updated_at=0))
+
+
+def _status(room_id: int) -> Optional[WaitRoomStatus]:
+    with engine.begin() as conn:
+        status = conn.execute(select(room_table.c.status).where(room_table.c.room_id == room_id)).scalar()
+    return None if status is None else WaitRoomStatus(status)
+
+
+def _room_user_count(room_id: int) -> int:
+    with engine.begin() as conn:
+        return len(conn.execute(select(room_user_table).where(room_user_table.c.room_id == room_id)).all())
+
+
+def test_sweep_rooms(create_room):
+    abandoned: int = create_room(2001, [1])
+    stuck: int = create_room(2001, [1])
+    room_model.start_room(stuck)
+    active: int = create_room(2001, [1])
+    _make_stale(abandoned)
+    _make_stale(stuck)
+
+    # batch_size=1 runs one transaction per room
+    swept: Dict[str, int] = maintenance.sweep_rooms(batch_size=1, interval=0)
+    assert swept == {"Waiting": 1, "Dissolution": 0, "LiveStart": 1}
+    # the members of the abandoned room see Dissolution before it is deleted
+    assert _status(abandoned) == WaitRoomStatus.Dissolution
+    assert _room_user_count(abandoned) == 1
+    assert _status(stuck) is None
+    assert _room_user_count(stuck) == 0
+    assert _status(active) == WaitRoomStatus.Waiting
+
+    # not deleted before room_dissolution_grace
+    assert maintenance.sweep_rooms()["Dissolution"] == 0
+    _make_stale(abandoned)
+    assert maintenance.sweep_rooms() == {"Waiting": 0, "Dissolution": 1, "LiveStart": 0}
+    assert _status(abandoned) is None
+    assert _room_user_count(abandoned) == 0
+    assert _status(active) == WaitRoomStatus.Waiting
+
+
+def test_rebuild_user_play_stats(create_room):
+    user_id: int = 2002
+    for score in [100, 200, 300]:
+        room_id: int = create_room(2002, [1, user_id])
+        room_model.finish_playing(
+            room_model.RoomUserResult(
+                room_id=room_id,
+                user_id=user_id,
+                judge_count_perfect=score,
+                judge_count_great=1,
+                judge_count_good=0,
+                judge_count_bad=0,
+                judge_count_miss=0,
+                score=score,
+                end_playing=True,
+            )
+        )
+    counted: room_model.UserPlayStats = room_model.get_user_play_stats(user_id)
+    assert counted.play_count == 3
+    with engine.begin() as conn:
+        conn.execute(delete(user_play_stats_table).where(user_play_stats_table.c.user_id == user_id))
+
+    # batch_size=1 pages through the users one by one, each summed up over its plays
+    assert maintenance.rebuild_user_play_stats(batch_size=1, interval=0) >= 1
+    assert room_model.get_user_play_stats(user_id) == counted
+    assert counted.judge_count_list == [600, 3, 0, 0, 0]
+
+
+def test_sweep_rooms_keeps_polled_rooms(create_room):
+    polled: int = create_room(2003, [1])
+    polled_fast: int = create_room(2003, [1])
+    _make_stale(polled)
+    _make_stale(polled_fast)
+    # /room/wait of a member, on both response paths
+    assert room_model.get_room_snapshot(polled) is not None
+    assert asyncio.run(room_model.get_wait_room_record_async(polled_fast)) is not None
+
+    maintenance.sweep_rooms(batch_size=1, interval=0)
+    assert _status(polled) == WaitRoomStatus.Waiting
+    assert _status(polled_fast) == WaitRoomStatus.Waiting
@@ -0,0 +1,63 @@
+# Standard Library
+from typing import Dict
+
+# Third Party Library
+from fastapi.testclient import TestClient
+from prometheus_client.parser import text_string_to_metric_families
+
+# First Party Library
+from app import api
+from app import room_model
+from app.config import settings
+
+client = TestClient(api.app)
+
+
+def _scrape() -> Dict[str, Dict[tuple, float]]:
+    """metric sample name -> sorted label items -> value"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    samples: Dict[str, Dict[tuple, float]] = {}
+    for family in text_string_to_metric_families(response.text):
+        for sample in family.samples:
+            samples.setdefault(sample.name, {})[tuple(sorted(sample.labels.items()))] = sample.value
+    return samples
+
+
+def test_metrics():
+    token: str = client.post("/user/create", json={"user_name": "metrics", "leader_card_id": 1}).json()["user_token"]
+    response = client.post(
+        "/room/create",
+        headers={"Authorization": f"bearer {token}"},
+        json={"live_id": 1, "select_difficulty": int(room_model.LiveDifficulty.normal)},
+    )
+    assert response.status_code == 200
+    client.post("/no/such/route", json={})
+
+    samples = _scrape()
+
+    requests = samples["http_request_duration_seconds_count"]
+    assert requests[(("method", "POST"), ("route", "/room/create"), ("status", "200"))] >= 1
+    assert requests[(("method", "POST"), ("route", "unmatched"), ("status", "404"))] >= 1
+    assert samples["http_requests_in_progress"][(("method", "POST"), ("route", "/room/create"))] == 0
+    statements = samples["db_statement_duration_seconds_count"]
+    assert statements[(("function", "room_model._create_room"),)] >= 1
+    assert statements[(("function", "model._create_user"),)] >= 1
+    assert samples["db_pool_checkout_wait_seconds_count"][(("engine", "async"),)] >= 1
+    assert (("engine", "async"),) in samples["db_pool_checked_out"]
+    assert samples["rooms"][(("status", "Waiting"),)] >= 1
+    assert samples["room_joined_players"][(("status", "Waiting"),)] >= 1
+    assert set(samples["rooms"]) == {(("status", status.name),) for status in room_model.WaitRoomStatus}
+    # /room/create looked the token up
+    assert samples["cache_misses_total"][(("cache", "user"),)] >= 1
+    assert samples["cache_size"][(("cache", "user"),)] >= 1
+    assert samples["cache_maxsize"][(("cache", "user"),)] == settings.user_cache_size
+
+
+def test_user_cache_hits():
+    token: str = client.post("/user/create", json={"user_name": "metrics", "leader_card_id": 1}).json()["user_token"]
+    hits: float = _scrape()["cache_hits_total"][(("cache", "user"),)]
+    for _ in range(2):
+        assert client.get("/user/me", headers={"Authorization": f"bearer {token}"}).status_code == 200
+    # the first lookup may read the database, the second one is answered by the cache
+    assert _scrape()["cache_hits_total"][(("cache", "user"),)] >= hits + 1
@@ -0,0 +1,36 @@
+# Standard Library
+import asyncio
+
+# First Party Library
+from app.notifier import Notifier
+from app.notifier import SingleFlight
+
+
+def test_notify_wakes_subscriber():
+    async def main():
+        notifier: Notifier[int] = Notifier()
+        event = notifier.subscribe(1)
+        asyncio.get_running_loop().call_soon(notifier.notify, 1)
+        assert await Notifier.wait(event, timeout=1.0) is True
+        # a new subscription waits for the next notification
+        assert await Notifier.wait(notifier.subscribe(1), timeout=0.01) is False
+
+    asyncio.run(main())
+
+
+def test_single_flight_shares_call():
+    calls = []
+
+    async def main():
+        flight: SingleFlight[int, int] = SingleFlight()
+
+        async def fetch() -> int:
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(*[flight.do(1, fetch) for _ in range(5)])
+        assert results == [1] * 5
+        assert await flight.do(1, fetch) == 2
+
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+# Standard Library
+from typing import List
+from typing import Tuple
+
+# First Party Library
+from app import room_model
+from app.presence import PresenceTracker
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_pop_expired():
+    clock = FakeClock()
+    tracker = PresenceTracker(clock=clock)
+    tracker.touch(1, 10)
+    tracker.touch(1, 11)
+    tracker.touch(2, 20)
+    clock.now = 5.0
+    tracker.touch(1, 10)  # heartbeat
+    clock.now = 10.0
+    assert tracker.pop_expired(timeout=10.0) == [(1, 11), (2, 20)]
+    assert tracker.pop_expired(timeout=10.0) == []
+    assert len(tracker) == 1
+
+
+def test_forget_room():
+    tracker = PresenceTracker(clock=FakeClock())
+    tracker.touch(1, 10)
+    tracker.touch(1, 11)
+    tracker.touch(2, 20)
+    tracker.forget_room(1)
+    tracker.forget(2, 20)
+    assert len(tracker) == 0
+    assert tracker.pop_expired(timeout=0.0) == []
+
+
+def _members(room_id: int) -> List[Tuple[int, bool]]:
+    return [(room_user.user_id, room_user.is_host) for room_user in room_model.get_room_users(room_id, user_id_req=0)]
+
+
+def test_evict_host_hands_over(create_room):
+    room_id: int = create_room(3001, [101, 102])
+    assert room_model.evict_room_user(room_id, 101, host_handover=True)
+    assert _members(room_id) == [(102, True)]
+    # no longer a member
+    assert not room_model.evict_room_user(room_id, 101, host_handover=True)
+
+
+def test_evict_host_dissolves(create_room):
+    room_id: int = create_room(3001, [103, 104])
+    assert room_model.evict_room_user(room_id, 103, host_handover=False)
+    assert _members(room_id) == [(104, False)]
+    assert room_model.get_room_status(room_id).status == room_model.WaitRoomStatus.Dissolution
+    # the member left behind is evicted later, and the room goes with it
+    assert room_model.evict_room_user(room_id, 104, host_handover=False)
+    assert _members(room_id) == []
+
+
+def test_evict_skips_started_room(create_room):
+    room_id: int = create_room(3001, [105])
+    room_model.start_room(room_id)
+    assert not room_model.evict_room_user(room_id, 105)
+    assert _members(room_id) == [(105, True)]
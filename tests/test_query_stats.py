@@ -0,0 +1,41 @@
+# Standard Library
+import asyncio
+
+# Third Party Library
+import pytest
+from fastapi.testclient import TestClient
+
+# First Party Library
+from app import api
+from app import model
+from app import query_stats
+from app.config import settings
+from app.db import async_engine
+
+client = TestClient(api.app)
+
+
+@pytest.mark.skipif(not settings.query_stats, reason="the engines are instrumented by settings.query_stats")
+def test_track_queries():
+    async def create_user() -> query_stats.QueryStats:
+        with query_stats.track_queries() as stats:
+            token: str = await model.create_user_async("query_stats", 1)
+            async with async_engine.begin() as conn:
+                await conn.run_sync(model._get_user_by_token, token)
+                await conn.run_sync(model._get_user_by_token, token)
+        return stats
+
+    stats: query_stats.QueryStats = asyncio.run(create_user())
+    assert (stats.statements, stats.transactions) == (3, 2)
+    assert stats.seconds > 0
+
+
+def test_headers(assert_max_queries):
+    response = client.post("/user/create", json={"user_name": "query_stats", "leader_card_id": 1})
+    assert response.status_code == 200
+    assert response.headers[query_stats.statements_header] == "1"
+    assert response.headers[query_stats.transactions_header] == "1"
+    assert_max_queries(response, statements=1, transactions=1)
+
+    response = client.get("/")
+    assert response.headers[query_stats.statements_header] == "0"
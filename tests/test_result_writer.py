@@ -0,0 +1,69 @@
+# Standard Library
+import asyncio
+from typing import List
+from typing import Optional
+
+# First Party Library
+from app import room_model
+from app.leaderboard import BestScore
+from app.result_writer import ResultWriter
+
+
+def test_result_writer(create_room, room_user_result):
+    first: int = create_room(4001, [4001, 4002])
+    second: int = create_room(4001, [4003])
+    results = [
+        room_user_result(first, 4001, 100),
+        room_user_result(first, 4002, 200),
+        room_user_result(second, 4003, 300, judge_count_list=[300, 1, 0, 0, 0]),
+        room_user_result(second, 4004, 400),  # not in the room
+        room_user_result(first, 4001, 150),  # repeated /room/end: overwrites, not another play
+    ]
+
+    async def main() -> List[Optional[BestScore]]:
+        writer = ResultWriter(batch_size=2, delay=0.01, buffer_size=3)
+        writer.start()
+        try:
+            return await asyncio.gather(*[writer.submit(result) for result in results])
+        finally:
+            await writer.stop()
+
+    best_scores: List[Optional[BestScore]] = asyncio.run(main())
+    assert [None if best_score is None else best_score.score for best_score in best_scores] == [
+        100,
+        200,
+        300,
+        None,
+        150,
+    ]
+    assert {result_user.user_id: result_user.score for result_user in room_model.get_result_user_list(first)} == {
+        4001: 150,
+        4002: 200,
+    }
+    assert [result_user.judge_count_list for result_user in room_model.get_result_user_list(second)] == [
+        [300, 1, 0, 0, 0]
+    ]
+    stats: room_model.UserPlayStats = room_model.get_user_play_stats(4001)
+    assert (stats.play_count, stats.best_score) == (1, 100)
+    assert room_model.get_user_play_stats(4004).play_count == 0
+
+
+def test_result_writer_stop_writes_accepted_results(create_room, room_user_result):
+    room_id: int = create_room(4001, [4101, 4102])
+
+    async def main() -> List[Optional[BestScore]]:
+        writer = ResultWriter(batch_size=1, delay=10.0, buffer_size=2)
+        writer.start()
+        submits = [
+            asyncio.ensure_future(writer.submit(room_user_result(room_id, user_id, user_id)))
+            for user_id in [4101, 4102]
+        ]
+        # the first batch is being written, the second one is buffered
+        for _ in range(3):
+            await asyncio.sleep(0)
+        await writer.stop()
+        return await asyncio.gather(*submits)
+
+    best_scores: List[Optional[BestScore]] = asyncio.run(main())
+    assert [None if best_score is None else best_score.score for best_score in best_scores] == [4101, 4102]
+    assert sorted(result_user.score for result_user in room_model.get_result_user_list(room_id)) == [4101, 4102]
@@ -1,4 +1,5 @@
 # Standard Library
+import asyncio
 from logging import getLogger
 from typing import Any
 from typing import Dict
@@ -10,7 +11,9 @@ from fastapi.testclient import TestClient
 
 # First Party Library
 from app import api
+from app import model
 from app import room_model
+from app.config import settings
 
 logger = getLogger(__name__)
 
@@ -101,8 +104,19 @@ class TestRoom:
         assert response.status_code == 200
         logger.info(f"{response=}")
         room_list_response: api.RoomListResponse = api.RoomListResponse.parse_obj(response.json())
-        assert room_id in set([room_info.room_id for room_info in room_list_response.room_info_list])
-        assert set([room_arg["live_id"]]) == set([room_info.live_id for room_info in room_list_response.room_info_list])
+        assert room_id not in set([room_info.room_id for room_info in room_list_response.room_info_list])
+        assert set([room_info.live_id for room_info in room_list_response.room_info_list]) <= set([room_arg["live_id"]])
+
+        # the members of the dropped room are gone as well
+        response = client.post(
+            "/room/wait",
+            headers=_get_auth_header(self.user_tokens[0]),
+            json=dict(room_id=room_id),
+        )
+        assert response.status_code == 200
+        room_wait_response = api.RoomWaitResponse.parse_obj(response.json())
+        assert room_wait_response.status == room_model.WaitRoomStatus.Dissolution
+        assert room_wait_response.room_user_list == []
 
     @pytest.mark.parametrize(
         "room_arg",
@@ -158,7 +172,7 @@ class TestRoom:
         room_join_response = api.RoomJoinResponse.parse_obj(response.json())
         assert room_join_response.join_room_result == room_model.JoinRoomResult.RoomFull
 
-    def test_start_to_end(self):
+    def test_start_to_end(self, assert_max_queries):
         response = client.post(
             "/room/create",
             headers=_get_auth_header(self.user_tokens[0]),
@@ -168,11 +182,13 @@ class TestRoom:
             ),
         )
         assert response.status_code == 200
+        assert_max_queries(response, statements=6, transactions=3)
         room_id = response.json()["room_id"]
         logger.info(f"room/create {room_id=}")
 
         response = client.post("/room/list", json=dict(live_id=1001))
         assert response.status_code == 200
+        assert_max_queries(response, statements=1, transactions=1)
         logger.info("room/list response:", response.json())
 
         response = client.post(
@@ -184,6 +200,7 @@ class TestRoom:
             },
         )
         assert response.status_code == 200
+        assert_max_queries(response, statements=5, transactions=2)
         logger.info("room/join response:", response.json())
         assert response.json()["join_room_result"] in [result for result in room_model.JoinRoomResult]
 
@@ -193,7 +210,13 @@ class TestRoom:
             json={"room_id": room_id},
         )
         assert response.status_code == 200
+        assert_max_queries(response, statements=1, transactions=1)
         logger.info("room/wait response:", response.json())
+        room_wait_response = api.RoomWaitResponse.parse_obj(response.json())
+        assert room_wait_response.status == room_model.WaitRoomStatus.Waiting
+        assert [(room_user.is_me, room_user.is_host) for room_user in room_wait_response.room_user_list] == [
+            (True, True)
+        ]
 
         response = client.post(
             "/room/start",
@@ -201,6 +224,7 @@ class TestRoom:
             json={"room_id": room_id},
         )
         assert response.status_code == 200
+        assert_max_queries(response, statements=1, transactions=1)
         logger.info("room/wait response:", response.json())
 
         response = client.post(
@@ -209,6 +233,7 @@ class TestRoom:
             json={"room_id": room_id, "score": 1234, "judge_count_list": [5, 4, 3, 2, 1]},
         )
         assert response.status_code == 200
+        assert_max_queries(response, statements=4, transactions=1)
         logger.info("room/end response:", response.json())
 
         response = client.post(
@@ -216,4 +241,220 @@ class TestRoom:
             json={"room_id": room_id},
         )
         assert response.status_code == 200
+        assert_max_queries(response, statements=1, transactions=1)
         logger.info("room/end response:", response.json())
+
+        # long-poll returns as soon as every player has finished
+        response = client.post(
+            "/room/result",
+            json={"room_id": room_id, "wait_timeout": 1.0},
+        )
+        assert response.status_code == 200
+        room_result_response = api.RoomResultResponse.parse_obj(response.json())
+        assert [result_user.score for result_user in room_result_response.result_user_list] == [1234]
+
+        # the complete result is cached
+        response = client.post("/room/result", json={"room_id": room_id})
+        assert response.status_code == 200
+        assert_max_queries(response, statements=0, transactions=0)
+
+        # a repeated /room/end overwrites the result and invalidates the cached one
+        response = client.post(
+            "/room/end",
+            headers=_get_auth_header(self.user_tokens[0]),
+            json={"room_id": room_id, "score": 2345, "judge_count_list": [6, 4, 3, 2, 1]},
+        )
+        assert response.status_code == 200
+        response = client.post("/room/result", json={"room_id": room_id})
+        assert response.status_code == 200
+        room_result_response = api.RoomResultResponse.parse_obj(response.json())
+        assert [
+            (result_user.score, result_user.judge_count_list) for result_user in room_result_response.result_user_list
+        ] == [(2345, [6, 4, 3, 2, 1])]
+
+    def test_wait_stream_ends_after_start(self):
+        response = client.post(
+            "/room/create",
+            headers=_get_auth_header(self.user_tokens[0]),
+            json=dict(live_id=1002, select_difficulty=int(room_model.LiveDifficulty.normal)),
+        )
+        assert response.status_code == 200
+        room_id = response.json()["room_id"]
+
+        response = client.post(
+            "/room/start",
+            headers=_get_auth_header(self.user_tokens[0]),
+            json={"room_id": room_id},
+        )
+        assert response.status_code == 200
+
+        # the room is no longer waiting: the stream sends a single snapshot and closes
+        response = client.post(
+            "/room/wait/stream",
+            headers=_get_auth_header(self.user_tokens[0]),
+            json={"room_id": room_id},
+        )
+        assert response.status_code == 200
+        events = [line[len("data: ") :] for line in response.text.splitlines() if line.startswith("data: ")]
+        assert len(events) == 1
+        room_wait_response = api.RoomWaitResponse.parse_raw(events[0])
+        assert room_wait_response.status == room_model.WaitRoomStatus.LiveStart
+        assert [room_user.is_me for room_user in room_wait_response.room_user_list] == [True]
+
+    def test_wait_stream_pushes_changes(self):
+        host: model.SafeUser = model.get_user_by_token(self.user_tokens[0])
+        guest: model.SafeUser = model.get_user_by_token(self.user_tokens[1])
+
+        async def main() -> List[api.RoomWaitResponse]:
+            room_id: int = await room_model.create_room_async(1004)
+            await room_model.join_room_async(
+                host.id, room_id, host.name, host.leader_card_id, room_model.LiveDifficulty.normal, is_host=True
+            )
+            events = api._room_wait_events(room_id, host)
+            responses: List[api.RoomWaitResponse] = []
+
+            async def next_response() -> api.RoomWaitResponse:
+                event: str = await asyncio.wait_for(events.__anext__(), timeout=5.0)
+                assert event.startswith("data: ")
+                return api.RoomWaitResponse.parse_raw(event[len("data: ") :])
+
+            # the snapshot on connect, then the stream waits for a change
+            responses.append(await next_response())
+            pending = asyncio.ensure_future(next_response())
+            await asyncio.sleep(0.05)
+            assert not pending.done()
+            await room_model.join_room_async(
+                guest.id, room_id, guest.name, guest.leader_card_id, room_model.LiveDifficulty.hard
+            )
+            responses.append(await pending)
+            pending = asyncio.ensure_future(next_response())
+            await asyncio.sleep(0.05)
+            await room_model.start_room_async(room_id)
+            responses.append(await pending)
+            # the stream ends with the room no longer waiting
+            with pytest.raises(StopAsyncIteration):
+                await events.__anext__()
+            return responses
+
+        responses: List[api.RoomWaitResponse] = asyncio.run(main())
+        assert [(response.status, len(response.room_user_list)) for response in responses] == [
+            (room_model.WaitRoomStatus.Waiting, 1),
+            (room_model.WaitRoomStatus.Waiting, 2),
+            (room_model.WaitRoomStatus.LiveStart, 2),
+        ]
+
+    def test_room_list_pagination(self):
+        room_ids: List[int] = []
+        for _ in range(3):
+            response = client.post(
+                "/room/create",
+                headers=_get_auth_header(self.user_tokens[5]),
+                json=dict(live_id=1003, select_difficulty=int(room_model.LiveDifficulty.normal)),
+            )
+            assert response.status_code == 200
+            room_ids.append(response.json()["room_id"])
+
+        response = client.post(
+            "/room/list",
+            json=dict(live_id=1003, limit=2, order=int(room_model.RoomListOrder.newest)),
+        )
+        assert response.status_code == 200
+        first_page = api.RoomListResponse.parse_obj(response.json())
+        assert [room_info.room_id for room_info in first_page.room_info_list] == room_ids[:0:-1]
+        assert first_page.next_cursor is not None
+
+        response = client.post(
+            "/room/list",
+            json=dict(live_id=1003, limit=2, order=int(room_model.RoomListOrder.newest), cursor=first_page.next_cursor),
+        )
+        assert response.status_code == 200
+        second_page = api.RoomListResponse.parse_obj(response.json())
+        assert second_page.room_info_list[0].room_id == room_ids[0]
+
+        # a cursor is bound to its order
+        response = client.post(
+            "/room/list",
+            json=dict(live_id=1003, order=int(room_model.RoomListOrder.oldest), cursor=first_page.next_cursor),
+        )
+        assert response.status_code == 400
+
+    def test_quick_join(self):
+        response = client.post(
+            "/room/quick_join",
+            headers=_get_auth_header(self.user_tokens[6]),
+            json=dict(live_id=1004, select_difficulty=int(room_model.LiveDifficulty.normal)),
+        )
+        assert response.status_code == 200
+        quick_join_response = api.RoomQuickJoinResponse.parse_obj(response.json())
+
+        response = client.post(
+            "/room/wait",
+            headers=_get_auth_header(self.user_tokens[6]),
+            json={"room_id": quick_join_response.room_id},
+        )
+        assert response.status_code == 200
+        room_wait_response = api.RoomWaitResponse.parse_obj(response.json())
+        assert [room_user.is_host for room_user in room_wait_response.room_user_list if room_user.is_me] == [
+            quick_join_response.is_host
+        ]
+
+        # a room the user has already joined is never picked again
+        response = client.post(
+            "/room/quick_join",
+            headers=_get_auth_header(self.user_tokens[6]),
+            json=dict(live_id=1004, select_difficulty=int(room_model.LiveDifficulty.normal)),
+        )
+        assert response.status_code == 200
+        assert response.json()["room_id"] != quick_join_response.room_id
+
+
+def test_result_waiter_after_notification_does_not_join_stale_read(monkeypatch):
+    room_id: int = 1005
+    complete: List[room_model.ResultUser] = [room_model.ResultUser(user_id=1, judge_count_list=[0] * 5, score=1)]
+    reads: List[int] = []
+
+    async def main() -> None:
+        gate = asyncio.Event()
+
+        async def get_result_user_list_async(room_id: int) -> List[room_model.ResultUser]:
+            reads.append(room_id)
+            if len(reads) == 1:
+                # the first read sees the room before the last /room/end and is slow to return
+                await gate.wait()
+                return []
+            return complete
+
+        monkeypatch.setattr(room_model, "get_result_user_list_async", get_result_user_list_async)
+        first = asyncio.ensure_future(room_model.wait_result_user_list_async(room_id, timeout=5.0))
+        await asyncio.sleep(0.01)
+        # the last /room/end commits while the first read is running
+        room_model.room_result_notifier.notify(room_id)
+        second = asyncio.ensure_future(room_model.wait_result_user_list_async(room_id, timeout=5.0))
+        assert await asyncio.wait_for(second, timeout=1.0) == complete
+        gate.set()
+        # woken up by the notification, the first waiter reads again
+        assert await asyncio.wait_for(first, timeout=1.0) == complete
+
+    asyncio.run(main())
+    assert len(reads) == 3
+
+
+def test_result_waiter_reads_again_without_notification(monkeypatch):
+    complete: List[room_model.ResultUser] = [room_model.ResultUser(user_id=1, judge_count_list=[0] * 5, score=1)]
+    reads: List[int] = []
+
+    async def get_result_user_list_async(room_id: int) -> List[room_model.ResultUser]:
+        # the last /room/end is served by another worker after the first read, and notifies no one here
+        reads.append(room_id)
+        return [] if len(reads) == 1 else complete
+
+    monkeypatch.setattr(room_model, "get_result_user_list_async", get_result_user_list_async)
+    monkeypatch.setattr(settings, "room_result_poll_interval", 0.01)
+    assert asyncio.run(room_model.wait_result_user_list_async(1006, timeout=5.0)) == complete
+    assert len(reads) == 2
+
+    # the wait ends at the timeout, before the next poll, with one last read
+    reads.clear()
+    monkeypatch.setattr(settings, "room_result_poll_interval", 10.0)
+    assert asyncio.run(room_model.wait_result_user_list_async(1007, timeout=0.05)) == complete
+    assert len(reads) == 2
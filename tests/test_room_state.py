@@ -0,0 +1,156 @@
+# Third Party Library
+import orjson
+
+# First Party Library
+from app import room_model
+from app.api import RoomListResponse
+from app.api import RoomWaitResponse
+from app.api import WaitResponseRoomUser
+from app.room_state import RoomStateEngine
+
+
+def _join(engine: RoomStateEngine, room_id: int, user_id: int, is_host: bool = False) -> room_model.JoinRoomResult:
+    return engine.join_room(
+        user_id=user_id,
+        room_id=room_id,
+        user_name=f"user_{user_id}",
+        leader_card_id=1000,
+        live_difficulty=room_model.LiveDifficulty.normal,
+        is_host=is_host,
+    )
+
+
+def test_room_lifecycle_in_memory(room_user_result):
+    engine = RoomStateEngine()
+    engine.add_room(room_id=1, live_id=1001)
+
+    assert _join(engine, room_id=1, user_id=1, is_host=True) == room_model.JoinRoomResult.Ok
+    assert _join(engine, room_id=1, user_id=1) == room_model.JoinRoomResult.OhterError  # already joined
+    for user_id in range(2, room_model.max_user_count + 1):
+        assert _join(engine, room_id=1, user_id=user_id) == room_model.JoinRoomResult.Ok
+    assert _join(engine, room_id=1, user_id=100) == room_model.JoinRoomResult.RoomFull
+    assert _join(engine, room_id=2, user_id=100) == room_model.JoinRoomResult.Disbanded
+    assert [room_info.room_id for room_info in engine.get_rooms_by_live_id(1001)] == [1]
+
+    snapshot = engine.get_room_snapshot(room_id=1, user_id_req=2)
+    assert snapshot is not None
+    assert [(room_user.is_me, room_user.is_host) for room_user in snapshot.room_user_list][:2] == [
+        (False, True),
+        (True, False),
+    ]
+
+    engine.start_room(room_id=1)
+    assert engine.get_room_status(room_id=1).status == room_model.WaitRoomStatus.LiveStart
+    assert engine.get_rooms_by_live_id(1001) == []
+
+    engine.finish_playing(room_user_result(room_id=1, user_id=1, score=100))
+    assert engine.get_result_user_list(room_id=1) == []  # the others are still playing
+    for user_id in range(2, room_model.max_user_count + 1):
+        engine.finish_playing(room_user_result(room_id=1, user_id=user_id, score=100))
+    result_user_list = engine.get_result_user_list(room_id=1)
+    assert result_user_list is not None
+    assert [result_user.judge_count_list for result_user in result_user_list][0] == [0, 1, 2, 3, 4]
+
+    # every transition is queued for the database
+    assert engine._queue.qsize() == room_model.max_user_count * 2 + 1
+
+    # the room is dropped with the last member
+    for user_id in range(1, room_model.max_user_count + 1):
+        assert engine.get_room_snapshot(room_id=1) is not None
+        engine.leave_room(room_id=1, user_id=user_id)
+    assert engine.get_room_snapshot(room_id=1) is None
+
+
+def test_waiting_room_index_in_memory():
+    engine = RoomStateEngine()
+
+    def indexed() -> dict:
+        return {live_id: list(rooms) for live_id, rooms in engine._waiting_rooms_by_live_id.items()}
+
+    engine.add_room(room_id=1, live_id=1003)
+    engine.add_room(room_id=2, live_id=1003)
+    engine.add_room(room_id=3, live_id=1004)
+    assert indexed() == {1003: [1, 2], 1004: [3]}
+    for room_id in (1, 2, 3):
+        _join(engine, room_id=room_id, user_id=room_id, is_host=True)
+
+    engine.start_room(room_id=1)
+    assert indexed() == {1003: [2], 1004: [3]}
+    assert [room_info.room_id for room_info in engine.get_rooms_by_live_id(1003)] == [2]
+
+    # leaving to empty drops the room, and the live without waiting rooms leaves the index
+    engine.leave_room(room_id=3, user_id=3)
+    assert 3 not in engine._rooms
+    assert indexed() == {1003: [2]}
+    engine.leave_room(room_id=2, user_id=2)
+    assert indexed() == {}
+    assert engine.get_rooms_by_live_id(1003) == []
+
+    # the started room is not indexed, and dropping it leaves the index alone
+    engine.leave_room(room_id=1, user_id=1)
+    assert engine._rooms == {}
+    assert indexed() == {}
+
+
+def test_evicted_host_dissolves_room_in_memory():
+    engine = RoomStateEngine()
+    engine.add_room(room_id=1, live_id=1002)
+    _join(engine, room_id=1, user_id=1, is_host=True)
+    _join(engine, room_id=1, user_id=2)
+
+    assert engine.evict_room_user(room_id=1, user_id=1, host_handover=False)
+    assert engine.get_room_status(room_id=1).status == room_model.WaitRoomStatus.Dissolution
+    assert engine.get_rooms_by_live_id(1002) == []
+    # the sweeper does not run in memory mode: evicting the last member drops the room
+    assert engine.evict_room_user(room_id=1, user_id=2, host_handover=False)
+    assert 1 not in engine._rooms
+    assert not engine.evict_room_user(room_id=1, user_id=2, host_handover=False)
+
+
+def test_room_list_pagination_in_memory():
+    engine = RoomStateEngine()
+    for room_id in range(1, 6):
+        engine.add_room(room_id=room_id, live_id=1001)
+    _join(engine, room_id=4, user_id=1)
+    _join(engine, room_id=2, user_id=2)
+
+    order = room_model.RoomListOrder.fewest_free_slots
+    first_page = room_model._make_room_list_page(
+        engine.get_rooms_by_live_id(1001, order=order, limit=3 + 1), order=order, limit=3
+    )
+    assert [room_info.room_id for room_info in first_page.room_info_list] == [2, 4, 1]
+    assert first_page.next_cursor is not None
+
+    after = room_model.RoomListCursor.decode(first_page.next_cursor)
+    assert [room_info.room_id for room_info in engine.get_rooms_by_live_id(1001, order=order, after=after)] == [3, 5]
+
+
+def test_records_encode_like_the_response_models():
+    engine = RoomStateEngine()
+    for room_id in range(1, 4):
+        engine.add_room(room_id=room_id, live_id=1001)
+    _join(engine, room_id=1, user_id=1, is_host=True)
+    _join(engine, room_id=1, user_id=2)
+    _join(engine, room_id=3, user_id=3, is_host=True)
+
+    order = room_model.RoomListOrder.fewest_free_slots
+    page = room_model._make_room_list_page(
+        engine.get_rooms_by_live_id(1001, order=order, limit=3), order=order, limit=2
+    )
+    record_room_info_list, next_cursor = room_model._split_room_list_page(
+        engine.get_room_info_records(1001, order=order, limit=3), order=order, limit=2
+    )
+    page_record = room_model.RoomListPageRecord(room_info_list=record_room_info_list, next_cursor=next_cursor)
+    response = RoomListResponse(room_info_list=page.room_info_list, next_cursor=page.next_cursor)
+    assert orjson.dumps(page_record) == orjson.dumps(response.dict())
+
+    snapshot = engine.get_room_snapshot(room_id=1, user_id_req=2)
+    assert snapshot is not None
+    wait_response = RoomWaitResponse(
+        status=snapshot.status,
+        room_user_list=[
+            WaitResponseRoomUser(name=room_user.user_name, **room_user.dict(exclude={"room_id", "user_name"}))
+            for room_user in snapshot.room_user_list
+        ],
+    )
+    assert orjson.dumps(engine.get_wait_room_record(room_id=1, user_id_req=2)) == orjson.dumps(wait_response.dict())
@@ -49,3 +49,33 @@ def test_create_user():
 def test_update_not_existing_user():
     with pytest.raises(InvalidToken):
         app.model.update_user(token="nothing", name="Hello", leader_card_id=0)
+
+
+def test_user_stats():
+    token: str = client.post("/user/create", json={"user_name": "stats", "leader_card_id": 1}).json()["user_token"]
+    headers = {"Authorization": f"bearer {token}"}
+
+    response = client.get("/user/stats", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["play_count"] == 0
+    assert response.json()["judge_count_list"] == [0, 0, 0, 0, 0]
+
+    for score, judge_count_list in [(100, [1, 2, 3, 4, 5]), (300, [10, 0, 0, 0, 0])]:
+        room_id: int = client.post("/room/create", headers=headers, json={"live_id": 1, "select_difficulty": 1}).json()[
+            "room_id"
+        ]
+        for _ in range(2):  # a repeated /room/end is not another play
+            response = client.post(
+                "/room/end",
+                headers=headers,
+                json={"room_id": room_id, "score": score, "judge_count_list": judge_count_list},
+            )
+            assert response.status_code == 200
+
+    response = client.get("/user/stats", headers=headers)
+    assert response.status_code == 200
+    response_data = response.json()
+    assert response_data["play_count"] == 2
+    assert response_data["total_score"] == 400
+    assert response_data["best_score"] == 300
+    assert response_data["judge_count_list"] == [11, 2, 3, 4, 5]